@@ -0,0 +1,261 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+import asyncio
+import logging
+import threading
+
+import metrics
+import protocol
+from outbound import Outbox
+from server import ChatServer
+
+log = logging.getLogger('chat.async_server')
+
+
+class StreamConnection:
+    """
+    Adapta um par (StreamReader, StreamWriter) à interface de socket usada pelo
+    ChatServer (sendall/close), para que handle_action e os demais métodos sejam
+    reaproveitados sem alteração pelo motor asyncio.
+    """
+
+    def __init__(self, reader, writer, loop):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+
+    def sendall(self, data):
+        """
+        Enfileira os dados no transporte. Chamadas feitas fora da thread do loop
+        (ex.: entrega de mensagens offline) são repassadas ao loop e aguardam o
+        buffer do transporte esvaziar, para que remessas grandes não acumulem
+        memória sem limite.
+        """
+        if threading.get_ident() == self.loop_thread:
+            self.writer.write(data)
+        else:
+            asyncio.run_coroutine_threadsafe(self.write_and_drain(data), self.loop).result()
+
+    async def write_and_drain(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def close(self):
+        """Fecha o transporte (idempotente)."""
+        if self.loop.is_closed():
+            return
+        if threading.get_ident() == self.loop_thread:
+            self.writer.close()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class AsyncOutbox(Outbox):
+    """Outbox do motor asyncio: o escritor é uma tarefa no loop da conexão."""
+
+    def start(self):
+        client = self.client
+        self.event = asyncio.Event()
+        self.task = client.loop.create_task(self.run())
+        return self
+
+    def put(self, frame, spill_message=None, block=False, timeout=None, delivery=None):
+        if block and threading.get_ident() == self.client.loop_thread:
+            # A thread do loop não pode esperar pelo escritor, que roda nela mesma:
+            # o frame entra na fila mesmo acima do limite
+            with self.cond:
+                successor = self.successor
+                if successor is None:
+                    if self.closed:
+                        return False
+                    self.enqueue(frame, spill_message, delivery)
+            if successor is not None:
+                return successor.put(frame, spill_message, block, timeout, delivery)
+            self.wake()
+            return True
+        return super().put(frame, spill_message, block, timeout, delivery)
+
+    def wake(self):
+        client = self.client
+        if threading.get_ident() == client.loop_thread:
+            self.event.set()
+        elif not client.loop.is_closed():
+            client.loop.call_soon_threadsafe(self.event.set)
+
+    def abort(self):
+        self.client.close()
+
+    async def run(self):
+        writer = self.client.writer
+        while not (self.closed or self.detached):
+            await self.event.wait()
+            self.event.clear()
+            if self.closed or self.detached:
+                return
+            if self.coalesce_delay:
+                await asyncio.sleep(self.coalesce_delay)
+            frames = self.take()
+            if not frames:
+                continue
+            try:
+                if self.gather:
+                    writer.writelines(frames)  # Uma única escrita no transporte para o lote
+                    writes = 1
+                else:
+                    for frame in frames:
+                        writer.write(frame)
+                    writes = len(frames)
+                await writer.drain()
+            except (ConnectionError, OSError) as e:
+                log.warning("Erro ao enviar dados para %s: %s", self.username, e)
+                self.abort()
+                return
+            self.sent(frames, writes)
+
+
+class AsyncChatServer(ChatServer):
+    """
+    Motor asyncio do servidor de chat: todas as conexões são atendidas por um
+    único loop de eventos, sem uma thread por cliente.
+    """
+
+    def create_outbox(self, client, username, replay=0):
+        """Cria a fila de saída da conexão com um escritor no loop de eventos."""
+        return AsyncOutbox(client, username, self.outbound_limit, self.slow_consumer_policy,
+                           spill=self.spill_to_offline, coalesce_delay=self.coalesce_delay,
+                           gather=self.gather_writes, replay=replay).start()
+
+    def when_stored(self, future, on_stored, on_error):
+        """
+        Como ChatServer.when_stored, sem bloquear o loop: a confirmação é aguardada
+        por uma tarefa, e o loop segue atendendo as demais conexões. Chamado na
+        thread do loop (a partir de handle_action).
+        """
+        asyncio.get_running_loop().create_task(self.await_stored(future, on_stored, on_error))
+
+    async def await_stored(self, future, on_stored, on_error):
+        try:
+            # shield: o timeout não deve cancelar o Future do armazenamento, que ainda será resolvido
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.publish_timeout)
+        except Exception as e:
+            on_error(e)
+            return
+        on_stored()
+
+    def start(self):
+        """Inicia o loop de eventos e aguarda conexões de clientes."""
+        log.info("Servidor (asyncio) iniciado em %s:%s", self.host, self.port)
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            log.error("Erro no servidor: %s", e)
+        finally:
+            self.shutdown()
+
+    async def serve(self):
+        """Registra o socket de escuta no loop e atende conexões indefinidamente."""
+        self.server_socket.setblocking(False)
+        server = await asyncio.start_server(self.on_connection, sock=self.server_socket)
+        log.info("Aguardando conexões...")
+        async with server:
+            await server.serve_forever()
+
+    async def refuse_stream(self, client, reader):
+        """
+        Avisa o cliente que o servidor está cheio e fecha a conexão depois que ele
+        também fechar (ou após admission_timeout), como ChatServer.refuse.
+        """
+        metrics.CONNECTIONS_REFUSED.inc()
+        try:
+            client.writer.write(protocol.encode(protocol.SERVER_FULL))
+            client.writer.write_eof()
+            await asyncio.wait_for(self.discard_input(reader), self.admission_timeout)
+        except (asyncio.TimeoutError, ConnectionError, OSError):
+            pass
+        client.close()
+
+    @staticmethod
+    async def discard_input(reader):
+        """Lê e descarta os dados da conexão até o cliente fechá-la."""
+        while await reader.read(protocol.RECV_SIZE):
+            pass
+
+    async def on_connection(self, reader, writer):
+        """
+        Corrotina executada para cada cliente: registra o usuário e processa
+        suas ações até a desconexão. O loop aceita as conexões por conta própria:
+        o accept_limiter adia o handshake e, sem vaga (max_clients), a conexão é
+        recusada na hora, sem a espera de admission_timeout do motor com threads.
+        """
+        client = StreamConnection(reader, writer, asyncio.get_running_loop())
+        if self.accept_limiter is not None:
+            wait = self.accept_limiter.delay()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.accept_limiter.delay()
+        if not self.connection_slots.acquire(False):
+            await self.refuse_stream(client, reader)
+            return
+        try:
+            await self.serve_connection(client, reader)
+        finally:
+            self.connection_slots.release()
+
+    async def serve_connection(self, client, reader):
+        """Registra o usuário da conexão e processa suas ações até a desconexão."""
+        decoder = protocol.FrameDecoder()
+        pending = []
+        try:
+            while not pending:
+                data = await reader.read(protocol.RECV_SIZE)
+                if not data:
+                    client.close()
+                    return
+                metrics.BYTES_IN.inc(len(data))
+                pending = decoder.feed(data)
+            username, options = protocol.parse_handshake(pending.pop(0))
+            if not await client.loop.run_in_executor(None, self.declare_queue, client, username):
+                return
+            if not self.add_session(client, username, options):
+                return
+        except Exception as e:
+            log.warning("Erro ao registrar cliente: %s", e)
+            client.close()
+            return
+
+        try:
+            while True:
+                for action_data in pending:
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("Ação recebida de %s: %s", self.sessions.username(client), action_data)
+                    self.handle_action(action_data, client)
+                data = await reader.read(protocol.RECV_SIZE)
+                if not data:
+                    break
+                metrics.BYTES_IN.inc(len(data))
+                pending = decoder.feed(data)
+        except Exception as e:
+            log.warning("Erro ao gerenciar cliente %s: %s", self.sessions.username(client), e)
+        finally:
+            self.remove_session(client)
@@ -0,0 +1,102 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Benchmark de publicação de mensagens offline usando o InMemoryBroker com
+latência simulada: um canal compartilhado protegido por lock com confirmação
+por mensagem versus o BrokerPool com lotes confirmados.
+
+Uso:
+    python benchmarks/bench_broker.py --threads 32 --messages 200 --latency 0.001
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broker import BrokerPool, InMemoryBroker  # noqa: E402
+
+
+def run_threads(threads, target):
+    """Executa target(i) em N threads e retorna o tempo total."""
+    workers = [threading.Thread(target=target, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def bench_shared_channel(threads, messages, latency):
+    """Um único canal com confirmação por mensagem, serializado por um lock."""
+    broker = InMemoryBroker(latency)
+    channel = broker.connect().channel()
+    channel.confirm_delivery()
+    lock = threading.Lock()
+
+    def worker(i):
+        for n in range(messages):
+            with lock:
+                channel.basic_publish(exchange='', routing_key=f"user-{i}", body=f"msg {n}")
+
+    return run_threads(threads, worker), broker
+
+
+def bench_pool(threads, messages, latency, batch_size):
+    """BrokerPool: cada worker aguarda a confirmação do lote em que sua mensagem entrou."""
+    broker = InMemoryBroker(latency)
+    pool = BrokerPool(broker.connect, batch_size=batch_size)
+
+    def worker(i):
+        for n in range(messages):
+            pool.publish(f"user-{i}", f"msg {n}").result()
+
+    elapsed = run_threads(threads, worker)
+    pool.close()
+    return elapsed, broker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de publicação no broker")
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--messages', type=int, default=200, help='Mensagens por thread')
+    parser.add_argument('--latency', type=float, default=0.001, help='Ida e volta simulada (s)')
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    total = args.threads * args.messages
+    for name, (elapsed, broker) in (
+        ("canal compartilhado", bench_shared_channel(args.threads, args.messages, args.latency)),
+        ("BrokerPool em lotes", bench_pool(args.threads, args.messages, args.latency, args.batch_size)),
+    ):
+        stored = sum(broker.depth(f"user-{i}") for i in range(args.threads))
+        print(f"{name:<20} {elapsed:8.3f} s  {total / elapsed:10,.0f} msg/s  ({stored} armazenadas)")
+
+
+if __name__ == '__main__':
+    main()
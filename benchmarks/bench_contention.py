@@ -0,0 +1,173 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Teste de estresse de contenção do estado compartilhado do servidor.
+
+Dezenas de threads executam uma carga mista sobre o SessionRegistry e o
+ContactGraph, como os handlers do motor com threads: registrar e remover
+sessões, consultar sessões e status (roteamento de mensagens privadas),
+consultar contatos e seguidores (avisos de presença) e, com menos frequência,
+adicionar e remover contatos. Compara o desenho anterior (um lock global para
+as sessões e leituras de contatos sob lock, com cópia) com as partições e os
+conjuntos copy-on-write, e confere no fim que os índices continuam consistentes.
+
+Uso:
+    python benchmarks/bench_contention.py --threads 64 128 --ops 20000
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contacts import ContactGraph  # noqa: E402
+from sessions import SessionRegistry  # noqa: E402
+
+
+class FakeClient:
+    """Substituto de socket: apenas um objeto hashable por conexão."""
+
+    __slots__ = ('fd',)
+
+    def __init__(self, fd):
+        self.fd = fd
+
+
+class LockedContactGraph(ContactGraph):
+    """Leituras como antes dos conjuntos copy-on-write: sob o lock e copiando o conjunto."""
+
+    def has(self, user, contact):
+        with self.lock:
+            return contact in self.contacts.get(user, ())
+
+    def followers_of(self, contact):
+        with self.lock:
+            return set(self.followers.get(contact, ()))
+
+
+def worker(registry, contacts, usernames, ops, seed, latencies, barrier):
+    """Executa ops operações sorteadas e guarda a latência de cada uma."""
+    rng = random.Random(seed)
+    own = [FakeClient(seed * 1000000 + i) for i in range(8)]
+    owned = {}  # conexão -> nome registrado por esta thread
+    samples = []
+    barrier.wait()
+    for _ in range(ops):
+        choice = rng.random()
+        user = rng.choice(usernames)
+        start = time.perf_counter()
+        if choice < 0.05:
+            client = rng.choice(own)
+            if client in owned:
+                registry.unregister(client)
+                del owned[client]
+            elif registry.register(client, user) is not None:
+                owned[client] = user
+        elif choice < 0.45:
+            if registry.is_online(user):
+                registry.get(user)
+        elif choice < 0.55:
+            registry.username(rng.choice(own))
+        elif choice < 0.75:
+            contacts.has(user, rng.choice(usernames))
+        elif choice < 0.95:
+            for follower in contacts.followers_of(user):
+                registry.is_online(follower)
+        elif choice < 0.975:
+            contacts.add(user, rng.choice(usernames))
+        else:
+            contacts.remove(user, rng.choice(usernames))
+        samples.append(time.perf_counter() - start)
+    for client in owned:
+        registry.unregister(client)
+    latencies.extend(samples)
+
+
+def check(registry, contacts):
+    """Confere que os dois índices de sessões e de contatos descrevem o mesmo estado."""
+    by_username = {}
+    by_client = {}
+    for partition in registry.partitions:
+        by_username.update(partition.by_username)
+        by_client.update(partition.by_client)
+    assert all(by_client[session.client] is session for session in by_username.values()), "sessão sem conexão"
+    assert all(by_username.get(session.username) is session for session in by_client.values()), "conexão órfã"
+    assert all(user in contacts.followers.get(contact, ())
+               for user, user_contacts in contacts.contacts.items() for contact in user_contacts), "seguidor ausente"
+    assert all(user in contacts.contacts.get(follower, ())
+               for user, followers in contacts.followers.items() for follower in followers), "contato ausente"
+    return len(by_username)
+
+
+def run(label, registry, contacts, args, threads):
+    usernames = [f"user-{i}" for i in range(args.users)]
+    rng = random.Random(7)
+    for username in usernames:
+        for contact in rng.sample(usernames, args.contacts):
+            if contact != username:
+                contacts.add(username, contact)
+    for fd, username in enumerate(usernames[:args.users // 2]):
+        registry.register(FakeClient(-fd - 1), username)
+
+    latencies = []
+    barrier = threading.Barrier(threads + 1)
+    pool = [threading.Thread(target=worker, args=(registry, contacts, usernames, args.ops, i + 1, latencies, barrier))
+            for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    sessions = check(registry, contacts)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    total = threads * args.ops
+    print(f"{label:<22} {threads:>4} threads  {total / elapsed:>10,.0f} ops/s  p99 {p99:8.1f} µs"
+          f"  ({sessions} sessões no fim)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estresse de contenção de sessões e contatos")
+    parser.add_argument('--threads', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--ops', type=int, default=20000, help='Operações por thread')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--contacts', type=int, default=20, help='Contatos por usuário')
+    parser.add_argument('--partitions', type=int, default=64)
+    args = parser.parse_args()
+
+    sys.setswitchinterval(0.0005)  # Trocas de thread frequentes expõem a disputa pelos locks
+    for threads in args.threads:
+        run("Lock global", SessionRegistry(partitions=1), LockedContactGraph(), args, threads)
+        run("Particionado + COW", SessionRegistry(partitions=args.partitions), ContactGraph(), args, threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+"""
+Compara os motores threaded e asyncio do servidor: conexões por segundo e
+memória residente (RSS) por conexão aberta.
+
+Uso:
+    python benchmarks/bench_engines.py --connections 2000
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import protocol  # noqa: E402
+
+
+def rss_kib(pid):
+    """Lê o RSS (KiB) de um processo em /proc (somente Linux)."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def wait_for_port(host, port, timeout=30.0):
+    """Aguarda o servidor começar a aceitar conexões."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Servidor não respondeu em {host}:{port}")
+
+
+def open_session(host, port, username):
+    """Abre uma conexão, envia o nome de usuário e aguarda a primeira resposta."""
+    sock = socket.create_connection((host, port))
+    protocol.send_frame(sock, username)
+    if protocol.FrameReader(sock).read() is None:
+        raise RuntimeError(f"Conexão de {username} encerrada pelo servidor")
+    return sock
+
+
+def run_engine(engine, host, port, connections):
+    """Sobe o servidor com o motor indicado e mede as conexões."""
+    data_dir = tempfile.mkdtemp(prefix='bench-engines-')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--host", host, "--port", str(port), "--engine", engine,
+         "--offline-store", "memory", "--data-dir", data_dir],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    sockets = []
+    try:
+        wait_for_port(host, port)
+        time.sleep(0.5)
+        baseline = rss_kib(proc.pid)
+        start = time.perf_counter()
+        for i in range(connections):
+            sockets.append(open_session(host, port, f"{engine}-user-{i}"))
+        elapsed = time.perf_counter() - start
+        time.sleep(0.5)
+        loaded = rss_kib(proc.pid)
+        return {
+            "engine": engine,
+            "connections": connections,
+            "connections_per_sec": connections / elapsed,
+            "rss_per_connection_kib": (loaded - baseline) / connections,
+        }
+    finally:
+        for sock in sockets:
+            sock.close()
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dos motores do servidor de chat")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--engines', nargs='+', default=['threaded', 'asyncio'])
+    args = parser.parse_args()
+
+    print(f"{'motor':<10} {'conexões':>9} {'conn/s':>10} {'KiB/conn':>10}")
+    for offset, engine in enumerate(args.engines):
+        result = run_engine(engine, args.host, args.port + offset, args.connections)
+        print(f"{result['engine']:<10} {result['connections']:>9} "
+              f"{result['connections_per_sec']:>10.1f} {result['rss_per_connection_kib']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Latência de fan-out de canais em função do tamanho da sala.
+
+Para cada tamanho, conecta os membros, cria o canal e publica mensagens uma a
+uma, medindo o tempo até a última cópia chegar a todos os membros online e até
+a confirmação chegar ao remetente (que inclui a gravação em lote das cópias dos
+membros offline).
+
+Uso:
+    python benchmarks/bench_fanout.py --sizes 10 100 500 1000 --posts 50 --offline-fraction 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import protocol  # noqa: E402
+from bench_engines import wait_for_port  # noqa: E402
+
+
+class Member:
+    def __init__(self, name, room):
+        self.name = name
+        self.room = room
+        self.decoder = protocol.FrameDecoder()
+        self.reader = self.writer = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.send(self.name)
+
+    def send(self, obj):
+        self.writer.write(protocol.encode(obj))
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(protocol.RECV_SIZE)
+                if not data:
+                    return
+                for message in self.decoder.feed(data):
+                    if isinstance(message, str):
+                        self.room.on_message(self, message)
+        except ConnectionError:
+            pass
+
+
+class Room:
+    """Uma sala de teste: membros conectados e as mensagens aguardadas."""
+
+    def __init__(self, name):
+        self.name = name
+        self.prefix = f"[{name}] "
+        self.joined = 0
+        self.expected = 0  # Cópias esperadas por mensagem (membros online, exceto o remetente)
+        self.received = {}
+        self.delivered = {}  # mensagem -> Future com o instante da última cópia
+        self.confirmed = {}  # mensagem -> Future com o instante da confirmação ao remetente
+
+    def on_message(self, member, message):
+        if message.startswith(self.prefix):
+            index = int(message.rsplit(': m', 1)[1])
+            self.received[index] = self.received.get(index, 0) + 1
+            if self.received[index] == self.expected:
+                self.delivered[index].set_result(time.perf_counter())
+        elif message.startswith(f"Você em [{self.name}]:"):
+            self.confirmed[int(message.rsplit(': m', 1)[1])].set_result(time.perf_counter())
+        elif message.startswith(("Você entrou no canal", f"Canal {self.name} criado")):
+            self.joined += 1
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def wait_until(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise RuntimeError("Tempo esgotado aguardando o servidor")
+        await asyncio.sleep(0.01)
+
+
+async def measure(host, port, size, posts, offline_fraction):
+    room = Room(f"room-{size}")
+    members = [Member(f"{room.name}-{i}", room) for i in range(size)]
+    for member in members:
+        await member.connect(host, port)
+    readers = [asyncio.create_task(member.read_loop()) for member in members]
+
+    poster = members[0]
+    poster.send({'action': 'create_channel', 'channel': room.name})
+    await wait_until(lambda: room.joined >= 1)
+    for member in members[1:]:
+        member.send({'action': 'join_channel', 'channel': room.name})
+    await wait_until(lambda: room.joined >= size)
+
+    offline = members[1:1 + int((size - 1) * offline_fraction)]
+    for member in offline:
+        member.send({'action': 'status_update', 'status': False})
+    await asyncio.sleep(0.2)
+    room.expected = size - 1 - len(offline)
+
+    loop = asyncio.get_running_loop()
+    delivery, confirmation = [], []
+    for index in range(posts):
+        room.delivered[index] = loop.create_future()
+        room.confirmed[index] = loop.create_future()
+        if room.expected == 0:
+            room.delivered[index].set_result(None)
+        start = time.perf_counter()
+        poster.send({'action': 'post_channel', 'channel': room.name, 'message': f"m{index}"})
+        delivered = await asyncio.wait_for(room.delivered[index], 30)
+        confirmed = await asyncio.wait_for(room.confirmed[index], 30)
+        if delivered is not None:
+            delivery.append(delivered - start)
+        confirmation.append(confirmed - start)
+
+    for member in members:
+        member.writer.close()
+    for task in readers:
+        task.cancel()
+    return delivery, confirmation
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de fan-out de canais")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5060)
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='asyncio')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 1000])
+    parser.add_argument('--posts', type=int, default=50, help='Mensagens publicadas por tamanho de sala')
+    parser.add_argument('--offline-fraction', type=float, default=0.0,
+                        help='Fração dos membros offline (recebem pelo armazenamento offline)')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench-fanout-')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--host", args.host, "--port", str(args.port),
+         "--engine", args.engine, "--offline-store", "memory", "--log-level", "WARNING",
+         "--data-dir", data_dir, "--rate-limit", "*=0", "--rate-limit", "offline=0",
+         "--rate-limit", "post_channel=0"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(args.host, args.port)
+        print(f"{'membros':>8} {'entrega p50':>12} {'entrega p99':>12} {'confirm. p50':>13} {'confirm. p99':>13}  (ms)")
+        for size in args.sizes:
+            delivery, confirmation = asyncio.run(
+                measure(args.host, args.port, size, args.posts, args.offline_fraction))
+            delivered = (f"{percentile(delivery, 0.5) * 1e3:>12.2f} {percentile(delivery, 0.99) * 1e3:>12.2f}"
+                         if delivery else f"{'-':>12} {'-':>12}")
+            print(f"{size:>8} {delivered} {percentile(confirmation, 0.5) * 1e3:>13.2f} "
+                  f"{percentile(confirmation, 0.99) * 1e3:>13.2f}")
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Latência das consultas ao histórico de mensagens conforme ele cresce: últimas
+N mensagens, página antes de um cursor e busca por palavras, medidas em
+pontos de controle até o total de mensagens pedido.
+
+Uso:
+    python benchmarks/bench_history.py --messages 1000000 --conversations 10000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import MessageHistory, private_conversation  # noqa: E402
+
+WORDS = [f"palavra{i}" for i in range(5000)]
+
+
+def timed(function, repeat):
+    """Tempo médio (ms) de function() em repeat execuções."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do histórico de mensagens")
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--conversations', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=200, help='Consultas por medição')
+    parser.add_argument('--memory', action='store_true', help='Histórico só em memória (sem arquivo)')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    users = [f"user{i}" for i in range(args.users)]
+    pairs = [tuple(rng.sample(users, 2)) for _ in range(args.conversations)]
+    data_dir = None if args.memory else tempfile.mkdtemp(prefix='bench-history-')
+    history = MessageHistory(data_dir)
+
+    checkpoints = sorted({min(args.messages, 10 ** k) for k in range(4, 8)} | {args.messages})
+    print(f"{'mensagens':>10} {'gravação µs':>12} {'últimas ms':>11} {'cursor ms':>10} "
+          f"{'busca ms':>9} {'busca 2 termos ms':>18}")
+    stored = 0
+    try:
+        for checkpoint in checkpoints:
+            start = time.perf_counter()
+            for _ in range(checkpoint - stored):
+                sender, target = rng.choice(pairs)
+                text = ' '.join(rng.choice(WORDS) for _ in range(8))
+                history.append(private_conversation(sender, target), sender, text)
+            write_us = (time.perf_counter() - start) / max(1, checkpoint - stored) * 1e6
+            stored = checkpoint
+
+            def last():
+                sender, target = rng.choice(pairs)
+                history.last(private_conversation(sender, target), 50)
+
+            def page():
+                sender, target = rng.choice(pairs)
+                history.before(private_conversation(sender, target), rng.randrange(stored), 50)
+
+            def search(terms):
+                user = rng.choice(users)
+                history.search(history.conversations_of(user), ' '.join(rng.sample(WORDS, terms)), 50)
+
+            print(f"{checkpoint:>10} {write_us:>12.1f} {timed(last, args.queries):>11.3f} "
+                  f"{timed(page, args.queries):>10.3f} {timed(lambda: search(1), args.queries):>9.3f} "
+                  f"{timed(lambda: search(2), args.queries):>18.3f}")
+    finally:
+        history.close()
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Micro-benchmark do RateLimiter: custo por mensagem em função do número de
+usuários. Um relógio simulado avança a cada mensagem (--seconds de tráfego no
+total), então a roda de tempo gira e descarta os baldes ociosos durante a
+medição. O custo deve ficar estável de 1k a 100k usuários, e os baldes em
+memória, limitados aos usuários ativos na janela de reposição.
+
+Uso:
+    python benchmarks/bench_ratelimit.py --users 1000 10000 100000 --messages 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import RateLimiter  # noqa: E402
+
+
+class SimulatedClock:
+    """Relógio que avança step segundos a cada leitura."""
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+def run(users, args):
+    rng = random.Random(42)
+    # Poucos usuários muito ativos e uma cauda longa, como em um chat real
+    senders = [f"user-{int(users * rng.random() ** 3)}" for _ in range(args.messages)]
+    clock = SimulatedClock(args.seconds / args.messages)
+    limiter = RateLimiter(args.rate, args.burst, clock=clock)
+
+    allowed = 0
+    peak = 0
+    start = time.perf_counter()
+    for i, sender in enumerate(senders):
+        if limiter.allow(sender):
+            allowed += 1
+        if i % 10000 == 0:
+            peak = max(peak, len(limiter))
+    elapsed = time.perf_counter() - start
+
+    print(f"{users:>8} usuários: {elapsed / args.messages * 1e9:8.0f} ns/mensagem  "
+          f"{allowed / args.messages:6.1%} aceitas  pico de {peak:,} baldes em memória")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do limitador de taxa por usuário")
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--seconds', type=float, default=600.0, help='Duração simulada do tráfego')
+    parser.add_argument('--rate', type=float, default=1.0, help='Mensagens por segundo por usuário')
+    parser.add_argument('--burst', type=float, default=5.0)
+    args = parser.parse_args()
+
+    for users in args.users:
+        run(users, args)
+
+
+if __name__ == '__main__':
+    main()
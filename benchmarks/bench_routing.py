@@ -0,0 +1,108 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Micro-benchmark do roteamento de mensagens: resolve o socket de destino de
+1M mensagens entre 10k sessões simuladas, comparando o SessionRegistry com a
+busca linear em dicionário usada anteriormente pelo servidor.
+
+Uso:
+    python benchmarks/bench_routing.py --sessions 10000 --messages 1000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sessions import SessionRegistry  # noqa: E402
+
+
+class FakeClient:
+    """Substituto de socket: apenas um objeto hashable por sessão."""
+
+    __slots__ = ('fd',)
+
+    def __init__(self, fd):
+        self.fd = fd
+
+
+def route_registry(registry, targets):
+    """Resolve cada destino via SessionRegistry (O(1) por mensagem)."""
+    delivered = 0
+    for target_user in targets:
+        if registry.is_online(target_user):
+            session = registry.get(target_user)
+            if session.client is not None:
+                delivered += 1
+    return delivered
+
+
+def route_linear(clients, targets):
+    """Resolve cada destino com a busca linear original (O(n) por mensagem)."""
+    delivered = 0
+    for target_user in targets:
+        target_client = next((c for c, u in clients.items() if u == target_user), None)
+        if target_client:
+            delivered += 1
+    return delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de roteamento de mensagens")
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--linear-sample', type=int, default=2000,
+                        help='Mensagens roteadas com a busca linear (o resultado é extrapolado)')
+    args = parser.parse_args()
+
+    registry = SessionRegistry()
+    clients = {}
+    usernames = [f"user-{i}" for i in range(args.sessions)]
+    for fd, username in enumerate(usernames):
+        client = FakeClient(fd)
+        registry.register(client, username)
+        clients[client] = username
+
+    rng = random.Random(42)
+    targets = [rng.choice(usernames) for _ in range(args.messages)]
+
+    start = time.perf_counter()
+    delivered = route_registry(registry, targets)
+    registry_elapsed = time.perf_counter() - start
+
+    sample = targets[:args.linear_sample]
+    start = time.perf_counter()
+    route_linear(clients, sample)
+    linear_elapsed = (time.perf_counter() - start) * len(targets) / len(sample)
+
+    print(f"{args.sessions} sessões, {args.messages} mensagens ({delivered} entregues)")
+    print(f"SessionRegistry: {registry_elapsed:8.3f} s  ({args.messages / registry_elapsed:,.0f} msg/s)")
+    print(f"Busca linear:    {linear_elapsed:8.3f} s  (extrapolado de {len(sample)} mensagens)")
+
+
+if __name__ == '__main__':
+    main()
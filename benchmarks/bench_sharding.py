@@ -0,0 +1,142 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Curva de escalabilidade do modo multiprocesso: vazão de mensagens privadas
+(com confirmação ao remetente) com 1, 2, 4 e 8 shards. Os clientes também rodam
+em vários processos para que o gerador de carga não seja o gargalo.
+
+Uso:
+    python benchmarks/bench_sharding.py --workers 1 2 4 8 --pairs 64 --messages 500
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import protocol  # noqa: E402
+from bench_engines import wait_for_port  # noqa: E402
+
+
+def connect(host, port, username):
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    protocol.send_frame(sock, username)
+    reader = protocol.FrameReader(sock)
+    reader.read()  # Lista de contatos inicial
+    return sock, reader
+
+
+def client_process(host, port, first_pair, pairs, messages, window, start_barrier, results):
+    """Conecta os pares (remetente, destinatário) deste processo e troca mensagens em janelas."""
+    senders, receivers = [], []
+    for i in range(first_pair, first_pair + pairs):
+        senders.append(connect(host, port, f"s{i}"))
+        receivers.append(connect(host, port, f"r{i}"))
+    start_barrier.wait()  # Todos conectados: a presença já foi difundida entre os shards
+    time.sleep(0.5)
+    for i, (sock, reader) in enumerate(senders):
+        protocol.send_frame(sock, {'action': 'add_contact', 'contact': f"r{first_pair + i}"})
+        reader.read()
+        reader.read()
+    start_barrier.wait()
+
+    start = time.perf_counter()
+    sent = 0
+    while sent < messages:
+        burst = min(window, messages - sent)
+        for i, (sock, _) in enumerate(senders):
+            target = f"r{first_pair + i}"
+            sock.sendall(b''.join(
+                protocol.encode({'action': 'send_private_message', 'target_user': target, 'message': f"m{sent + n}"})
+                for n in range(burst)))
+        for (_, sender_reader), (_, receiver_reader) in zip(senders, receivers):
+            for _ in range(burst):
+                sender_reader.read()
+                receiver_reader.read()
+        sent += burst
+    results.put((pairs * messages, time.perf_counter() - start))
+
+
+def run(workers, args):
+    data_dir = tempfile.mkdtemp(prefix='bench-shards-')
+    port = args.port + workers
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "server.py"), "--host", args.host, "--port", str(port),
+         "--workers", str(workers), "--offline-store", "memory", "--data-dir", data_dir,
+         "--outbound-limit", "100000", "--rate-limit", "*=0", "--rate-limit", "offline=0"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(args.host, port)
+        time.sleep(0.5)
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(args.client_procs)
+        results = context.Queue()
+        per_process = args.pairs // args.client_procs
+        clients = [
+            context.Process(target=client_process, args=(args.host, port, p * per_process, per_process,
+                                                         args.messages, args.window, barrier, results))
+            for p in range(args.client_procs)
+        ]
+        for client in clients:
+            client.start()
+        outcomes = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+        total = sum(count for count, _ in outcomes)
+        elapsed = max(seconds for _, seconds in outcomes)
+        return total, elapsed
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de escalabilidade por número de shards")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5600)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--pairs', type=int, default=64, help='Pares remetente/destinatário')
+    parser.add_argument('--messages', type=int, default=500, help='Mensagens por par')
+    parser.add_argument('--window', type=int, default=50, help='Mensagens enviadas antes de aguardar as respostas')
+    parser.add_argument('--client-procs', type=int, default=4, help='Processos geradores de carga')
+    args = parser.parse_args()
+
+    print(f"núcleos disponíveis: {os.cpu_count()}")
+    print(f"{'shards':>6} {'mensagens':>10} {'tempo (s)':>10} {'msg/s':>10}")
+    for workers in args.workers:
+        total, elapsed = run(workers, args)
+        print(f"{workers:>6} {total:>10} {elapsed:>10.2f} {total / elapsed:>10,.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Gerador de carga headless para o servidor de chat.
+
+Simula milhares de usuários em um único loop asyncio falando o protocolo do
+server.py (handshake com o nome de usuário, add_contact, send_private_message e
+status_update), com alternância configurável entre online e offline. Mede a
+vazão, a latência fim a fim (p50/p99/p999) das mensagens entregues online e
+offline, o tempo de drenagem das mensagens offline quando o usuário volta e os
+bytes recebidos (para comparar o custo com e sem --compression).
+
+Cada mensagem carrega o instante de envio e o destinatário ("lg:<ns>:<destino>"),
+então remetente e destinatário não precisam trocar nenhum outro dado.
+
+Uso (com o servidor já em execução):
+    python benchmarks/loadgen.py --port 5000 --users 2000 --duration 30 --json resultado.json
+
+Com --rate acima dos limites do servidor (--rate-limit), as mensagens excedentes
+são recusadas e não chegam aos destinatários; para medir só a vazão, suba o
+servidor com --rate-limit '*=0' --rate-limit offline=0.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol  # noqa: E402
+
+TAG = 'lg:'
+
+
+def percentiles(values, scale=1.0):
+    """p50/p99/p999/max de uma lista de amostras."""
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * scale
+
+    return {'count': len(values), 'p50': pick(0.50), 'p99': pick(0.99), 'p999': pick(0.999),
+            'max': values[-1] * scale}
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.confirmed_online = 0
+        self.stored_offline = 0
+        self.delivered = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.latencies = []  # ns, mensagens entregues online
+        self.offline_latencies = []  # ns, mensagens entregues na drenagem offline
+        self.drain_times = []  # s, do status_update online até a última mensagem offline
+
+
+class SimUser:
+    """Um usuário simulado e sua conexão."""
+
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.reader = self.writer = None
+        self.decoder = protocol.FrameDecoder()
+        self.compress = False
+        self.contacts = []
+        self.online = True
+        self.offline_expected = 0  # Mensagens guardadas offline para este usuário
+        self.offline_received = 0
+        self.drain_started = None
+        self.drain_target = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        compression = self.load.args.compression
+        self.send(protocol.handshake(self.name, compression) if compression else self.name)
+
+    def send(self, obj):
+        self.writer.write(protocol.encode(obj, self.compress))
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(protocol.RECV_SIZE)
+                if not data:
+                    break
+                self.load.stats.bytes_received += len(data)
+                for message in self.decoder.feed(data):
+                    self.handle(message)
+        except (ConnectionError, protocol.ProtocolError):
+            pass
+
+    def handle(self, message):
+        stats = self.load.stats
+        now = time.time_ns()
+        if isinstance(message, list):
+            # Lote de mensagens offline
+            for text in message:
+                sent_ns = parse_sent(text)
+                if sent_ns is not None:
+                    stats.offline_latencies.append(now - sent_ns)
+            self.offline_received += len(message)
+            stats.delivered += len(message)
+            if self.drain_started is not None and self.offline_received >= self.drain_target:
+                stats.drain_times.append(time.perf_counter() - self.drain_started)
+                self.drain_started = None
+        elif isinstance(message, str):
+            if message.startswith('Você para ('):
+                stats.confirmed_online += 1
+            elif message.startswith('Você (privado): '):
+                stats.stored_offline += 1
+                target = parse_target(message)
+                if target in self.load.users:
+                    self.load.users[target].offline_expected += 1
+            elif ' (privado): ' + TAG in message:
+                sent_ns = parse_sent(message)
+                if sent_ns is not None:
+                    stats.latencies.append(now - sent_ns)
+                stats.delivered += 1
+            elif message.startswith('Erro'):
+                stats.errors += 1
+        elif isinstance(message, dict) and message.get('action') == 'welcome':
+            self.compress = message['compression'] is not None
+
+    def set_online(self, online):
+        self.online = online
+        if online:
+            self.drain_target = self.offline_expected
+            self.drain_started = time.perf_counter() if self.drain_target > self.offline_received else None
+        self.send({'action': 'status_update', 'status': online})
+
+
+def parse_sent(text):
+    """Instante de envio (ns) embutido na mensagem, se houver."""
+    start = text.find(TAG)
+    if start < 0:
+        return None
+    try:
+        return int(text[start + len(TAG):].split(':', 1)[0])
+    except ValueError:
+        return None
+
+
+def parse_target(text):
+    start = text.find(TAG)
+    if start < 0:
+        return None
+    parts = text[start + len(TAG):].split(':', 1)
+    return parts[1] if len(parts) == 2 else None
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+        self.users = {}
+        self.rng = random.Random(args.seed)
+        self.running = True
+
+    async def run(self):
+        args = self.args
+        names = [f"{args.prefix}{i}" for i in range(args.users)]
+        self.users = {name: SimUser(name, self) for name in names}
+
+        # Conecta todos (com concorrência limitada) antes de adicionar contatos
+        limit = asyncio.Semaphore(args.connect_concurrency)
+
+        async def connect(user):
+            async with limit:
+                await user.connect(args.host, args.port)
+
+        connect_start = time.perf_counter()
+        await asyncio.gather(*(connect(user) for user in self.users.values()))
+        connect_elapsed = time.perf_counter() - connect_start
+        readers = [asyncio.create_task(user.read_loop()) for user in self.users.values()]
+        await asyncio.sleep(args.settle)
+
+        for user in self.users.values():
+            user.contacts = self.rng.sample([n for n in names if n != user.name], min(args.contacts, len(names) - 1))
+            for contact in user.contacts:
+                user.send({'action': 'add_contact', 'contact': contact})
+        await asyncio.sleep(args.settle)
+
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(self.sender(user)) for user in self.users.values()]
+        if args.churn > 0:
+            tasks.append(asyncio.create_task(self.churn()))
+        await asyncio.sleep(args.duration)
+        self.running = False
+        for task in tasks:
+            task.cancel()
+
+        # Traz todos de volta e espera a drenagem das mensagens offline
+        for user in self.users.values():
+            if not user.online:
+                user.set_online(True)
+        await asyncio.sleep(args.drain_wait)
+        elapsed = time.perf_counter() - start
+
+        for user in self.users.values():
+            user.writer.close()
+        for task in readers:
+            task.cancel()
+        return self.report(elapsed, connect_elapsed)
+
+    async def sender(self, user):
+        rate = self.args.rate
+        while self.running:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if not user.online or not user.contacts:
+                continue
+            target = self.rng.choice(user.contacts)
+            user.send({'action': 'send_private_message', 'target_user': target,
+                       'message': f"{TAG}{time.time_ns()}:{target}"})
+            self.stats.sent += 1
+
+    async def churn(self):
+        """A cada segundo, uma fração dos usuários fica offline por offline_time segundos."""
+        args = self.args
+        users = list(self.users.values())
+        while self.running:
+            await asyncio.sleep(1.0)
+            for user in self.rng.sample(users, max(1, int(len(users) * args.churn))):
+                if user.online:
+                    user.set_online(False)
+                    asyncio.get_running_loop().call_later(args.offline_time, self.come_back, user)
+
+    def come_back(self, user):
+        if self.running and not user.online:
+            user.set_online(True)
+
+    def report(self, elapsed, connect_elapsed):
+        stats = self.stats
+        return {
+            'label': self.args.label,
+            'users': self.args.users,
+            'duration_s': self.args.duration,
+            'connect_s': connect_elapsed,
+            'sent': stats.sent,
+            'confirmed_online': stats.confirmed_online,
+            'stored_offline': stats.stored_offline,
+            'delivered': stats.delivered,
+            'errors': stats.errors,
+            'compression': self.args.compression,
+            'bytes_received': stats.bytes_received,
+            'throughput_msg_s': stats.delivered / elapsed if elapsed else 0.0,
+            'latency_ms': percentiles(stats.latencies, 1e-6),
+            'offline_latency_ms': percentiles(stats.offline_latencies, 1e-6),
+            'offline_drain_s': percentiles(stats.drain_times),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de carga para o servidor de chat")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--contacts', type=int, default=5, help='Contatos por usuário')
+    parser.add_argument('--rate', type=float, default=1.0, help='Mensagens por segundo por usuário')
+    parser.add_argument('--duration', type=float, default=30.0, help='Segundos de carga')
+    parser.add_argument('--churn', type=float, default=0.01,
+                        help='Fração dos usuários que fica offline a cada segundo (0 desativa)')
+    parser.add_argument('--offline-time', type=float, default=5.0, help='Segundos que cada usuário fica offline')
+    parser.add_argument('--drain-wait', type=float, default=5.0,
+                        help='Segundos aguardando entregas pendentes ao final')
+    parser.add_argument('--settle', type=float, default=1.0, help='Pausa após conectar e após adicionar contatos')
+    parser.add_argument('--connect-concurrency', type=int, default=200)
+    parser.add_argument('--prefix', type=str, default='lg', help='Prefixo dos nomes de usuário')
+    parser.add_argument('--label', type=str, default='', help='Identificação da execução (ex.: motor do servidor)')
+    parser.add_argument('--compression', choices=protocol.COMPRESSIONS, default=None,
+                        help='Compressão pedida ao servidor no handshake (padrão: nenhuma)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', type=str, default=None, help="Arquivo de saída JSON ('-' para stdout)")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadGenerator(args).run())
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+        return
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    latency = report['latency_ms']
+    drain = report['offline_drain_s']
+    print(f"{report['users']} usuários, {report['sent']} mensagens enviadas, {report['delivered']} entregues "
+          f"({report['throughput_msg_s']:,.0f} msg/s), {report['bytes_received']:,} bytes recebidos")
+    if latency['count']:
+        print(f"latência online (ms): p50={latency['p50']:.2f} p99={latency['p99']:.2f} p999={latency['p999']:.2f}")
+    if drain['count']:
+        print(f"drenagem offline (s): p50={drain['p50']:.3f} p99={drain['p99']:.3f} max={drain['max']:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Acesso ao broker de mensagens offline.
+
+- BrokerPool: empresta canais exclusivos a cada worker (conexões pika não são
+  thread-safe), publica em lotes confirmados por uma thread dedicada e
+  reconecta com backoff exponencial.
+- InMemoryBroker: substituto do RabbitMQ em memória, com o subconjunto da API
+  do BlockingChannel usado pelo servidor, para testes e benchmarks.
+"""
+
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import pika
+
+import metrics
+
+log = logging.getLogger('chat.broker')
+
+PERSISTENT = pika.BasicProperties(delivery_mode=2)  # Persistência da mensagem
+
+
+class BrokerUnavailable(Exception):
+    """Não foi possível (re)conectar ao broker dentro do número de tentativas."""
+
+
+def rabbitmq_connector(host='localhost'):
+    """Fábrica de conexões bloqueantes com o RabbitMQ."""
+    params = pika.ConnectionParameters(host)
+    return lambda: pika.BlockingConnection(params)
+
+
+def connect_with_backoff(connect, initial_backoff=0.5, max_backoff=30.0, max_attempts=None, stop=None):
+    """
+    Tenta abrir uma conexão até conseguir, dobrando a espera a cada falha
+    (com jitter) até max_backoff. Substitui a recursão de connect_rabbitmq.
+    """
+    delay = initial_backoff
+    for attempt in itertools.count(1):
+        try:
+            return connect()
+        except Exception as e:
+            if max_attempts is not None and attempt >= max_attempts:
+                raise BrokerUnavailable(f"Broker indisponível após {attempt} tentativas: {e}") from e
+            if stop is not None and stop.is_set():
+                raise BrokerUnavailable("Pool encerrado durante a reconexão") from e
+            wait = delay * random.uniform(0.5, 1.0)
+            log.warning("Erro ao conectar ao broker: %s. Tentando novamente em %.1f segundos...", e, wait)
+            time.sleep(wait)
+            delay = min(delay * 2, max_backoff)
+
+
+class BrokerPool:
+    """
+    Pool de canais do broker.
+
+    - channel(): context manager que empresta um canal exclusivo ao chamador.
+    - publish()/publish_many(): enfileiram mensagens para a thread publicadora,
+      que agrupa tudo o que estiver pendente em um único lote e o confirma com
+      tx_commit. Retornam um Future resolvido após a confirmação do broker.
+    """
+
+    def __init__(self, connect, size=8, batch_size=256, initial_backoff=0.5, max_backoff=30.0,
+                 max_publish_attempts=5, max_connect_attempts=5):
+        """
+        - connect: função que abre uma nova conexão (pika ou InMemoryBroker.connect).
+        - size: número máximo de canais emprestados simultaneamente.
+        - batch_size: número máximo de mensagens por lote confirmado.
+        - max_connect_attempts: tentativas de conexão (com backoff) antes de
+          desistir com BrokerUnavailable; com o broker fora do ar, publicações e
+          declarações falham em vez de esperar indefinidamente.
+        """
+        self.connect = connect
+        self.batch_size = batch_size
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_publish_attempts = max_publish_attempts
+        self.max_connect_attempts = max_connect_attempts
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.outbox = queue.Queue()
+        self.closed = threading.Event()
+        self.publisher_connection = None
+        self.publisher_channel = None
+        self.publisher = threading.Thread(target=self.publisher_loop, name="broker-publisher", daemon=True)
+        self.publisher.start()
+
+    def open_channel(self):
+        """Abre uma conexão (com backoff, até max_connect_attempts tentativas) e um canal sobre ela."""
+        connection = connect_with_backoff(self.connect, self.initial_backoff, self.max_backoff,
+                                          self.max_connect_attempts, stop=self.closed)
+        return connection, connection.channel()
+
+    @contextmanager
+    def channel(self):
+        """Empresta um canal exclusivo; canais com erro são descartados em vez de devolvidos."""
+        self.slots.acquire()
+        try:
+            try:
+                connection, channel = self.idle.get_nowait()
+                if connection.is_closed or channel.is_closed:
+                    connection, channel = self.open_channel()
+            except queue.Empty:
+                connection, channel = self.open_channel()
+            try:
+                yield channel
+            except Exception:
+                close_quietly(connection)
+                raise
+            self.idle.put((connection, channel))
+        finally:
+            self.slots.release()
+
+    def declare(self, queue_name):
+        """Declara uma fila durável."""
+        with self.channel() as channel:
+            channel.queue_declare(queue=queue_name, durable=True)
+
+    def drain(self, queue_name, prefetch=500, batch_size=100, idle_timeout=0.05):
+        """
+        Consome a fila em lotes de até batch_size corpos (str), com no máximo
+        prefetch mensagens em trânsito. Cada lote é confirmado com um único ack
+        múltiplo quando o chamador pede o próximo; se o consumo for interrompido
+        (ex.: falha ao entregar ao cliente), as mensagens não confirmadas voltam
+        para a fila. Termina quando a fila fica ociosa por idle_timeout segundos.
+        """
+        with self.channel() as channel:
+            channel.basic_qos(prefetch_count=max(prefetch, batch_size))
+            batch = []
+            last_tag = None
+            completed = False
+            waiting = time.perf_counter()  # Início da espera pelo lote atual
+            try:
+                for method_frame, _, body in channel.consume(queue_name, inactivity_timeout=idle_timeout):
+                    if method_frame is None:
+                        break
+                    batch.append(body.decode())
+                    last_tag = method_frame.delivery_tag
+                    if len(batch) >= batch_size:
+                        metrics.BROKER_GET.observe(time.perf_counter() - waiting)
+                        yield batch
+                        channel.basic_ack(last_tag, multiple=True)
+                        batch = []
+                        waiting = time.perf_counter()
+                if batch:
+                    metrics.BROKER_GET.observe(time.perf_counter() - waiting)
+                    yield batch
+                    channel.basic_ack(last_tag, multiple=True)
+                completed = True
+            finally:
+                channel.cancel()
+                if not completed:
+                    channel.basic_nack(delivery_tag=0, multiple=True, requeue=True)
+
+    def publish(self, queue_name, body):
+        """Publica uma mensagem na fila; retorna um Future confirmado pelo broker."""
+        return self.publish_many([(queue_name, body)])
+
+    def publish_many(self, items):
+        """Publica vários pares (fila, corpo) no mesmo lote confirmado."""
+        future = Future()
+        self.outbox.put((list(items), future))
+        return future
+
+    def publisher_loop(self):
+        """Agrupa as publicações pendentes e as envia em lotes confirmados."""
+        while True:
+            request = self.outbox.get()
+            if request is None:
+                return
+            batch = [request]
+            count = len(request[0])
+            while count < self.batch_size:
+                try:
+                    request = self.outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.outbox.put(None)  # Processa o lote atual e encerra na próxima iteração
+                    break
+                batch.append(request)
+                count += len(request[0])
+            self.flush(batch)
+
+    def flush(self, batch):
+        """Publica e confirma um lote, reconectando e repetindo em caso de falha."""
+        start = time.perf_counter()
+        for attempt in range(1, self.max_publish_attempts + 1):
+            try:
+                if self.publisher_channel is None or self.publisher_connection.is_closed:
+                    self.publisher_connection, self.publisher_channel = self.open_channel()
+                    self.publisher_channel.tx_select()
+                for items, _ in batch:
+                    for queue_name, body in items:
+                        self.publisher_channel.basic_publish(
+                            exchange='', routing_key=queue_name, body=body, properties=PERSISTENT)
+                self.publisher_channel.tx_commit()
+                metrics.BROKER_PUBLISH.observe(time.perf_counter() - start)
+                metrics.BROKER_PUBLISH_MESSAGES.inc(sum(len(items) for items, _ in batch))
+                for _, future in batch:
+                    future.set_result(True)
+                return
+            except BrokerUnavailable as e:
+                # A reconexão já esgotou suas tentativas: repetir só multiplicaria a espera
+                log.error("Erro ao publicar lote no broker: %s", e)
+                break
+            except Exception as e:
+                log.warning("Erro ao publicar lote no broker (tentativa %s): %s", attempt, e)
+                close_quietly(self.publisher_connection)
+                self.publisher_connection = self.publisher_channel = None
+                if self.closed.is_set():
+                    break
+        error = BrokerUnavailable("Não foi possível confirmar o lote de mensagens")
+        for _, future in batch:
+            future.set_exception(error)
+
+    def close(self):
+        """Publica o que estiver pendente e fecha todas as conexões."""
+        self.outbox.put(None)
+        self.publisher.join(timeout=5)
+        self.closed.set()
+        close_quietly(self.publisher_connection)
+        while True:
+            try:
+                connection, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            close_quietly(connection)
+
+
+def close_quietly(connection):
+    """Fecha uma conexão ignorando erros (ela pode já estar quebrada)."""
+    if connection is None:
+        return
+    try:
+        if not connection.is_closed:
+            connection.close()
+    except Exception:
+        pass
+
+
+class InMemoryMethod:
+    """Equivalente ao method frame do basic_get (apenas delivery_tag)."""
+
+    __slots__ = ('delivery_tag',)
+
+    def __init__(self, delivery_tag):
+        self.delivery_tag = delivery_tag
+
+
+class InMemoryChannel:
+    """Canal do InMemoryBroker com a mesma semântica de ack/requeue do AMQP."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+        self.transactional = False
+        self.confirming = False
+        self.uncommitted = []
+        self.unacked = {}  # delivery_tag -> (fila, corpo)
+        self.prefetch_count = 0
+        self.consuming = False
+        self.next_tag = itertools.count(1)
+
+    def queue_declare(self, queue, durable=False):
+        self.broker.round_trip()
+        with self.broker.lock:
+            self.broker.queues.setdefault(queue, deque())
+
+    def confirm_delivery(self):
+        self.confirming = True
+
+    def tx_select(self):
+        self.transactional = True
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if self.transactional:
+            self.uncommitted.append((routing_key, body))
+            return
+        if self.confirming:
+            self.broker.round_trip()
+        self.broker.enqueue([(routing_key, body)])
+
+    def tx_commit(self):
+        self.broker.round_trip()
+        self.broker.enqueue(self.uncommitted)
+        self.uncommitted = []
+
+    def basic_get(self, queue, auto_ack=False):
+        self.broker.round_trip()
+        with self.broker.lock:
+            messages = self.broker.queues.get(queue)
+            if not messages:
+                return None, None, None
+            body = messages.popleft()
+        tag = next(self.next_tag)
+        if not auto_ack:
+            self.unacked[tag] = (queue, body)
+        return InMemoryMethod(tag), None, body
+
+    def basic_qos(self, prefetch_count=0):
+        self.prefetch_count = prefetch_count
+
+    def consume(self, queue, inactivity_timeout=None):
+        """
+        Entrega mensagens respeitando a janela de prefetch; cada reabastecimento
+        da janela custa uma ida e volta. Gera (None, None, None) quando a fila
+        está vazia ou a janela está cheia, como o pika após inactivity_timeout.
+        """
+        self.consuming = True
+        window = deque()
+        try:
+            yield from self.consume_window(queue, window)
+        finally:
+            # Mensagens pré-buscadas e ainda não entregues voltam para a fila
+            self.requeue([(queue, body) for body in window])
+
+    def consume_window(self, queue, window):
+        while self.consuming:
+            if not window:
+                free = self.prefetch_count - len(self.unacked) if self.prefetch_count else 1000
+                if free > 0:
+                    self.broker.round_trip()
+                    with self.broker.lock:
+                        messages = self.broker.queues.get(queue)
+                        while messages and len(window) < free:
+                            window.append(messages.popleft())
+                if not window:
+                    yield None, None, None
+                    continue
+            body = window.popleft()
+            tag = next(self.next_tag)
+            self.unacked[tag] = (queue, body)
+            yield InMemoryMethod(tag), None, body
+
+    def cancel(self):
+        self.consuming = False
+
+    def basic_ack(self, delivery_tag=0, multiple=False):
+        if multiple:
+            for tag in [t for t in self.unacked if delivery_tag == 0 or t <= delivery_tag]:
+                del self.unacked[tag]
+        else:
+            self.unacked.pop(delivery_tag, None)
+
+    def basic_nack(self, delivery_tag=0, multiple=False, requeue=True):
+        """Rejeita mensagens entregues; com requeue elas voltam ao início da fila."""
+        if multiple:
+            tags = [t for t in self.unacked if delivery_tag == 0 or t <= delivery_tag]
+        else:
+            tags = [delivery_tag] if delivery_tag in self.unacked else []
+        rejected = [self.unacked.pop(tag) for tag in tags]
+        if requeue:
+            self.requeue(rejected)
+
+    def requeue(self, deliveries):
+        with self.broker.lock:
+            for queue_name, body in reversed(deliveries):
+                self.broker.queues.setdefault(queue_name, deque()).appendleft(body)
+
+    def close(self):
+        """Devolve ao início das filas as mensagens entregues e não confirmadas."""
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self.requeue(list(self.unacked.values()))
+        self.unacked.clear()
+
+
+class InMemoryConnection:
+    """Conexão do InMemoryBroker; cada chamada a channel() abre um canal novo."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_closed = False
+        self.channels = []
+
+    def channel(self):
+        channel = InMemoryChannel(self.broker)
+        self.channels.append(channel)
+        return channel
+
+    def close(self):
+        self.is_closed = True
+        for channel in self.channels:
+            channel.close()
+
+
+class InMemoryBroker:
+    """
+    Broker em memória compartilhado entre conexões. latency simula o tempo de
+    ida e volta das operações síncronas do AMQP (declare, get, commit, confirm).
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.queues = {}
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return InMemoryConnection(self)
+
+    def round_trip(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def enqueue(self, items):
+        with self.lock:
+            for queue_name, body in items:
+                self.queues.setdefault(queue_name, deque()).append(body)
+
+    def depth(self, queue_name):
+        """Número de mensagens prontas na fila."""
+        with self.lock:
+            return len(self.queues.get(queue_name, ()))
@@ -0,0 +1,78 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Canais (salas de conversa em grupo).
+
+Os membros de cada canal ficam em um ChannelDirectory, que reaproveita o grafo
+persistente de contatos: o canal faz o papel de usuário e seus membros, o de
+contatos, e o índice reverso dá os canais de cada usuário. Um canal existe
+enquanto tiver pelo menos um membro.
+"""
+
+import os
+
+from contacts import EMPTY, ContactGraph
+
+MAX_CHANNEL_NAME = 64
+
+
+def valid_channel_name(channel):
+    return isinstance(channel, str) and 0 < len(channel) <= MAX_CHANNEL_NAME
+
+
+class ChannelDirectory(ContactGraph):
+    """Membros de cada canal, com persistência opcional em data_dir (ver ContactGraph)."""
+
+    def __init__(self, data_dir=None, **kwargs):
+        """Grava channels.snapshot e channels.wal em data_dir (demais parâmetros: ver ContactGraph)."""
+        if data_dir is not None:
+            # Versões anteriores usavam os nomes de arquivo do ContactGraph
+            for suffix in ('snapshot', 'wal'):
+                old = os.path.join(data_dir, f'contacts.{suffix}')
+                new = os.path.join(data_dir, f'channels.{suffix}')
+                if os.path.exists(old) and not os.path.exists(new):
+                    os.replace(old, new)
+        super().__init__(data_dir, name='channels', **kwargs)
+
+    def join(self, channel, user):
+        """Adiciona user ao canal. Retorna False se já era membro."""
+        return self.add(channel, user)
+
+    def leave(self, channel, user):
+        """Remove user do canal. Retorna False se não era membro."""
+        return self.remove(channel, user)
+
+    def exists(self, channel):
+        return channel in self.contacts
+
+    def is_member(self, channel, user):
+        return self.has(channel, user)
+
+    def members(self, channel):
+        """Conjunto imutável dos membros do canal (sem cópia, para o fan-out)."""
+        return self.contacts.get(channel, EMPTY)
+
+    def channels_of(self, user):
+        """Lista ordenada dos canais de que user participa."""
+        return sorted(self.followers_of(user))
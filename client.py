@@ -24,32 +24,213 @@ import tkinter as tk
 from tkinter import simpledialog
 import socket
 import threading
-import pickle
+import queue
 import argparse
+import bisect
+import random
+import time
+from collections import deque
+
+import protocol
+from client_store import ClientCache, HistoryStore, database_path
+
+
+class ChatLog(tk.Frame):
+    """
+    Log de mensagens com janela limitada: o widget Text mantém no máximo
+    capacity linhas, e as linhas recebidas são acumuladas e inseridas de uma vez
+    a cada quadro. Todas as linhas vão para o HistoryStore; ao rolar até o topo
+    (ou de volta ao fim) a janela busca a próxima página do histórico.
+    """
+
+    FRAME_MS = 16  # Intervalo mínimo entre atualizações do widget (~60 por segundo)
+
+    def __init__(self, master, capacity=1000, page_size=200, store=None, **kwargs):
+        """
+        - capacity: número máximo de linhas no widget.
+        - page_size: linhas buscadas no histórico a cada rolagem até a borda.
+        - store: HistoryStore (padrão: somente em memória).
+        - kwargs: opções do widget Text (ex.: width, height).
+        """
+        super().__init__(master)
+        self.capacity = capacity
+        self.page_size = page_size
+        self.store = store if store is not None else HistoryStore()
+        self.newest_id = self.store.last_id()
+        self.ids = deque()  # Ids no histórico das linhas exibidas, na ordem do widget
+        self.pending = []  # Linhas recebidas desde a última atualização do widget
+        self.flush_scheduled = False
+        self.page_scheduled = False
+        self.at_oldest = False  # Já não há linhas mais antigas que a janela no histórico
+
+        self.text = tk.Text(self, state='disabled', **kwargs)
+        self.scrollbar = tk.Scrollbar(self, command=self.text.yview)
+        self.text.config(yscrollcommand=self.on_scroll)
+        self.text.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+
+    def append(self, line):
+        """Acrescenta uma linha; o widget é atualizado no próximo quadro."""
+        self.pending.append(line.replace('\n', ' '))  # Uma entrada do histórico por linha do widget
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.after(self.FRAME_MS, self.flush)
+
+    def flush(self):
+        """Grava as linhas pendentes no histórico e, se a janela estiver no fim, as exibe."""
+        self.flush_scheduled = False
+        lines, self.pending = self.pending, []
+        if not lines:
+            return
+        following = (not self.ids or self.ids[-1] == self.newest_id) and self.text.yview()[1] >= 1.0
+        ids = self.store.append_many(lines)
+        self.newest_id = ids[-1]
+        if not following:
+            return  # O usuário está lendo linhas antigas; as novas são buscadas ao rolar até o fim
+        self.text.config(state='normal')
+        self.text.insert(tk.END, ''.join(line + '\n' for line in lines))
+        self.ids.extend(ids)
+        self.trim_top()
+        self.text.config(state='disabled')
+        self.text.see(tk.END)
+
+    def on_scroll(self, first, last):
+        """Atualiza a barra de rolagem e busca outra página ao chegar a uma das bordas."""
+        self.scrollbar.set(first, last)
+        if self.page_scheduled or not self.ids:
+            return
+        if float(first) <= 0.0 and not self.at_oldest:
+            self.page_scheduled = True
+            self.after_idle(self.page_older)
+        elif float(last) >= 1.0 and self.ids[-1] < self.newest_id:
+            self.page_scheduled = True
+            self.after_idle(self.page_newer)
+
+    def page_older(self):
+        """Insere no topo a página anterior do histórico, descartando linhas do fim."""
+        self.page_scheduled = False
+        rows = self.store.before(self.ids[0], self.page_size)
+        if not rows:
+            self.at_oldest = True
+            return
+        top = self.top_line()
+        self.text.config(state='normal')
+        self.text.insert('1.0', ''.join(line + '\n' for _, line in rows))
+        self.ids.extendleft(line_id for line_id, _ in reversed(rows))
+        excess = len(self.ids) - self.capacity
+        if excess > 0:
+            self.text.delete(f'{self.capacity + 1}.0', 'end-1c')
+            for _ in range(excess):
+                self.ids.pop()
+        self.text.config(state='disabled')
+        self.text.yview(f'{top + len(rows)}.0')  # Mantém visível a linha que estava no topo
+
+    def page_newer(self):
+        """Insere no fim a página seguinte do histórico, descartando linhas do topo."""
+        self.page_scheduled = False
+        rows = self.store.after(self.ids[-1], self.page_size)
+        if not rows:
+            return
+        top = self.top_line()
+        self.text.config(state='normal')
+        self.text.insert(tk.END, ''.join(line + '\n' for _, line in rows))
+        self.ids.extend(line_id for line_id, _ in rows)
+        removed = self.trim_top()
+        self.text.config(state='disabled')
+        self.text.yview(f'{max(top - removed, 1)}.0')
+        self.at_oldest = False
+
+    def trim_top(self):
+        """Remove do topo as linhas além da capacidade; retorna quantas foram removidas."""
+        excess = len(self.ids) - self.capacity
+        if excess <= 0:
+            return 0
+        self.text.delete('1.0', f'{excess + 1}.0')
+        for _ in range(excess):
+            self.ids.popleft()
+        self.at_oldest = False
+        return excess
+
+    def top_line(self):
+        """Número da primeira linha visível no widget."""
+        return int(self.text.index('@0,0').split('.')[0])
+
+    def set_store(self, store):
+        """
+        Troca o histórico (ex.: pelo arquivo do usuário, após o login), levando as
+        linhas já exibidas, e mostra a última página do novo histórico.
+        """
+        previous = self.store
+        store.append_many([line for _, line in previous.after(0, -1)])
+        previous.close()
+        self.store = store
+        self.newest_id = store.last_id()
+        rows = store.before(self.newest_id + 1, self.page_size)
+        self.text.config(state='normal')
+        self.text.delete('1.0', tk.END)
+        self.text.insert(tk.END, ''.join(line + '\n' for _, line in rows))
+        self.text.config(state='disabled')
+        self.text.see(tk.END)
+        self.ids = deque(line_id for line_id, _ in rows)
+        self.at_oldest = False
+
+    def close(self):
+        """Grava as linhas ainda pendentes e fecha o histórico."""
+        if self.pending:
+            self.store.append_many(self.pending)
+            self.pending = []
+        self.store.close()
+
 
 class ChatClient(tk.Tk):
-    def __init__(self, host, port):
+    PRESENCE_COLORS = {'online': 'green', 'offline': 'gray'}  # Cor de cada contato na lista
+    UNKNOWN_PRESENCE_COLOR = 'light gray'  # Presença ainda não recebida do servidor (contatos do cache)
+    RECONNECT_DELAY = 0.5  # Espera antes da primeira tentativa de reconexão, dobrada a cada falha
+    RECONNECT_MAX_DELAY = 30.0
+    FLUSH_BATCH = 20  # Mensagens da fila local enviadas por vez
+    FLUSH_INTERVAL_MS = 1000  # Entre lotes: 20 mensagens/s cabem nos limites padrão do servidor ('offline': 20/s)
+
+    def __init__(self, host, port, data_dir='client-data', compression='zlib'):
         """
         Inicializa o cliente com interface gráfica.
         - host: IP do servidor ao qual o cliente vai se conectar.
         - port: Porta do servidor ao qual o cliente vai se conectar.
+        - data_dir: Diretório do histórico local de cada usuário.
+        - compression: Compressão pedida ao servidor no handshake (None desativa).
         """
         super().__init__()
         self.host = host
         self.port = port
+        self.data_dir = data_dir
+        self.compression = compression
+        self.compress = False  # Passa a True quando o servidor aceita a compressão
         self.username = None
         self.client_socket = None
         self.connected = False
+        self.closing = False  # Janela fechada: não tenta mais reconectar
+        self.token = None  # Token recebido no welcome para retomar a sessão após uma queda
+        self.received = 0  # Frames recebidos na sessão (número de sequência do último)
+        self.awaiting_welcome = False  # O próximo welcome é o desta conexão (os demais são reenvios)
+        self.rejected = False  # Conexão recusada pelo servidor (ex.: nome em uso): não reconecta
+        self.cache = None  # ClientCache do usuário: contatos conhecidos e mensagens na fila
+        self.decoder = protocol.FrameDecoder()  # Remonta frames recebidos em leituras parciais
+        self.incoming = queue.Queue()  # Mensagens decodificadas pela thread leitora, consumidas pela interface
+        self.drain_scheduled = threading.Event()  # Já há um after_idle pendente para esvaziar a fila
+        self.flush_scheduled = False  # Já há um lote da fila local agendado (ver flush_outbox)
         self.current_chat_user = None  # Usuário com quem o cliente está conversando
         self.is_online = True  # Status online/offline do cliente
-        self.contacts = []  # Lista de contatos do cliente
+        self.contacts = []  # Lista de contatos do cliente (ordenada, na mesma ordem do Listbox)
+        self.presence = {}  # Contato -> 'online' ou 'offline'
+        self.roster_version = None  # Versão da lista de contatos recebida do servidor
         self.setup_chat_interface()
 
     def setup_chat_interface(self):
         """
         Configura os elementos da interface gráfica.
         """
-        self.chat_log = tk.Text(self, state='disabled', width=50, height=15)
+        self.chat_log = ChatLog(self, width=50, height=15)
         self.chat_log.grid(row=0, column=0, columnspan=2, sticky="nsew")
 
         self.chat_message = tk.Entry(self, width=50)
@@ -102,6 +283,7 @@ class ChatClient(tk.Tk):
             self.toggle_button.config(text="Ficar Offline")
             self.update_chat_log("Você está online.")
             self.update_server_online_status(True)
+            self.flush_outbox()
         else:
             self.toggle_button.config(text="Ficar Online")
             self.update_chat_log("Você está offline.")
@@ -112,71 +294,222 @@ class ChatClient(tk.Tk):
         if self.connected:
             try:
                 message = {"action": "status_update", "status": status}
-                self.client_socket.send(pickle.dumps(message))
+                protocol.send_frame(self.client_socket, message, self.compress)
             except Exception as e:
                 print(f"Erro ao atualizar status: {e}")
 
     def connect_to_server(self):
-        """Conecta ao servidor de chat."""
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        """
+        Carrega os dados locais do usuário e conecta ao servidor de chat. Se o
+        servidor estiver indisponível, o cliente segue utilizável (mensagens vão
+        para a fila local) enquanto a thread leitora tenta reconectar.
+        """
+        if not self.request_username():
+            return
         try:
-            self.client_socket.connect((self.host, self.port))
+            self.client_socket = socket.create_connection((self.host, self.port))
+            self.awaiting_welcome = True
+            protocol.send_frame(self.client_socket, protocol.handshake(self.username, self.compression))
             self.connected = True
-            self.request_username()
-            self.check_for_incoming_data()
-        except Exception as e:
+        except OSError as e:
             print(f"Erro ao conectar ao servidor: {e}")
+            self.update_chat_log("Servidor indisponível. As mensagens ficarão na fila até a conexão.")
+        threading.Thread(target=self.receive_loop, name='receiver', daemon=True).start()
+
+    def reconnect(self):
+        """
+        Reabre a conexão após uma queda, com espera exponencial (e aleatória, para
+        que vários clientes não voltem juntos) entre as tentativas, e pede a
+        retomada da sessão a partir do último frame recebido. Executa na thread leitora.
+        """
+        delay = self.RECONNECT_DELAY
+        while not self.closing:
+            time.sleep(random.uniform(delay / 2, delay))
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.RECONNECT_MAX_DELAY)
+                sock.settimeout(None)
+                protocol.send_frame(sock, protocol.handshake(self.username, self.compression, self.token,
+                                                             self.received))
+            except OSError as e:
+                print(f"Erro ao reconectar: {e}")
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+                continue
+            self.decoder = protocol.FrameDecoder()
+            self.awaiting_welcome = True
+            self.client_socket = sock
+            self.connected = True
+            return True
+        return False
 
     def request_username(self):
         """
-        Solicita um nome de usuário ao cliente e o envia ao servidor.
+        Solicita um nome de usuário ao cliente e abre seus dados locais: o
+        histórico e os contatos guardados aparecem antes da resposta do servidor.
+        Retorna False se nenhum nome foi informado.
         """
         self.username = simpledialog.askstring("Nome de Usuário", "Digite seu nome de usuário:")
-        if self.username:
-            self.title(f"Perfil do {self.username}")  # Define o título da janela com o nome do cliente
-            self.client_socket.send(pickle.dumps(self.username))
+        if not self.username:
+            return False
+        self.title(f"Perfil do {self.username}")  # Define o título da janela com o nome do cliente
+        path = database_path(self.data_dir, self.username)
+        self.chat_log.set_store(HistoryStore(path))
+        self.cache = ClientCache(path)
+        # Presença desconhecida até o snapshot do servidor
+        self.show_contacts(self.cache.contacts(), {})
+        queued = len(self.cache.pending())
+        if queued:
+            self.update_chat_log(f"{queued} mensagens na fila aguardando envio.")
+        return True
 
-    def check_for_incoming_data(self):
-        """Verifica continuamente se há dados recebidos do servidor."""
-        if self.connected:
-            try:
-                self.client_socket.settimeout(0.1)
-                while True:
-                    try:
-                        data = self.client_socket.recv(4096)
-                        if data:
-                            message = pickle.loads(data)
-
-                            if isinstance(message, list):
-                                # Se for uma lista de mensagens (offline), exibir todas as mensagens
-                                for msg in message:
-                                    self.update_chat_log(f"Mensagem offline: {msg}")
-                            elif isinstance(message, str):
-                                # Exibir a mensagem de erro ou sucesso no chat
-                                self.update_chat_log(message)
-                            elif isinstance(message, dict) and message['action'] == 'update_user_list':
-                                self.update_user_list(message['user_list'])
-                    except socket.timeout:
-                        break
-            except Exception as e:
-                print(f"Erro ao receber dados: {e}")
+    def receive_loop(self):
+        """
+        Thread leitora: bloqueia no recv, decodifica os frames e os repassa à
+        interface pela fila incoming. A thread do Tk é acordada com after_idle
+        uma vez por rajada de mensagens, sem polling. Se a conexão cair, reconecta
+        e continua lendo da nova conexão.
+        """
+        while not self.closing:
+            if self.connected:
+                try:
+                    self.read_frames()
+                except Exception as e:
+                    if self.closing:
+                        return
+                    print(f"Erro ao receber dados: {e}")
                 self.connected = False
-            self.after(100, self.check_for_incoming_data)
+                if self.rejected:
+                    return
+                self.deliver(["Conexão perdida. Reconectando..."])
+            if not self.reconnect():
+                return
+
+    def read_frames(self):
+        """Lê e repassa os frames da conexão atual até ela ser encerrada."""
+        while True:
+            data = self.client_socket.recv(protocol.RECV_SIZE)
+            if not data:
+                raise ConnectionError("Conexão encerrada pelo servidor")
+            messages = [message for message in self.decoder.feed(data) if self.sequence(message)]
+            if messages:
+                self.deliver(messages)
+
+    def sequence(self, message):
+        """
+        Conta o frame recebido (o servidor numera os frames da sessão a partir do
+        welcome) e guarda o token de retomada. Retorna False para frames que a
+        interface deve ignorar, como um welcome antigo reenviado na retomada.
+        """
+        if self.awaiting_welcome and isinstance(message, str) and \
+                message not in (protocol.SERVER_FULL, protocol.SERVER_UNAVAILABLE):
+            self.rejected = True  # Recusado antes do welcome (ex.: nome em uso); servidor cheio: tenta de novo
+        if isinstance(message, dict) and message.get('action') == 'welcome':
+            if not self.awaiting_welcome:
+                self.received += 1
+                return False
+            self.awaiting_welcome = False
+            self.token = message.get('token')
+            if not message.get('resumed'):
+                self.received = 0
+        self.received += 1
+        return True
+
+    def deliver(self, messages):
+        """Repassa mensagens à interface (chamado pela thread leitora)."""
+        for message in messages:
+            self.incoming.put(message)
+        if not self.drain_scheduled.is_set():
+            self.drain_scheduled.set()
+            self.after_idle(self.process_incoming)
+
+    def process_incoming(self):
+        """Exibe todas as mensagens pendentes na fila incoming (executa na thread do Tk)."""
+        self.drain_scheduled.clear()
+        while True:
+            try:
+                message = self.incoming.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(message, list):
+                # Se for uma lista de mensagens (offline), exibir todas as mensagens
+                for msg in message:
+                    self.update_chat_log(f"Mensagem offline: {msg}")
+            elif isinstance(message, str):
+                # Exibir a mensagem de erro ou sucesso no chat
+                self.update_chat_log(message)
+            elif isinstance(message, dict) and message['action'] == 'welcome':
+                self.welcome(message)
+            elif isinstance(message, dict) and message['action'] == 'roster':
+                self.load_roster(message['version'], message['contacts'])
+            elif isinstance(message, dict) and message['action'] == 'roster_delta':
+                self.apply_roster_delta(message['version'], message['changes'])
+
+    def welcome(self, message):
+        """Aplica as opções aceitas pelo servidor no início de cada conexão."""
+        self.compress = self.compression is not None and message.get('compression') == self.compression
+        if message.get('resumed'):
+            self.update_chat_log("Conexão restabelecida.")
+        elif not self.is_online:
+            # Sessão nova após uma queda: o servidor começa com o usuário online
+            self.update_server_online_status(False)
+        self.flush_outbox()
 
     def update_chat_log(self, message):
-        """Atualiza o log de mensagens exibido na interface."""
-        self.chat_log.config(state='normal')
-        self.chat_log.insert(tk.END, message + '\n')
-        self.chat_log.config(state='disabled')
-        self.chat_log.see(tk.END)
-
-    def update_user_list(self, user_list):
-        """Atualiza a lista de contatos exibida na interface."""
-        self.contacts = user_list
+        """Acrescenta uma linha ao log de mensagens (exibida no próximo quadro)."""
+        self.chat_log.append(message)
+
+    def load_roster(self, version, contacts):
+        """Recebe o snapshot da lista de contatos e redesenha o Listbox (uma vez por sessão)."""
+        self.roster_version = version
+        self.show_contacts(sorted(contact for contact, _ in contacts), dict(contacts))
+        self.cache.save_contacts(self.contacts)
+
+    def show_contacts(self, contacts, presence):
+        """Redesenha o Listbox com os contatos (ordenados) e sua presença."""
+        self.contacts = contacts
+        self.presence = presence
         self.user_list.delete(0, tk.END)
-        for user in user_list:
-            if user != self.username:
-                self.user_list.insert(tk.END, user)
+        for index, contact in enumerate(contacts):
+            self.user_list.insert(tk.END, contact)
+            self.user_list.itemconfig(index, foreground=self.PRESENCE_COLORS.get(presence.get(contact), self.UNKNOWN_PRESENCE_COLOR))
+
+    def apply_roster_delta(self, version, changes):
+        """
+        Aplica um delta à lista de contatos alterando só as linhas afetadas. Se
+        uma versão foi perdida, pede um novo snapshot ao servidor.
+        """
+        if self.roster_version is None:
+            return  # Aguardando o snapshot
+        if version != self.roster_version + 1:
+            self.roster_version = None
+            self.send_data_to_server({'action': 'roster_sync'})
+            return
+        self.roster_version = version
+        membership = False
+        for change in changes:
+            op, contact = change[0], change[1]
+            index = bisect.bisect_left(self.contacts, contact)
+            listed = index < len(self.contacts) and self.contacts[index] == contact
+            if op == 'add':
+                if not listed:
+                    self.contacts.insert(index, contact)
+                    self.user_list.insert(index, contact)
+                    membership = True
+                self.set_presence(index, contact, change[2])
+            elif op == 'remove':
+                if listed:
+                    del self.contacts[index]
+                    self.user_list.delete(index)
+                    membership = True
+                self.presence.pop(contact, None)
+            elif listed:
+                self.set_presence(index, contact, op)
+        if membership:
+            self.cache.save_contacts(self.contacts)
+
+    def set_presence(self, index, contact, status):
+        """Atualiza a cor de um contato no Listbox."""
+        self.presence[contact] = status
+        self.user_list.itemconfig(index, foreground=self.PRESENCE_COLORS.get(status, self.UNKNOWN_PRESENCE_COLOR))
 
     def on_user_select(self, event):
         """Lida com a seleção de um usuário na lista de contatos."""
@@ -198,26 +531,67 @@ class ChatClient(tk.Tk):
         """
         Envia a mensagem escrita no campo de entrada para o servidor.
         """
-        if not self.is_online:
-            self.update_chat_log("Você está offline. Não é possível enviar mensagens.")
-            return
-
         message = self.chat_message.get()
         if message and self.current_chat_user:
             formatted_message = {'action': 'send_private_message', 'message': message, 'target_user': self.current_chat_user}
-            self.send_data_to_server(formatted_message)
+            if self.is_online and self.connected:
+                self.send_data_to_server(formatted_message)
+            else:
+                # Offline ou sem conexão: a mensagem espera na fila local (ver flush_outbox)
+                self.cache.enqueue(formatted_message)
+                self.update_chat_log(f"Na fila para ({self.current_chat_user}): {message}")
             self.chat_message.delete(0, tk.END)
 
+    def flush_outbox(self):
+        """
+        Envia as mensagens da fila local em lotes de FLUSH_BATCH (um sendall com os
+        frames do lote), um lote a cada FLUSH_INTERVAL_MS, removendo cada lote da
+        fila depois de enviado. O ritmo mantém a fila dentro dos limites de taxa do
+        servidor, que recusaria o excedente de uma rajada já removida da fila. Só
+        envia com o cliente online e conectado; se ele cair, o restante espera a
+        próxima chamada.
+        """
+        if self.flush_scheduled:
+            return  # O lote agendado continua a partir de onde a fila está
+        self.send_outbox_batch()
+
+    def send_outbox_batch(self):
+        """Envia um lote da fila local e agenda o próximo (executa na thread do Tk)."""
+        self.flush_scheduled = False
+        if self.cache is None or not (self.is_online and self.connected):
+            return
+        pending = self.cache.pending(self.FLUSH_BATCH)
+        if not pending:
+            return
+        try:
+            self.client_socket.sendall(b''.join(protocol.encode(data, self.compress) for _, data in pending))
+        except OSError as e:
+            print(f"Erro ao enviar a fila de mensagens: {e}")
+            return
+        self.cache.remove_through(pending[-1][0])
+        self.update_chat_log(f"{len(pending)} mensagens da fila enviadas.")
+        if len(pending) == self.FLUSH_BATCH:
+            self.flush_scheduled = True
+            self.after(self.FLUSH_INTERVAL_MS, self.send_outbox_batch)
+
     def send_data_to_server(self, data):
         """Envia dados para o servidor."""
         try:
-            self.client_socket.send(pickle.dumps(data))
+            protocol.send_frame(self.client_socket, data, self.compress)
         except Exception as e:
             print(f"Erro ao enviar dados: {e}")
 
     def run(self):
         """Executa a interface gráfica."""
-        self.mainloop()
+        try:
+            self.mainloop()
+        finally:
+            self.closing = True
+            if self.client_socket is not None:
+                self.client_socket.close()
+            self.chat_log.close()
+            if self.cache is not None:
+                self.cache.close()
 
 
 if __name__ == "__main__":
@@ -225,8 +599,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Cliente de Chat")
     parser.add_argument('--host', type=str, required=True, help='IP do servidor de chat')
     parser.add_argument('--port', type=int, required=True, help='Porta do servidor de chat')
+    parser.add_argument('--data-dir', type=str, default='client-data',
+                        help='Diretório do histórico local (padrão: client-data)')
+    parser.add_argument('--compression', choices=[*protocol.COMPRESSIONS, 'off'], default='zlib',
+                        help='Compressão pedida ao servidor (padrão: zlib)')
     args = parser.parse_args()
 
-    client = ChatClient(host=args.host, port=args.port)
+    compression = None if args.compression == 'off' else args.compression
+    client = ChatClient(host=args.host, port=args.port, data_dir=args.data_dir, compression=compression)
     client.connect_to_server()
     client.run()
@@ -0,0 +1,129 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Armazenamento local do cliente.
+
+HistoryStore guarda todas as linhas exibidas no chat em um banco SQLite, para
+que a interface mantenha apenas uma janela limitada de linhas na memória e
+busque as mais antigas (ou mais novas) sob demanda, à medida que o usuário rola.
+
+ClientCache, no mesmo arquivo, guarda a última lista de contatos recebida (para
+exibi-la ao abrir o cliente, antes da resposta do servidor) e a fila de saída
+das mensagens escritas enquanto o cliente está offline.
+"""
+
+import json
+import os
+import sqlite3
+
+
+def database_path(data_dir, username):
+    """Arquivo do banco local de um usuário (nome em hexadecimal, seguro para o sistema de arquivos)."""
+    return os.path.join(data_dir, username.encode('utf-8').hex() + '.sqlite3')
+
+
+class HistoryStore:
+    """Histórico de linhas do chat, numeradas em ordem crescente."""
+
+    def __init__(self, path=None):
+        """- path: arquivo SQLite; None mantém o histórico só em memória."""
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path or ':memory:')
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY, line TEXT NOT NULL)')
+        self.db.commit()
+
+    def append_many(self, lines):
+        """Grava as linhas em uma única transação e retorna seus ids, em ordem."""
+        with self.db:
+            cursor = self.db.cursor()
+            ids = []
+            for line in lines:
+                cursor.execute('INSERT INTO history (line) VALUES (?)', (line,))
+                ids.append(cursor.lastrowid)
+            return ids
+
+    def last_id(self):
+        """Id da linha mais recente (0 se o histórico estiver vazio)."""
+        return self.db.execute('SELECT COALESCE(MAX(id), 0) FROM history').fetchone()[0]
+
+    def before(self, line_id, limit):
+        """Até limit linhas anteriores a line_id, da mais antiga para a mais nova."""
+        rows = self.db.execute('SELECT id, line FROM history WHERE id < ? ORDER BY id DESC LIMIT ?',
+                               (line_id, limit)).fetchall()
+        rows.reverse()
+        return rows
+
+    def after(self, line_id, limit):
+        """Até limit linhas posteriores a line_id, da mais antiga para a mais nova."""
+        return self.db.execute('SELECT id, line FROM history WHERE id > ? ORDER BY id LIMIT ?',
+                               (line_id, limit)).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+class ClientCache:
+    """Contatos conhecidos e fila de saída local, persistidos em SQLite (WAL)."""
+
+    def __init__(self, path=None):
+        """- path: arquivo SQLite (pode ser o mesmo do HistoryStore); None mantém tudo em memória."""
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path or ':memory:')
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS contacts (contact TEXT PRIMARY KEY)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, payload TEXT NOT NULL)')
+        self.db.commit()
+
+    def contacts(self):
+        """Contatos guardados, em ordem alfabética."""
+        return [row[0] for row in self.db.execute('SELECT contact FROM contacts ORDER BY contact')]
+
+    def save_contacts(self, contacts):
+        """Substitui a lista de contatos guardada em uma única transação."""
+        with self.db:
+            self.db.execute('DELETE FROM contacts')
+            self.db.executemany('INSERT INTO contacts (contact) VALUES (?)', ((contact,) for contact in contacts))
+
+    def enqueue(self, data):
+        """Guarda uma ação (ex.: send_private_message) para envio quando o cliente voltar online."""
+        with self.db:
+            self.db.execute('INSERT INTO outbox (payload) VALUES (?)', (json.dumps(data, ensure_ascii=False),))
+
+    def pending(self, limit=-1):
+        """Até limit ações da fila de saída (padrão: todas), em ordem de chegada: lista de (id, ação)."""
+        return [(row_id, json.loads(payload))
+                for row_id, payload in self.db.execute('SELECT id, payload FROM outbox ORDER BY id LIMIT ?', (limit,))]
+
+    def remove_through(self, row_id):
+        """Remove da fila as ações até row_id (já enviadas)."""
+        with self.db:
+            self.db.execute('DELETE FROM outbox WHERE id <= ?', (row_id,))
+
+    def close(self):
+        self.db.close()
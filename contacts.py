@@ -0,0 +1,212 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Grafo de contatos persistente.
+
+Cada usuário tem um conjunto de contatos (consulta O(1)) e um índice reverso
+com quem o tem como contato. Alterações são gravadas em um write-ahead log
+(uma operação JSON por linha) e compactadas periodicamente em um snapshot;
+na inicialização o snapshot é carregado e o log é reaplicado por cima.
+
+Os conjuntos são imutáveis (frozenset) e copiados a cada escrita: leituras,
+muito mais frequentes (cada mensagem privada, aviso de presença ou fan-out de
+canal), não usam lock e sempre enxergam um conjunto completo. Só as escritas,
+que também gravam o log em ordem, passam pelo lock.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import metrics
+
+log = logging.getLogger('chat.contacts')
+
+EMPTY = frozenset()
+
+
+class ContactGraph:
+    """Contatos de cada usuário, com índice reverso e persistência opcional em data_dir."""
+
+    def __init__(self, data_dir=None, snapshot_every=10000, snapshot_interval=60.0, fsync=False, name='contacts'):
+        """
+        - data_dir: diretório do snapshot e do log; None mantém o grafo só em memória.
+        - snapshot_every: número de operações no log que dispara uma compactação.
+        - snapshot_interval: segundos entre compactações periódicas (se houver alterações).
+        - fsync: força a gravação em disco de cada operação do log.
+        - name: prefixo dos arquivos (<name>.snapshot e <name>.wal), do lock e da thread de compactação.
+        """
+        self.contacts = {}  # usuário -> frozenset de contatos
+        self.followers = {}  # contato -> frozenset de usuários que o têm como contato
+        self.lock = metrics.InstrumentedLock(name)  # Serializa as escritas (leituras não usam lock)
+        self.data_dir = data_dir
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.wal = None
+        self.wal_entries = 0
+        self.closed = threading.Event()
+        if data_dir is None:
+            return
+
+        os.makedirs(data_dir, exist_ok=True)
+        self.snapshot_path = os.path.join(data_dir, f'{name}.snapshot')
+        self.wal_path = os.path.join(data_dir, f'{name}.wal')
+        self.load()
+        self.wal = open(self.wal_path, 'a', encoding='utf-8')
+        threading.Thread(target=self.snapshot_loop, args=(snapshot_interval,),
+                         name=f"{name}-snapshot", daemon=True).start()
+
+    def load(self):
+        """Carrega o snapshot e reaplica as operações do log (em conjuntos mutáveis, congelados no fim)."""
+        contacts = {}
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                for user, user_contacts in json.load(f).items():
+                    contacts[user] = set(user_contacts)
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.wal_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        op, user, contact = json.loads(line)
+                    except ValueError:
+                        break  # Última linha incompleta (queda durante a gravação)
+                    if op == '+':
+                        contacts.setdefault(user, set()).add(contact)
+                    else:
+                        contacts.get(user, set()).discard(contact)
+                    self.wal_entries += 1
+        except FileNotFoundError:
+            pass
+        followers = {}
+        for user, user_contacts in contacts.items():
+            for contact in user_contacts:
+                followers.setdefault(contact, set()).add(user)
+        self.contacts = {user: frozenset(c) for user, c in contacts.items() if c}
+        self.followers = {contact: frozenset(f) for contact, f in followers.items()}
+
+    def link(self, user, contact):
+        """Aplica a inclusão trocando os dois conjuntos por cópias (chamado com o lock adquirido)."""
+        contacts = self.contacts.get(user, EMPTY)
+        if contact in contacts:
+            return False
+        self.contacts[user] = contacts | {contact}
+        self.followers[contact] = self.followers.get(contact, EMPTY) | {user}
+        return True
+
+    def unlink(self, user, contact):
+        """Aplica a remoção trocando os dois conjuntos por cópias (chamado com o lock adquirido)."""
+        contacts = self.contacts.get(user, EMPTY)
+        if contact not in contacts:
+            return False
+        replace(self.contacts, user, contacts - {contact})
+        replace(self.followers, contact, self.followers.get(contact, EMPTY) - {user})
+        return True
+
+    def log(self, op, user, contact):
+        """Grava a operação no log (chamado com o lock adquirido)."""
+        if self.wal is None:
+            return
+        self.wal.write(json.dumps([op, user, contact], ensure_ascii=False) + '\n')
+        self.wal.flush()
+        if self.fsync:
+            os.fsync(self.wal.fileno())
+        self.wal_entries += 1
+        if self.wal_entries >= self.snapshot_every:
+            self.write_snapshot()
+
+    def add(self, user, contact):
+        """Adiciona contact aos contatos de user. Retorna False se já estava."""
+        with self.lock:
+            changed = self.link(user, contact)
+            if changed:
+                self.log('+', user, contact)
+            return changed
+
+    def remove(self, user, contact):
+        """Remove contact dos contatos de user. Retorna False se não estava."""
+        with self.lock:
+            changed = self.unlink(user, contact)
+            if changed:
+                self.log('-', user, contact)
+            return changed
+
+    def has(self, user, contact):
+        """True se contact estiver nos contatos de user."""
+        return contact in self.contacts.get(user, EMPTY)
+
+    def contacts_of(self, user):
+        """Lista ordenada dos contatos de user."""
+        return sorted(self.contacts.get(user, EMPTY))
+
+    def followers_of(self, contact):
+        """Conjunto imutável dos usuários que têm contact como contato."""
+        return self.followers.get(contact, EMPTY)
+
+    def write_snapshot(self):
+        """Compacta o estado em um snapshot e zera o log (chamado com o lock adquirido)."""
+        state = {user: sorted(contacts) for user, contacts in self.contacts.items()}
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Reaplicar o log antigo sobre o snapshot seria inofensivo (operações idempotentes),
+        # então uma queda entre o replace e o truncate não corrompe o estado.
+        self.wal.close()
+        self.wal = open(self.wal_path, 'w', encoding='utf-8')
+        self.wal_entries = 0
+
+    def snapshot(self):
+        """Compacta o log em um novo snapshot, se houver alterações pendentes."""
+        with self.lock:
+            if self.wal is not None and self.wal_entries:
+                self.write_snapshot()
+
+    def snapshot_loop(self, interval):
+        while not self.closed.wait(interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                log.error("Erro ao gravar snapshot de contatos: %s", e)
+
+    def close(self):
+        """Grava um snapshot final e fecha o log."""
+        self.closed.set()
+        self.snapshot()
+        with self.lock:
+            if self.wal is not None:
+                self.wal.close()
+                self.wal = None
+
+
+def replace(index, key, value):
+    """Guarda o novo conjunto de key no índice, removendo a chave se ele ficou vazio."""
+    if value:
+        index[key] = value
+    else:
+        index.pop(key, None)
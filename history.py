@@ -0,0 +1,233 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Histórico de mensagens do servidor.
+
+Toda mensagem entregue (ou guardada offline) é acrescentada a um log
+append-only, uma linha JSON por mensagem, identificada por um id sequencial.
+Na memória ficam apenas índices compactos (array de inteiros):
+
+- posição e tamanho de cada registro no arquivo, indexados pelo id;
+- para cada conversa, os ids das suas mensagens, em ordem crescente, o que
+  torna "últimas N" um recorte e "antes do cursor" uma busca binária;
+- um índice invertido termo -> conversa -> ids, para a busca por palavras.
+
+O conteúdo é lido do arquivo (os.pread) só para as mensagens retornadas, então
+o custo de uma consulta não cresce com o total armazenado. Na inicialização o
+log é relido para reconstruir os índices.
+"""
+
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from array import array
+
+MAX_LIMIT = 200  # Mensagens por consulta
+WORD = re.compile(r'\w+')
+
+
+def private_conversation(user, other):
+    """Chave da conversa privada entre dois usuários (independe da ordem)."""
+    first, second = sorted((user, other))
+    return json.dumps(['private', first, second], ensure_ascii=False)
+
+
+def channel_conversation(channel):
+    return json.dumps(['channel', channel], ensure_ascii=False)
+
+
+def describe_conversation(conversation, user):
+    """A conversa vista por user: {'channel': canal} ou {'with': o outro participante}."""
+    kind, *names = json.loads(conversation)
+    if kind == 'channel':
+        return {'channel': names[0]}
+    return {'with': next((name for name in names if name != user), user)}
+
+
+def terms(text):
+    """Termos indexados de um texto: palavras em minúsculas com 2 ou mais caracteres."""
+    return {word for word in WORD.findall(text.lower()) if len(word) > 1}
+
+
+class MessageHistory:
+    """Histórico append-only com índices por conversa e por termo; persistido em data_dir se informado."""
+
+    def __init__(self, data_dir=None, fsync=False):
+        """
+        - data_dir: diretório do log; None mantém o histórico só em memória.
+        - fsync: força a gravação em disco de cada mensagem.
+        """
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.offsets = array('q')  # id -> posição do registro no arquivo
+        self.lengths = array('i')  # id -> tamanho do registro
+        self.conversations = {}  # conversa -> array de ids
+        self.participants = {}  # usuário -> conjunto de conversas privadas
+        self.index = {}  # termo -> {conversa: array de ids}
+        self.records = None  # Registros em memória quando não há data_dir
+        self.last_timestamp = 0.0
+        self.file = None
+        if data_dir is None:
+            self.records = []
+            return
+
+        os.makedirs(data_dir, exist_ok=True)
+        path = os.path.join(data_dir, 'history.log')
+        self.load(path)
+        self.file = open(path, 'ab')
+        self.file.truncate(self.offsets[-1] + self.lengths[-1] if self.offsets else 0)  # Descarta linha incompleta
+        self.reader = os.open(path, os.O_RDONLY)
+
+    def load(self, path):
+        """Reconstrói os índices a partir do log."""
+        try:
+            with open(path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    try:
+                        message_id, timestamp, conversation, sender, text = json.loads(line)
+                    except ValueError:
+                        break  # Última linha incompleta (queda durante a gravação)
+                    if not line.endswith(b'\n') or message_id != len(self.offsets):
+                        break
+                    self.add_to_index(offset, len(line), timestamp, conversation, sender, text)
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+
+    def add_to_index(self, offset, length, timestamp, conversation, sender, text):
+        """Registra uma mensagem nos índices (chamado com o lock adquirido); retorna o id."""
+        message_id = len(self.offsets)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        ids = self.conversations.get(conversation)
+        if ids is None:
+            ids = self.conversations[conversation] = array('q')
+            kind, *names = json.loads(conversation)
+            if kind == 'private':
+                for name in names:
+                    self.participants.setdefault(name, set()).add(conversation)
+        ids.append(message_id)
+        for term in terms(text):
+            postings = self.index.setdefault(term, {})
+            posting = postings.get(conversation)
+            if posting is None:
+                posting = postings[conversation] = array('q')
+            posting.append(message_id)
+        self.last_timestamp = timestamp
+        return message_id
+
+    def append(self, conversation, sender, text):
+        """Acrescenta uma mensagem à conversa e retorna seu id."""
+        with self.lock:
+            message_id = len(self.offsets)
+            timestamp = max(time.time(), self.last_timestamp)  # Não retrocede se o relógio for ajustado
+            line = json.dumps([message_id, timestamp, conversation, sender, text], ensure_ascii=False,
+                              separators=(',', ':')).encode('utf-8') + b'\n'
+            if self.file is None:
+                offset = len(self.records)
+                self.records.append(line)
+            else:
+                offset = self.offsets[-1] + self.lengths[-1] if self.offsets else 0
+                self.file.write(line)
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            return self.add_to_index(offset, len(line), timestamp, conversation, sender, text)
+
+    def read(self, message_ids):
+        """Registros [id, timestamp, remetente, texto] das mensagens indicadas."""
+        with self.lock:
+            locations = [(self.offsets[i], self.lengths[i]) for i in message_ids]
+        messages = []
+        for offset, length in locations:
+            line = self.records[offset] if self.file is None else os.pread(self.reader, length, offset)
+            message_id, timestamp, _, sender, text = json.loads(line)
+            messages.append([message_id, timestamp, sender, text])
+        return messages
+
+    def last(self, conversation, limit):
+        """As últimas limit mensagens da conversa, da mais antiga para a mais nova."""
+        return self.before(conversation, None, limit)
+
+    def before(self, conversation, cursor, limit):
+        """Até limit mensagens com id menor que cursor (None: as mais recentes), em ordem crescente."""
+        limit = max(1, min(limit, MAX_LIMIT))
+        with self.lock:
+            ids = self.conversations.get(conversation)
+            if not ids:
+                return []
+            end = len(ids) if cursor is None else bisect.bisect_left(ids, cursor)
+            selected = ids[max(0, end - limit):end]
+        return self.read(selected)
+
+    def conversations_of(self, user):
+        """Conversas privadas de que o usuário participa."""
+        with self.lock:
+            return set(self.participants.get(user, ()))
+
+    def search(self, conversations, query, limit):
+        """
+        Mensagens das conversas indicadas que contêm todos os termos da busca,
+        da mais recente para a mais antiga. Retorna [id, timestamp, remetente, texto, conversa].
+        """
+        limit = max(1, min(limit, MAX_LIMIT))
+        wanted = terms(query)
+        if not wanted:
+            return []
+        matches = []
+        with self.lock:
+            postings = [self.index.get(term, {}) for term in wanted]
+            for conversation in conversations:
+                lists = [posting.get(conversation) for posting in postings]
+                if not all(lists):
+                    continue
+                lists.sort(key=len)
+                # Percorre a lista mais curta do fim para o início, testando os demais termos por busca binária
+                found = 0
+                for message_id in reversed(lists[0]):
+                    if all(contains(other, message_id) for other in lists[1:]):
+                        matches.append((message_id, conversation))
+                        found += 1
+                        if found >= limit:
+                            break
+        matches.sort(reverse=True)
+        matches = matches[:limit]
+        records = self.read([message_id for message_id, _ in matches])
+        return [record + [conversation] for record, (_, conversation) in zip(records, matches)]
+
+    def close(self):
+        with self.lock:
+            if self.file is not None and not self.file.closed:
+                self.file.close()
+                os.close(self.reader)
+
+
+def contains(ids, message_id):
+    """True se message_id estiver no array ordenado ids."""
+    index = bisect.bisect_left(ids, message_id)
+    return index < len(ids) and ids[index] == message_id
@@ -0,0 +1,118 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Logging assíncrono do servidor.
+
+As threads de atendimento só colocam o LogRecord em uma fila limitada
+(QueueHandler); a formatação e a escrita acontecem em uma thread própria
+(QueueListener). Se a fila encher, o registro é descartado em vez de bloquear
+quem atende o cliente. Registros de nível DEBUG (ex.: cada ação recebida) podem
+ser amostrados: apenas 1 a cada debug_sample chega à fila.
+"""
+
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+
+import metrics
+
+FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+LOG_DROPPED = metrics.REGISTRY.counter('chat_log_records_dropped_total',
+                                       'Registros de log descartados (fila cheia ou amostragem)')
+
+listener = None
+
+
+class SamplingFilter(logging.Filter):
+    """Deixa passar 1 a cada `every` registros de nível menor ou igual a max_level."""
+
+    def __init__(self, every, max_level=logging.DEBUG):
+        super().__init__()
+        self.every = every
+        self.max_level = max_level
+        self.counter = itertools.count()
+
+    def filter(self, record):
+        if record.levelno > self.max_level or next(self.counter) % self.every == 0:
+            return True
+        LOG_DROPPED.inc(reason='sampled')
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que não formata na thread de origem e descarta quando a fila enche."""
+
+    def prepare(self, record):
+        # Mesmo processo: o registro vai intacto e é formatado pela thread do listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(reason='full')
+
+
+def setup_logging(level='INFO', debug_sample=1, queue_size=10000, stream=None):
+    """
+    Configura o logger raiz com a fila e inicia a thread de escrita. Pode ser
+    chamada de novo (ex.: em um processo filho após o fork), substituindo a anterior.
+    - level: nível mínimo ('DEBUG', 'INFO', ...).
+    - debug_sample: registra 1 a cada debug_sample registros DEBUG.
+    - queue_size: registros pendentes antes de começar a descartar.
+    """
+    global listener
+    if listener is not None:
+        try:
+            listener.stop()
+        except Exception:
+            pass  # Após o fork, a thread do listener anterior não existe no filho
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(FORMAT))
+    records = queue.Queue(queue_size)
+    handler = NonBlockingQueueHandler(records)
+    if debug_sample > 1:
+        handler.addFilter(SamplingFilter(debug_sample))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def shutdown_logging():
+    """Escreve os registros pendentes e encerra a thread de escrita."""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
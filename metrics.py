@@ -0,0 +1,304 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Métricas do servidor no formato texto do Prometheus.
+
+Contadores, gauges e histogramas de buckets fixos, com rótulos opcionais. A
+atualização custa um lock curto por métrica e, nos histogramas, uma busca
+binária nos buckets; a formatação só acontece quando o endpoint é lido.
+Gauges podem ser calculados no momento da leitura (ex.: sessões ativas).
+
+    python server.py --port 5000 --metrics-port 9100
+    curl http://127.0.0.1:9100/metrics
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Buckets de latência em segundos (100 µs a 10 s)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """Valor monotônico, um por combinação de rótulos."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(label_key(labels), 0)
+
+    def collect(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{format_labels(key)} {format_value(value)}" for key, value in values]
+
+
+class Gauge(Metric):
+    """
+    Valor instantâneo. Com function, o valor é calculado na leitura; a função
+    retorna um número ou um dicionário {tupla de pares (rótulo, valor): número}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        super().__init__(name, help)
+        self.values = {}
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        if self.function is not None:
+            result = self.function()
+            values = result.items() if isinstance(result, dict) else [((), result)]
+        else:
+            with self.lock:
+                values = list(self.values.items())
+        return [f"{self.name}{format_labels(key)} {format_value(value)}" for key, value in values]
+
+
+class Histogram(Metric):
+    """Distribuição em buckets cumulativos fixos (padrão: LATENCY_BUCKETS, em segundos)."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.series = {}  # rótulos -> [contagens por bucket (+Inf no fim), soma, total]
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Mede a duração do bloco with."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self.series.get(label_key(labels))
+        return series[2] if series else 0
+
+    def collect(self):
+        with self.lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+        lines = []
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                lines.append(f"{self.name}_bucket{format_labels(key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas de um processo; cada nome é registrado uma vez."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Métrica {metric.name} já registrada com outro tipo")
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help, function=None):
+        gauge = self.register(Gauge(name, help))
+        if function is not None:
+            gauge.function = function  # O servidor mais recente substitui a função anterior
+        return gauge
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        """Todas as métricas no formato texto do Prometheus."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Métricas compartilhadas pelos módulos do servidor
+ACTION_LATENCY = REGISTRY.histogram('chat_action_seconds', 'Tempo de processamento de cada ação do cliente')
+ACTION_ERRORS = REGISTRY.counter('chat_action_errors_total', 'Ações que terminaram com exceção')
+LOCK_WAIT = REGISTRY.histogram('chat_lock_wait_seconds', 'Tempo de espera pelos locks do servidor que estavam ocupados')
+BROKER_PUBLISH = REGISTRY.histogram('chat_broker_publish_seconds', 'Publicação e confirmação de um lote no broker')
+BROKER_PUBLISH_MESSAGES = REGISTRY.counter('chat_broker_published_messages_total',
+                                           'Mensagens confirmadas pelo broker')
+BROKER_GET = REGISTRY.histogram('chat_broker_get_seconds', 'Espera por um lote de mensagens consumidas do broker')
+BYTES_IN = REGISTRY.counter('chat_bytes_received_total', 'Bytes recebidos dos clientes')
+BYTES_OUT = REGISTRY.counter('chat_bytes_sent_total', 'Bytes enviados aos clientes')
+SESSIONS_RESUMED = REGISTRY.counter('chat_sessions_resumed_total', 'Sessões retomadas após a queda da conexão')
+SESSIONS_EXPIRED = REGISTRY.counter('chat_sessions_expired_total',
+                                    'Sessões encerradas por não serem retomadas dentro da janela de reconexão')
+CONNECTIONS_REFUSED = REGISTRY.counter('chat_connections_refused_total',
+                                      'Conexões recusadas por falta de vaga (limite de clientes)')
+RATE_LIMITED = REGISTRY.counter('chat_rate_limited_total', 'Ações recusadas pelo limite de taxa')
+
+
+class InstrumentedLock:
+    """
+    Lock que registra em LOCK_WAIT o tempo de espera das aquisições disputadas.
+    Aquisições com o lock livre não são medidas: assim o próprio histograma
+    (que tem um lock) não vira um ponto de contenção compartilhado por todos.
+    """
+
+    def __init__(self, name, lock=None):
+        self.name = name
+        self.lock = lock if lock is not None else threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        LOCK_WAIT.observe(time.perf_counter() - start, lock=self.name)
+        return acquired
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class MetricsServer:
+    """Endpoint HTTP local (GET /metrics) servido por uma thread em segundo plano."""
+
+    def __init__(self, host='127.0.0.1', port=9100, registry=REGISTRY):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Sem log por requisição de coleta
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
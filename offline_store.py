@@ -0,0 +1,321 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Armazenamento de mensagens offline.
+
+OfflineStore define a interface usada pelo servidor; há duas implementações:
+
+- BrokerOfflineStore: filas no RabbitMQ (ou no InMemoryBroker) via BrokerPool.
+- LogOfflineStore: log local, append-only, com um diretório por usuário contendo
+  segmentos mapeados em memória (mmap) e um arquivo de offset de leitura. Não
+  depende de broker externo e grava sem ida e volta pela rede.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class OfflineStore:
+    """Interface do armazenamento de mensagens para usuários offline."""
+
+    def declare(self, username):
+        """Garante que a fila do usuário exista."""
+        raise NotImplementedError
+
+    def append(self, username, message):
+        """Armazena uma mensagem; retorna um Future resolvido quando ela estiver gravada."""
+        return self.append_many([(username, message)])
+
+    def append_many(self, items):
+        """Armazena vários pares (usuário, mensagem) de uma só vez."""
+        raise NotImplementedError
+
+    def drain(self, username, batch_size=100):
+        """
+        Gera lotes de até batch_size mensagens pendentes do usuário. Um lote só é
+        removido do armazenamento quando o próximo é pedido (ou a iteração termina
+        normalmente); se a iteração for interrompida, ele será entregue de novo.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Libera conexões e arquivos abertos."""
+
+
+class BrokerOfflineStore(OfflineStore):
+    """Mensagens offline em filas duráveis do broker (RabbitMQ ou InMemoryBroker)."""
+
+    def __init__(self, pool, prefetch=500):
+        """
+        - pool: BrokerPool usado para declarar, publicar e consumir.
+        - prefetch: mensagens em trânsito por consumidor durante o drain.
+        """
+        self.pool = pool
+        self.prefetch = prefetch
+
+    def declare(self, username):
+        self.pool.declare(username)
+
+    def append_many(self, items):
+        return self.pool.publish_many(items)
+
+    def drain(self, username, batch_size=100):
+        return self.pool.drain(username, prefetch=self.prefetch, batch_size=batch_size)
+
+    def close(self):
+        self.pool.close()
+
+
+RECORD = struct.Struct('!IB')  # tamanho do corpo, marcador de registro válido
+RECORD_MARKER = 1
+OFFSET = struct.Struct('!Q')
+
+
+class SegmentLog:
+    """
+    Log de um usuário. Offsets lógicos contam os bytes de registros gravados desde
+    o início do log; cada segmento se chama <offset inicial>.log e é pré-alocado
+    com segment_size bytes (zeros marcam o fim dos dados). O arquivo "offset"
+    guarda a posição já consumida. draining marca o consumo em andamento: só um
+    drain por usuário lê o log de cada vez.
+    """
+
+    def __init__(self, path, segment_size, fsync):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(path) if name.endswith('.log'))
+        self.offset_path = os.path.join(path, 'offset')
+        self.read_offset = self.load_offset()
+        self.draining = False
+        self.tail_file = None
+        self.tail_map = None
+        self.write_offset = self.segments[-1] + self.scan_end(self.segments[-1]) if self.segments else 0
+
+    def segment_path(self, base):
+        return os.path.join(self.path, f"{base:020d}.log")
+
+    def load_offset(self):
+        try:
+            with open(self.offset_path, 'rb') as f:
+                return OFFSET.unpack(f.read(OFFSET.size))[0]
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def scan_end(self, base):
+        """Percorre um segmento até o primeiro registro inválido e retorna o tamanho usado."""
+        with open(self.segment_path(base), 'rb') as f:
+            data = f.read()
+        position = 0
+        while position + RECORD.size <= len(data):
+            length, marker = RECORD.unpack_from(data, position)
+            if marker != RECORD_MARKER or position + RECORD.size + length > len(data):
+                break
+            position += RECORD.size + length
+        return position
+
+    def map_tail(self, min_size=0):
+        """Mapeia o segmento final para escrita, criando um novo se necessário."""
+        if not self.segments:
+            self.segments.append(0)
+        base = self.segments[-1]
+        size = max(self.segment_size, min_size)
+        path = self.segment_path(base)
+        self.tail_file = open(path, 'a+b')
+        if os.fstat(self.tail_file.fileno()).st_size < size:
+            self.tail_file.truncate(size)
+        self.tail_map = mmap.mmap(self.tail_file.fileno(), 0)
+
+    def release(self):
+        """Desfaz o mapeamento do segmento final (ele é remapeado no próximo uso)."""
+        if self.tail_map is not None:
+            self.tail_map.close()
+            self.tail_file.close()
+            self.tail_map = self.tail_file = None
+
+    def append(self, bodies):
+        """Acrescenta corpos (bytes) ao final do log."""
+        for body in bodies:
+            needed = RECORD.size + len(body)
+            if self.tail_map is None:
+                self.map_tail(needed)
+            position = self.write_offset - self.segments[-1]
+            if position + needed > len(self.tail_map):
+                # Segmento cheio: o próximo começa no offset lógico atual
+                self.release()
+                self.segments.append(self.write_offset)
+                self.map_tail(needed)
+                position = 0
+            # Corpo antes do cabeçalho: um registro só passa a valer quando está completo
+            self.tail_map[position + RECORD.size:position + needed] = body
+            RECORD.pack_into(self.tail_map, position, len(body), RECORD_MARKER)
+            self.write_offset += needed
+        if self.fsync and self.tail_map is not None:
+            self.tail_map.flush()
+
+    def read(self, offset, limit):
+        """Lê até limit registros a partir de offset; retorna (corpos, próximo offset)."""
+        bodies = []
+        while len(bodies) < limit and offset < self.write_offset:
+            index = bisect.bisect_right(self.segments, offset) - 1
+            base = self.segments[index]
+            is_tail = index == len(self.segments) - 1
+            if is_tail and self.tail_map is None:
+                self.map_tail()
+            if is_tail:
+                data = self.tail_map
+                end = self.write_offset - base
+            else:
+                with open(self.segment_path(base), 'rb') as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                end = self.segments[index + 1] - base
+            try:
+                position = offset - base
+                while len(bodies) < limit and position < end:
+                    length, _ = RECORD.unpack_from(data, position)
+                    bodies.append(bytes(data[position + RECORD.size:position + RECORD.size + length]))
+                    position += RECORD.size + length
+                offset = base + position
+            finally:
+                if not is_tail:
+                    data.close()
+        return bodies, offset
+
+    def commit(self, offset):
+        """Registra offset como consumido e apaga segmentos inteiramente lidos (nunca recua)."""
+        if offset <= self.read_offset:
+            return
+        self.read_offset = offset
+        with open(self.offset_path + '.tmp', 'wb') as f:
+            f.write(OFFSET.pack(offset))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(self.offset_path + '.tmp', self.offset_path)
+        while len(self.segments) > 1 and self.segments[1] <= offset:
+            os.remove(self.segment_path(self.segments.pop(0)))
+
+
+class LogOfflineStore(OfflineStore):
+    """
+    Armazenamento offline embutido: um SegmentLog por usuário em data_dir.
+    Mantém no máximo max_open segmentos mapeados (LRU) para limitar descritores abertos.
+    """
+
+    def __init__(self, data_dir, segment_size=4 * 1024 * 1024, fsync=False, max_open=1024):
+        """
+        - data_dir: diretório raiz dos logs.
+        - segment_size: tamanho pré-alocado de cada segmento.
+        - fsync: se True, força msync/fsync a cada gravação (mais lento, sobrevive a queda do SO).
+        - max_open: número máximo de segmentos finais mapeados simultaneamente.
+        """
+        self.data_dir = data_dir
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.max_open = max_open
+        self.logs = {}
+        self.mapped = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(data_dir, exist_ok=True)
+
+    def log_for(self, username):
+        """Retorna o log do usuário, marcando-o como usado recentemente."""
+        evicted = []
+        with self.lock:
+            log = self.logs.get(username)
+            if log is None:
+                path = os.path.join(self.data_dir, username.encode('utf-8').hex())
+                log = self.logs[username] = SegmentLog(path, self.segment_size, self.fsync)
+            self.mapped[username] = log
+            self.mapped.move_to_end(username)
+            while len(self.mapped) > self.max_open:
+                evicted.append(self.mapped.popitem(last=False)[1])
+        for old in evicted:
+            with old.lock:
+                old.release()
+        return log
+
+    def declare(self, username):
+        self.log_for(username)
+
+    def append_many(self, items):
+        grouped = {}
+        for username, message in items:
+            grouped.setdefault(username, []).append(message.encode('utf-8'))
+        future = Future()
+        try:
+            for username, bodies in grouped.items():
+                log = self.log_for(username)
+                with log.lock:
+                    log.append(bodies)
+            future.set_result(True)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def drain(self, username, batch_size=100):
+        """
+        Se outro drain do usuário estiver em andamento, termina sem lotes: aquele
+        lê o log até o fim, inclusive o que for gravado enquanto isso, e entregar
+        a partir do mesmo offset duplicaria as mensagens. O drain libera o log no
+        mesmo trecho com lock em que o encontra vazio, então nenhuma gravação fica
+        sem um drain que a leia.
+        """
+        log = self.log_for(username)
+        with log.lock:
+            if log.draining:
+                return
+            log.draining = True
+            offset = log.read_offset
+        holding = True  # Este drain ainda detém o log (liberado uma única vez)
+        try:
+            while True:
+                with log.lock:
+                    bodies, next_offset = log.read(offset, batch_size)
+                    if not bodies:
+                        log.draining = holding = False
+                        return
+                yield [body.decode('utf-8') for body in bodies]
+                with log.lock:
+                    log.commit(next_offset)
+                offset = next_offset
+        finally:
+            if holding:
+                with log.lock:
+                    log.draining = False
+
+    def close(self):
+        with self.lock:
+            logs = list(self.logs.values())
+            self.mapped.clear()
+        for log in logs:
+            with log.lock:
+                log.release()
@@ -0,0 +1,340 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Filas de saída por conexão.
+
+Cada conexão registrada tem um Outbox limitado: quem envia apenas enfileira o
+frame já codificado e segue adiante, e um escritor dedicado faz o sendall.
+Assim um destinatário lento não bloqueia a thread de quem envia. Quando a fila
+enche, a política de consumidor lento decide o que fazer:
+
+- drop: descarta o novo frame;
+- spill: guarda a mensagem no armazenamento offline (quando o frame é uma
+  mensagem de chat) e descarta os demais frames;
+- disconnect: encerra a conexão.
+
+Sem conexão (sessão à espera de ser retomada) não há consumidor lento: as
+mensagens de chat que não cabem na fila vão sempre para o armazenamento offline.
+
+A fila guarda junto de cada frame a mensagem de chat que ele carrega. Se a fila
+for fechada antes de o escritor enviar o frame (a conexão caiu ou a sessão
+expirou), essas mensagens ficam em `unsent` para o servidor gravá-las no
+armazenamento offline. Quem precisa saber se um frame saiu (a entrega das
+mensagens offline, que só confirma o lote depois do envio) passa um Delivery.
+
+O escritor envia de uma vez tudo o que encontrar na fila: com gather=True os
+frames pendentes saem em uma única chamada sendmsg (writev), e uma janela de
+coalescência opcional (coalesce_delay) espera alguns milissegundos por mais
+frames antes de escrever, trocando um pouco de latência por menos chamadas de sistema.
+
+Sessões retomáveis: cada frame entregue ao escritor recebe implicitamente o
+próximo número de sequência (o cliente conta os frames que recebe) e os últimos
+`replay` frames ficam guardados. Quando a conexão cai, detach() para o escritor
+mas a fila continua aceitando frames; ao reconectar, a fila da nova conexão
+assume a antiga com resume_from(), reenviando só o que o cliente não recebeu.
+"""
+
+import logging
+import socket
+import threading
+import time
+from collections import deque
+
+import metrics
+import protocol
+
+POLICIES = ('drop', 'spill', 'disconnect')
+
+log = logging.getLogger('chat.outbound')
+
+
+class Delivery:
+    """Resultado do envio de um frame: wait() retorna True depois que o escritor o enviou."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.delivered = False
+
+    def done(self, delivered):
+        if not self.event.is_set():
+            self.delivered = delivered
+            self.event.set()
+
+    def wait(self, timeout=None):
+        """Espera o envio; False se a fila foi fechada antes (ou o tempo acabou)."""
+        self.event.wait(timeout)
+        return self.delivered
+
+
+class Outbox:
+    """Fila de saída limitada de uma conexão, com métricas de profundidade."""
+
+    def __init__(self, client, username, limit=1000, policy='drop', spill=None, coalesce_delay=0.0,
+                 gather=True, replay=0):
+        """
+        - client: conexão (socket ou StreamConnection).
+        - username: dono da conexão (usado ao desviar mensagens para o armazenamento offline).
+        - limit: número máximo de frames na fila.
+        - policy: política de consumidor lento ('drop', 'spill' ou 'disconnect').
+        - spill: função (username, mensagem) chamada pela política 'spill'.
+        - coalesce_delay: segundos que o escritor espera por mais frames antes de enviar (0 desativa).
+        - gather: envia os frames pendentes em uma única escrita em vez de um sendall por frame.
+        - replay: frames já entregues ao escritor guardados para reenvio ao retomar a sessão (0 desativa).
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Política de consumidor lento desconhecida: {policy}")
+        self.client = client
+        self.username = username
+        self.limit = limit
+        self.policy = policy
+        self.spill = spill
+        self.coalesce_delay = coalesce_delay
+        self.gather = gather
+        self.frames = deque()
+        self.pending = deque()  # Para cada frame da fila: None ou (mensagem de chat, Delivery)
+        self.inflight = []  # O mesmo para os frames com o escritor, até o envio terminar
+        self.unsent = []  # Mensagens de chat de frames descartados por close() sem envio
+        self.cond = threading.Condition()
+        self.closed = False
+        self.detached = False  # Conexão perdida: o escritor parou, mas a fila segue aceitando frames
+        self.successor = None  # Fila que assumiu esta ao retomar a sessão (recebe os frames seguintes)
+        self.taken = 0  # Frames entregues ao escritor (número de sequência do último)
+        self.ring = deque(maxlen=replay) if replay else None
+        self.spilled_detached = False  # Alguma mensagem foi para o offline por falta de espaço sem conexão
+        self.max_depth = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.writes = 0
+        self.dropped = 0
+        self.spilled = 0
+
+    def put(self, frame, spill_message=None, block=False, timeout=None, delivery=None):
+        """
+        Enfileira um frame. Com block=True espera haver espaço (usado por produtores
+        em segundo plano, como a entrega de mensagens offline); caso contrário aplica
+        a política de consumidor lento. Retorna True se o frame foi enfileirado ou
+        se spill_message foi guardada no armazenamento offline (ela chegará ao
+        usuário), e False se foi descartado.
+        - delivery: Delivery avisado quando o frame for enviado (ou descartado sem envio).
+        """
+        with self.cond:
+            if block:
+                self.cond.wait_for(lambda: self.closed or len(self.frames) < self.limit, timeout)
+            successor = self.successor
+            if successor is None:
+                if self.closed:
+                    return False
+                overflow = len(self.frames) >= self.limit
+                if not overflow:
+                    self.enqueue(frame, spill_message, delivery)
+        if successor is not None:
+            return successor.put(frame, spill_message, block, timeout, delivery)
+        if overflow:
+            return self.overflow(spill_message)
+        self.wake()
+        return True
+
+    def enqueue(self, frame, spill_message=None, delivery=None):
+        """Acrescenta o frame à fila (chamado com self.cond adquirido)."""
+        self.frames.append(frame)
+        self.pending.append(None if spill_message is None and delivery is None else (spill_message, delivery))
+        self.max_depth = max(self.max_depth, len(self.frames))
+        self.cond.notify_all()
+
+    def overflow(self, spill_message):
+        """
+        Aplica a política de consumidor lento a um frame que não coube na fila.
+        Retorna True se a mensagem foi guardada no armazenamento offline.
+        """
+        detached = self.detached
+        if spill_message is not None and self.spill is not None and (detached or self.policy == 'spill'):
+            self.spill(self.username, spill_message)
+            self.spilled += 1
+            if detached:
+                self.spilled_detached = True
+            return True
+        if self.policy == 'disconnect' and not detached:
+            log.warning("Fila de saída de %s cheia (%s frames). Desconectando.", self.username, self.limit)
+            self.close()
+            self.abort()
+        else:
+            self.dropped += 1
+        return False
+
+    def take(self):
+        """Retira todos os frames pendentes (chamado pelo escritor, que depois chama sent)."""
+        with self.cond:
+            frames = list(self.frames)
+            self.frames.clear()
+            self.inflight = list(self.pending)
+            self.pending.clear()
+            self.taken += len(frames)
+            if self.ring is not None:
+                self.ring.extend(frames)
+            self.cond.notify_all()
+            return frames
+
+    def sent(self, frames, writes=1):
+        """Registra o envio dos frames retirados por take()."""
+        with self.cond:
+            inflight, self.inflight = self.inflight, []
+        for entry in inflight:
+            if entry is not None and entry[1] is not None:
+                entry[1].done(True)
+        size = sum(len(frame) for frame in frames)
+        self.writes += writes
+        self.sent_frames += len(frames)
+        self.sent_bytes += size
+        metrics.BYTES_OUT.inc(size)
+
+    def wake(self):
+        """Acorda o escritor (o escritor em thread já é acordado pela Condition)."""
+
+    def abort(self):
+        """Encerra a conexão para que a thread/tarefa de leitura termine."""
+        try:
+            self.client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def detach(self):
+        """
+        Para o escritor sem descartar nada: a fila continua aceitando frames até
+        ser assumida por outra conexão (resume_from) ou fechada.
+        """
+        with self.cond:
+            self.detached = True
+            self.cond.notify_all()
+        self.wake()
+
+    def resume_from(self, previous, last_seq, first=None):
+        """
+        Assume a fila de uma sessão retomada: envia first, depois os frames que o
+        cliente não recebeu (posteriores a last_seq) e os que ainda aguardavam envio.
+        Frames enfileirados depois na fila antiga são repassados a esta. Retorna
+        False, sem alterar nada, se os frames perdidos já saíram do histórico.
+        """
+        with previous.cond:
+            missing = previous.taken - last_seq
+            if previous.closed or previous.ring is None or not 0 <= missing <= len(previous.ring):
+                return False
+            replay = [previous.ring.pop() for _ in range(missing)]
+            replay.reverse()
+            # Os frames com o escritor antigo são os últimos do histórico: os que o
+            # cliente recebeu contam como enviados, os demais seguem no reenvio
+            inflight, previous.inflight = previous.inflight, []
+            received = max(len(inflight) - missing, 0)
+            for entry in inflight[:received]:
+                if entry is not None and entry[1] is not None:
+                    entry[1].done(True)
+            replay_pending = [None] * (missing - len(inflight) + received) + inflight[received:]
+            with self.cond:
+                if first is not None:
+                    self.frames.append(first)
+                    self.pending.append(None)
+                self.frames.extend(replay)
+                self.pending.extend(replay_pending)
+                self.frames.extend(previous.frames)
+                self.pending.extend(previous.pending)
+                self.taken = last_seq
+                self.max_depth = max(self.max_depth, len(self.frames))
+                self.cond.notify_all()
+            previous.frames.clear()
+            previous.pending.clear()
+            previous.closed = True
+            previous.successor = self
+            previous.cond.notify_all()
+        self.wake()
+        return True
+
+    def close(self):
+        """
+        Fecha a fila e descarta os frames pendentes, inclusive os que estavam com o
+        escritor sem envio concluído. As mensagens de chat desses frames ficam em
+        unsent (o servidor as grava no armazenamento offline) e os Delivery são avisados.
+        """
+        with self.cond:
+            self.closed = True
+            entries = self.inflight + list(self.pending)
+            self.inflight = []
+            self.frames.clear()
+            self.pending.clear()
+            for entry in entries:
+                if entry is not None and entry[0] is not None:
+                    self.unsent.append(entry[0])
+            self.cond.notify_all()
+        for entry in entries:
+            if entry is not None and entry[1] is not None:
+                entry[1].done(False)
+        self.wake()
+
+    @property
+    def depth(self):
+        return len(self.frames)
+
+    def stats(self):
+        """Métricas da fila de saída."""
+        return {
+            'depth': len(self.frames),
+            'max_depth': self.max_depth,
+            'sent_frames': self.sent_frames,
+            'sent_bytes': self.sent_bytes,
+            'writes': self.writes,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+        }
+
+
+class ThreadedOutbox(Outbox):
+    """Outbox do motor threaded: uma thread escritora por conexão."""
+
+    def start(self):
+        threading.Thread(target=self.run, name=f"writer-{self.username}", daemon=True).start()
+        return self
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or self.detached or self.frames)
+                if self.closed or self.detached:
+                    return
+            if self.coalesce_delay:
+                time.sleep(self.coalesce_delay)
+            frames = self.take()
+            if not frames:
+                continue
+            try:
+                if self.gather and len(frames) > 1:
+                    protocol.send_frames(self.client, frames)
+                    writes = 1
+                else:
+                    for frame in frames:
+                        self.client.sendall(frame)
+                    writes = len(frames)
+            except OSError as e:
+                # Encerra a conexão; a leitura decide se a sessão acaba ou aguarda reconexão
+                log.warning("Erro ao enviar dados para %s: %s", self.username, e)
+                self.abort()
+                return
+            self.sent(frames, writes)
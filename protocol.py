@@ -0,0 +1,207 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+"""
+Protocolo de transporte compartilhado entre server.py e client.py.
+
+Cada mensagem trafega como um frame:
+
+    +----------------+-----------+------------------------+
+    | tamanho (u32)  | codec (u8)| corpo (tamanho bytes)  |
+    +----------------+-----------+------------------------+
+
+O cabeçalho é big-endian. O corpo é JSON UTF-8 (codec 0), o que evita executar
+pickle.loads em bytes recebidos da rede, ou esse mesmo JSON comprimido com
+deflate e um dicionário pré-compartilhado (codec 1), que torna a compressão
+eficaz mesmo em mensagens curtas. Cada frame é comprimido de forma independente,
+então um mesmo frame pode ser enviado a várias conexões. O FrameDecoder acumula
+bytes de leituras parciais e extrai quantos frames completos houver em um mesmo buffer.
+
+O primeiro frame do cliente é o handshake: o nome de usuário (str) ou, para
+negociar opções, {'username': ..., 'compression': ['zlib']}. Neste caso o
+servidor responde com {'action': 'welcome', 'compression': 'zlib' ou None,
+'token': ..., 'resumed': False}. Se a conexão cair, o cliente reconecta com
+{'username': ..., 'resume': token, 'last_seq': n}, onde n é o número de frames
+recebidos na sessão (o welcome é o frame 1), e recebe só os frames seguintes.
+"""
+
+import json
+import os
+import struct
+import zlib
+from collections import deque
+
+HEADER = struct.Struct('!IB')
+CODEC_JSON = 0
+CODEC_ZLIB = 1
+COMPRESSIONS = ('zlib',)
+COMPRESS_MIN_SIZE = 64  # Corpos menores são enviados sem compressão
+COMPRESSION_LEVEL = 6
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # Limite de 16 MiB por frame
+RECV_SIZE = 65536
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024  # Buffers por sendmsg
+SERVER_FULL = "Servidor cheio. Tente novamente mais tarde."  # Recusa por falta de vaga (o cliente pode reconectar)
+SERVER_UNAVAILABLE = "Servidor indisponível no momento. Tente novamente mais tarde."  # Ex.: broker fora do ar
+
+# Trechos frequentes nos frames do chat: o deflate passa a referenciá-los desde o primeiro byte
+ZLIB_DICTIONARY = (
+    '{"action":"roster_delta","version":,"changes":[["online","offline","add","remove",'
+    '{"action":"roster","contacts":[{"action":"history","cursor":"messages":[{"id":,"timestamp":,'
+    '"sender":"message":"with":"channel":{"action":"search_results","query":'
+    '{"action":"send_private_message","target_user":"message":{"action":"status_update","status":'
+    'true{"action":"add_contact","contact":{"action":"post_channel","channel":'
+    ' (privado): Você para Você em [Mensagem offline: Contato adicionado: não existe.'
+).encode('utf-8')
+
+
+class ProtocolError(Exception):
+    """Frame malformado, grande demais ou com codec desconhecido."""
+
+
+def encode(obj, compress=False):
+    """
+    Serializa um objeto em um frame pronto para envio. Com compress=True, corpos a
+    partir de COMPRESS_MIN_SIZE bytes são comprimidos quando isso os torna menores.
+    """
+    body = json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if len(body) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame de {len(body)} bytes excede o limite de {MAX_FRAME_SIZE}")
+    if compress and len(body) >= COMPRESS_MIN_SIZE:
+        compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=ZLIB_DICTIONARY)
+        packed = compressor.compress(body) + compressor.flush()
+        if len(packed) < len(body):
+            return HEADER.pack(len(packed), CODEC_ZLIB) + packed
+    return HEADER.pack(len(body), CODEC_JSON) + body
+
+
+def decode_body(codec, body):
+    """Desserializa o corpo de um frame de acordo com o codec do cabeçalho."""
+    if codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=ZLIB_DICTIONARY)
+        try:
+            body = decompressor.decompress(body, MAX_FRAME_SIZE)
+        except zlib.error as e:
+            raise ProtocolError(f"Frame comprimido inválido: {e}") from e
+        if decompressor.unconsumed_tail:
+            raise ProtocolError(f"Frame descomprimido excede o limite de {MAX_FRAME_SIZE}")
+    elif codec != CODEC_JSON:
+        raise ProtocolError(f"Codec desconhecido: {codec}")
+    return json.loads(body.decode('utf-8'))
+
+
+def send_frame(sock, obj, compress=False):
+    """Envia um objeto como um único frame (sendall garante a escrita completa)."""
+    sock.sendall(encode(obj, compress))
+
+
+def send_frames(sock, frames):
+    """
+    Envia vários frames já codificados com sendmsg (writev): uma chamada de sistema
+    para o lote, repetida apenas quando o kernel aceita só parte dos bytes.
+    """
+    buffers = [memoryview(frame) for frame in frames]
+    first = 0
+    while first < len(buffers):
+        sent = sock.sendmsg(buffers[first:first + IOV_MAX])
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = buffers[first][sent:]
+
+
+def handshake(username, compression=None, resume=None, last_seq=0):
+    """
+    Primeiro frame do cliente, com as opções negociadas no welcome.
+    - resume: token de uma sessão anterior, para retomá-la a partir do frame last_seq.
+    """
+    options = {'username': username, 'compression': [compression] if compression else []}
+    if resume is not None:
+        options.update(resume=resume, last_seq=last_seq)
+    return options
+
+
+def parse_handshake(obj):
+    """Retorna (nome de usuário, opções) do handshake; aceita também o formato só com o nome."""
+    if isinstance(obj, str):
+        return obj, {}
+    if isinstance(obj, dict) and isinstance(obj.get('username'), str):
+        return obj['username'], obj
+    raise ProtocolError("Handshake inválido")
+
+
+class FrameDecoder:
+    """
+    Decodificador incremental: recebe bytes em pedaços arbitrários e devolve os
+    objetos de todos os frames completos, guardando o restante para a próxima leitura.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Acrescenta bytes ao buffer e retorna a lista de objetos decodificados."""
+        self.buffer += data
+        messages = []
+        offset = 0
+        buffer = self.buffer
+        while len(buffer) - offset >= HEADER.size:
+            length, codec = HEADER.unpack_from(buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame de {length} bytes excede o limite de {MAX_FRAME_SIZE}")
+            end = offset + HEADER.size + length
+            if len(buffer) < end:
+                break
+            messages.append(decode_body(codec, bytes(buffer[offset + HEADER.size:end])))
+            offset = end
+        if offset:
+            del buffer[:offset]
+        return messages
+
+
+class FrameReader:
+    """
+    Lê frames de um socket bloqueante, um objeto por chamada. Frames extras
+    recebidos na mesma leitura ficam guardados para as chamadas seguintes.
+    """
+
+    def __init__(self, sock, initial=b'', bytes_in=None):
+        """
+        - sock: socket bloqueante.
+        - initial: bytes já lidos do socket por outro componente (ex.: o handshake).
+        - bytes_in: contador (com inc) dos bytes recebidos, opcional.
+        """
+        self.sock = sock
+        self.bytes_in = bytes_in
+        self.decoder = FrameDecoder()
+        self.pending = deque(self.decoder.feed(initial) if initial else ())
+
+    def read(self):
+        """Retorna o próximo objeto recebido, ou None se a conexão foi encerrada."""
+        while not self.pending:
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                return None
+            if self.bytes_in is not None:
+                self.bytes_in.inc(len(data))
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
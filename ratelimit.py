@@ -0,0 +1,141 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Limites de taxa do servidor (token bucket).
+
+TokenBucket é um balde único, usado pelo laço que aceita conexões. RateLimiter
+guarda um balde por chave (ex.: nome de usuário) e custa O(1) por consulta
+mesmo com centenas de milhares de chaves: o saldo é reposto de forma
+preguiçosa, a partir do instante da última consulta, e uma roda de tempo
+descarta os baldes que ficaram ociosos tempo bastante para encher de novo,
+de modo que só os usuários ativos ocupam memória. Chave sem balde equivale
+a balde cheio.
+"""
+
+import math
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Balde com capacidade burst, reposto a rate fichas por segundo. Não é
+    thread-safe: cada instância pertence a uma única thread (ou loop).
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def delay(self, cost=1):
+        """Consome cost fichas e retorna 0, ou retorna os segundos até haver fichas suficientes."""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class Wheel:
+    """
+    Parte dos baldes de um RateLimiter, com seu lock. slots[t % n] guarda as
+    chaves consultadas pela última vez no tick t; ao avançar o relógio, o slot
+    que dá a volta contém só chaves ociosas há pelo menos n - 1 ticks.
+    """
+
+    __slots__ = ('buckets', 'slots', 'tick', 'lock')
+
+    def __init__(self, size, tick):
+        self.buckets = {}  # chave -> [fichas, instante da última consulta, tick da última consulta]
+        self.slots = [set() for _ in range(size)]
+        self.tick = tick
+        self.lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Um token bucket por chave, particionado por hash como o SessionRegistry
+    (chaves diferentes raramente disputam o mesmo lock).
+    """
+
+    def __init__(self, rate, burst=None, partitions=16, resolution=1.0, clock=time.monotonic):
+        """
+        - rate: fichas repostas por segundo em cada balde.
+        - burst: capacidade de cada balde (padrão: rate).
+        - resolution: duração de um tick da roda, em segundos.
+        - clock: relógio monotônico (substituível nos benchmarks).
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.resolution = resolution
+        self.clock = clock
+        # Ticks para um balde vazio encher de novo, mais um pela fração do tick corrente
+        self.size = math.ceil(self.burst / rate / resolution) + 1
+        tick = int(clock() / resolution)
+        self.partitions = [Wheel(self.size, tick) for _ in range(partitions)]
+
+    def allow(self, key, cost=1):
+        """Consome cost fichas do balde de key. Retorna False (sem consumir) se não houver saldo."""
+        now = self.clock()
+        tick = int(now / self.resolution)
+        wheel = self.partitions[hash(key) % len(self.partitions)]
+        with wheel.lock:
+            if tick > wheel.tick:
+                self.advance(wheel, tick)
+            bucket = wheel.buckets.get(key)
+            if bucket is None:
+                bucket = wheel.buckets[key] = [self.burst, now, tick]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                if bucket[2] != tick:
+                    wheel.slots[bucket[2] % self.size].discard(key)
+                    bucket[2] = tick
+            wheel.slots[tick % self.size].add(key)
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+    def advance(self, wheel, tick):
+        """
+        Descarta os baldes dos slots pelos quais a roda passou: estão ociosos há
+        tempo suficiente para estarem cheios. Cada chave é descartada no máximo
+        uma vez por inserção, então o custo amortizado por consulta é O(1).
+        """
+        for t in range(max(wheel.tick + 1, tick - self.size + 1), tick + 1):
+            slot = wheel.slots[t % self.size]
+            for key in slot:
+                del wheel.buckets[key]
+            slot.clear()
+        wheel.tick = tick
+
+    def __len__(self):
+        """Número de baldes em memória (chaves ativas recentemente)."""
+        return sum(len(wheel.buckets) for wheel in self.partitions)
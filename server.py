@@ -20,117 +20,425 @@
 # THE SOFTWARE.
 # -----------------------------------------------------------------------------
 
+import os
+import secrets
 import socket
 import threading
-import pickle
-import pika
 import time
 import argparse
+import logging
+from contextlib import closing
+
+import logs
+import metrics
+import protocol
+from broker import BrokerPool, InMemoryBroker, rabbitmq_connector
+from channels import ChannelDirectory, valid_channel_name
+from contacts import ContactGraph
+from history import MessageHistory, channel_conversation, describe_conversation, private_conversation
+from offline_store import BrokerOfflineStore, LogOfflineStore
+from outbound import POLICIES, Delivery, ThreadedOutbox
+from ratelimit import RateLimiter, TokenBucket
+from sessions import SessionRegistry
+
+log = logging.getLogger('chat.server')
+
+# Limites por usuário (fichas por segundo, rajada): '*' vale para todas as ações,
+# os demais para a ação de mesmo nome e 'offline' para as gravações no armazenamento offline
+DEFAULT_RATE_LIMITS = {
+    '*': (100, 200),
+    'search_history': (5, 10),
+    'post_channel': (10, 50),  # Cada post grava uma cópia offline por membro offline do canal
+    'offline': (20, 100),
+}
 
 class ChatServer:
-    def __init__(self, host, port, max_clients=10):
+    # Ações conhecidas (as demais aparecem como 'unknown' nas métricas)
+    actions = ('send_private_message', 'add_contact', 'remove_contact', 'status_update', 'roster_sync',
+               'create_channel', 'join_channel', 'leave_channel', 'post_channel', 'history', 'search_history')
+
+    def __init__(self, host, port, max_clients=10000, offline_store=None, contacts=None, channels=None,
+                 history=None):
         """
         Inicializa o servidor de chat.
         - host: IP onde o servidor vai rodar.
         - port: Porta onde o servidor escutará as conexões.
-        - max_clients: Número máximo de clientes permitidos.
+        - max_clients: Número máximo de conexões atendidas ao mesmo tempo (ver accept_connections).
+        - offline_store: OfflineStore para mensagens offline (padrão: RabbitMQ em localhost).
+        - contacts: ContactGraph com os contatos de cada usuário (padrão: somente em memória).
+        - channels: ChannelDirectory com os membros de cada canal (padrão: somente em memória).
+        - history: MessageHistory com as mensagens trocadas (padrão: somente em memória).
         """
         self.host = host
         self.port = port
         self.max_clients = max_clients
-        self.clients = {}  # Dicionário para conexões de clientes e seus nomes
-        self.client_status = {}  # Status online/offline dos clientes
-        self.contacts = {}  # Lista de contatos de cada cliente
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen()
-        self.lock = threading.Lock()
-
-        # Conecta ao RabbitMQ para gerenciamento de mensagens offline no broker
-        self.connect_rabbitmq()
-
-    def connect_rabbitmq(self):
-        """Conecta ao RabbitMQ, com tentativa de reconexão em caso de falha."""
-        try:
-            self.rabbitmq_connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-            self.rabbitmq_channel = self.rabbitmq_connection.channel()
-            print("Conexão com RabbitMQ estabelecida.")
-        except Exception as e:
-            print(f"Erro ao conectar ao RabbitMQ: {e}. Tentando novamente em 5 segundos...")
-            time.sleep(5)
-            self.connect_rabbitmq()
+        self.connection_slots = threading.BoundedSemaphore(max_clients)  # Uma vaga por conexão atendida
+        self.sessions = SessionRegistry()  # Índice nome de usuário <-> conexão <-> status
+        self.contacts = contacts if contacts is not None else ContactGraph()  # Contatos de cada cliente
+        self.channels = channels if channels is not None else ChannelDirectory()  # Membros de cada canal
+        self.history = history if history is not None else MessageHistory()  # Histórico das conversas
+        self.server_socket = self.create_server_socket()
+        self.lock = metrics.InstrumentedLock('server')
+        self.metrics_server = None  # MetricsServer iniciado por start_metrics
+        self.publish_timeout = 10.0  # Segundos aguardando a gravação da mensagem offline
+        self.offline_batch_size = 100  # Mensagens offline por frame enviado ao cliente
+        self.outbound_limit = 1000  # Frames na fila de saída de cada conexão
+        self.slow_consumer_policy = 'drop'  # Política quando a fila de saída enche (ver outbound.POLICIES)
+        self.compression = 'zlib'  # Compressão oferecida a quem pedir no handshake (None desativa)
+        self.coalesce_delay = 0.0  # Segundos que o escritor de cada conexão espera por mais frames
+        self.gather_writes = True  # Envia os frames pendentes de uma conexão em uma única escrita
+        self.resume_grace = 30.0  # Segundos que uma sessão retomável aguarda reconexão (0 desativa)
+        self.replay_size = 256  # Frames guardados por sessão para reenvio ao retomar
+        self.admission_timeout = 1.0  # Segundos que as conexões aguardam vaga na fila de aceitação
+        self.accept_limiter = None  # TokenBucket que limita as conexões aceitas por segundo
+        self.rate_limits = rate_limiters(DEFAULT_RATE_LIMITS)  # Chave do limite -> RateLimiter por usuário
+        self.closing = False
+
+        # Armazenamento das mensagens para usuários offline
+        if offline_store is None:
+            offline_store = BrokerOfflineStore(BrokerPool(rabbitmq_connector('localhost')))
+        self.offline_store = offline_store
+        self.register_metrics()
+
+    def register_metrics(self):
+        """Gauges calculados na leitura do endpoint de métricas."""
+        registry = metrics.REGISTRY
+        registry.gauge('chat_active_sessions', 'Usuários conectados', lambda: len(self.sessions))
+        registry.gauge('chat_online_sessions', 'Usuários conectados com status online',
+                       lambda: sum(1 for session in self.sessions.all() if session.online))
+        registry.gauge('chat_detached_sessions', 'Sessões sem conexão aguardando reconexão',
+                       lambda: sum(1 for session in self.sessions.all() if session.client is None))
+        for field, help in (('depth', 'Frames aguardando envio nas filas de saída'),
+                            ('max_depth', 'Maior profundidade já atingida por uma fila de saída'),
+                            ('dropped', 'Frames descartados pela política de consumidor lento'),
+                            ('spilled', 'Mensagens desviadas para o armazenamento offline')):
+            registry.gauge(f'chat_outbox_{field}', help, lambda field=field: self.outbox_total(field))
+
+    def outbox_total(self, field):
+        """Soma (ou máximo, para max_depth) de um campo de Outbox.stats() entre as sessões."""
+        values = [session.outbox.stats()[field] for session in self.sessions.all()]
+        if field == 'max_depth':
+            return max(values, default=0)
+        return sum(values)
+
+    def start_metrics(self, host, port):
+        """Inicia o endpoint HTTP de métricas (GET /metrics) em host:port."""
+        self.metrics_server = metrics.MetricsServer(host, port).start()
+        log.info("Métricas disponíveis em http://%s:%s/metrics", host, port)
+
+    def create_server_socket(self):
+        """Cria o socket de escuta em host:port."""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((self.host, self.port))
+        server_socket.listen()
+        return server_socket
 
     def start(self):
         """Inicia o servidor e aguarda conexões de clientes."""
-        print(f"Servidor iniciado em {self.host}:{self.port}")
+        log.info("Servidor iniciado em %s:%s", self.host, self.port)
         try:
             self.accept_connections()
         except Exception as e:
-            print(f"Erro no servidor: {e}")
+            log.error("Erro no servidor: %s", e)
         finally:
             self.shutdown()
 
     def accept_connections(self):
-        """Aceita conexões de clientes continuamente."""
-        print("Aguardando conexões...")
+        """
+        Aceita conexões de clientes continuamente, uma por vaga livre (max_clients).
+        Sem vaga, o servidor para de aceitar e as conexões novas aguardam na fila
+        de aceitação do kernel; se nenhuma vaga abrir em admission_timeout
+        segundos, as que estão na fila são recusadas com SERVER_FULL, em vez de
+        esperarem indefinidamente. Com accept_limiter, o ritmo de aceitação
+        também é limitado (o excedente aguarda na mesma fila).
+        """
+        log.info("Aguardando conexões...")
         while True:
             try:
+                self.pace_accept()
+                if not self.connection_slots.acquire(timeout=self.admission_timeout):
+                    self.shed_accept_queue()
+                    continue
                 client, addr = self.server_socket.accept()
-                threading.Thread(target=self.register_client, args=(client,), daemon=True).start()
+                threading.Thread(target=self.serve_client, args=(client,), daemon=True).start()
             except Exception as e:
-                print(f"Erro ao aceitar conexões: {e}")
+                log.error("Erro ao aceitar conexões: %s", e)
                 break
 
-    def register_client(self, client):
+    def pace_accept(self):
+        """Aguarda uma ficha do accept_limiter, se houver limite de conexões por segundo."""
+        if self.accept_limiter is None:
+            return
+        wait = self.accept_limiter.delay()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.accept_limiter.delay()
+
+    def shed_accept_queue(self):
+        """Recusa todas as conexões que aguardam na fila de aceitação (servidor cheio)."""
+        self.server_socket.setblocking(False)
+        try:
+            while True:
+                try:
+                    client, addr = self.server_socket.accept()
+                except BlockingIOError:
+                    break
+                self.refuse(client)
+        finally:
+            self.server_socket.setblocking(True)
+
+    def refuse(self, client):
+        """
+        Avisa o cliente que o servidor está cheio, sem bloquear, e fecha a conexão.
+        O que o cliente já enviou (ex.: o handshake) é descartado antes do close:
+        fechar com dados não lidos faz o kernel responder com RST, e o cliente
+        perderia o aviso.
+        """
+        metrics.CONNECTIONS_REFUSED.inc()
+        try:
+            client.setblocking(False)
+            client.send(protocol.encode(protocol.SERVER_FULL))
+            client.shutdown(socket.SHUT_WR)
+            while client.recv(protocol.RECV_SIZE):
+                pass
+        except OSError:
+            pass
+        client.close()
+
+    def serve_client(self, client, initial=b''):
+        """Atende a conexão (ver register_client) e libera sua vaga ao final."""
+        try:
+            self.register_client(client, initial)
+        finally:
+            self.connection_slots.release()
+
+    def register_client(self, client, initial=b''):
         """
-        Registra um cliente no servidor e cria uma fila de mensagens no RabbitMQ.
+        Registra um cliente no servidor e cria sua fila de mensagens offline.
         - client: Socket do cliente conectado.
+        - initial: bytes já lidos da conexão (ex.: handshake repassado por outro processo).
         """
         try:
-            username = pickle.loads(client.recv(4096))
-            with self.lock:
-                if username in self.clients.values():
-                    client.send(pickle.dumps("Nome de usuário já em uso. Tente outro."))
-                    client.close()
-                    return
-                self.clients[client] = username
-                self.client_status[username] = True  # O cliente começa online
-                self.contacts[username] = []  # Inicializa lista de contatos do cliente
-
-                # Criação de uma fila no RabbitMQ para o cliente
-                self.rabbitmq_channel.queue_declare(queue=username, durable=True)
-            print(f"Usuário {username} conectado e fila de mensagens criada.")
-            self.update_user_list(client)
-            self.handle_client(client)
+            reader = protocol.FrameReader(client, initial, bytes_in=metrics.BYTES_IN)
+            handshake = reader.read()
+            if handshake is None:
+                client.close()
+                return
+            username, options = protocol.parse_handshake(handshake)
+            if not self.declare_queue(client, username):
+                return
+            if not self.add_session(client, username, options):
+                return
+            self.handle_client(client, reader)
         except Exception as e:
-            print(f"Erro ao registrar cliente: {e}")
+            log.warning("Erro ao registrar cliente: %s", e)
             client.close()
 
-    def handle_client(self, client):
+    def declare_queue(self, client, username):
+        """
+        Cria a fila de mensagens offline do usuário (idempotente). Chamado antes
+        de add_session, fora dele, porque pode esperar pelo broker: o motor
+        asyncio o executa em uma thread auxiliar. Retorna False (e fecha a
+        conexão com SERVER_UNAVAILABLE) se o armazenamento não responder.
+        """
+        try:
+            self.offline_store.declare(username)
+        except Exception as e:
+            log.error("Erro ao criar a fila de mensagens offline de %s: %s", username, e)
+            self.send(client, protocol.SERVER_UNAVAILABLE)
+            client.close()
+            return False
+        log.debug("Fila de mensagens offline de %s criada.", username)
+        return True
+
+    def add_session(self, client, username, options=None):
+        """
+        Associa o nome de usuário à conexão e cria sua fila de mensagens offline.
+        Retorna False (e fecha a conexão) se o nome já estiver em uso.
+        Compartilhado pelos motores threaded e asyncio.
+        - options: opções do handshake (ver protocol.parse_handshake); quando
+          presentes, o cliente recebe um 'welcome' com a compressão negociada e
+          o token para retomar a sessão, e com {'resume': token, 'last_seq': n}
+          retoma uma sessão cuja conexão caiu (ver resume_session).
+        """
+        options = options or {}
+        compress = self.compression is not None and self.compression in options.get('compression', ())
+        resumable = bool(options) and self.resume_grace > 0
+        outbox = self.create_outbox(client, username, self.replay_size if resumable else 0)
+        if resumable and options.get('resume') is not None and \
+                self.resume_session(client, username, options, outbox, compress):
+            return True
+        token = secrets.token_urlsafe(16) if resumable else None
+        if options:
+            # O welcome é o frame número 1 da sessão: entra na fila antes de qualquer outro
+            welcome = {'action': 'welcome', 'compression': self.compression if compress else None}
+            if token is not None:
+                welcome.update(token=token, resumed=False)
+            outbox.put(protocol.encode(welcome))
+        session = self.sessions.register(client, username, outbox)
+        if session is None:
+            stale = self.sessions.get(username)
+            if stale is not None and self.sessions.unregister_detached(stale):
+                # Login sem token com o nome de uma sessão sem conexão: ela é encerrada
+                self.end_session(stale)
+                session = self.sessions.register(client, username, outbox)
+        if session is None:
+            outbox.close()
+            self.send(client, "Nome de usuário já em uso. Tente outro.")
+            client.close()
+            return False
+        session.compress = compress
+        session.token = token
+        log.info("Usuário %s conectado.", username)
+        self.publish_presence(username, True)
+        self.send_roster(client)
+        return True
+
+    def resume_session(self, client, username, options, outbox, compress):
+        """
+        Retoma a sessão de username se o token do handshake conferir: a nova conexão
+        assume a fila de saída e recebe só os frames posteriores a last_seq, sem
+        novo snapshot de contatos, aviso de presença ou drenagem das mensagens
+        offline. Retorna False se não houver sessão a retomar (o cliente recebe uma nova).
+        """
+        resumed = self.sessions.resume(client, username, str(options['resume']))
+        if resumed is None:
+            return False
+        session, previous = resumed
+        expiry, session.expiry = session.expiry, None
+        if expiry is not None:
+            expiry.cancel()
+        if previous is not None:
+            # A conexão antiga ainda não tinha sido detectada como perdida
+            session.outbox.detach()
+            session.outbox.abort()  # Encerra a leitura da conexão antiga
+        welcome = protocol.encode({'action': 'welcome', 'compression': self.compression if compress else None,
+                                   'token': session.token, 'resumed': True})
+        try:
+            last_seq = int(options.get('last_seq', 0))
+        except (TypeError, ValueError):
+            last_seq = -1
+        previous_outbox = session.outbox
+        if not outbox.resume_from(previous_outbox, last_seq, welcome):
+            log.info("Sessão de %s não pôde ser retomada: frames perdidos fora do histórico de reenvio.", username)
+            if self.sessions.unregister(client) is session:
+                self.end_session(session)
+            return False
+        session.outbox = outbox
+        session.compress = compress
+        if previous_outbox.spilled_detached and session.online:
+            # Mensagens que não couberam na fila durante a queda foram para o armazenamento offline
+            threading.Thread(target=self.retrieve_offline_messages, args=(username,)).start()
+        metrics.SESSIONS_RESUMED.inc()
+        log.info("Sessão de %s retomada a partir do frame %s.", username, last_seq)
+        return True
+
+    def remove_session(self, client):
+        """
+        Remove a sessão associada à conexão e fecha o socket. Sessões retomáveis
+        continuam registradas por resume_grace segundos, com a fila de saída
+        acumulando os frames, à espera de que o cliente reconecte.
+        """
+        session = self.sessions.for_client(client)
+        if session is not None and session.token is not None and not self.closing:
+            if self.sessions.detach(client) is session:
+                session.outbox.detach()
+                session.expiry = threading.Timer(self.resume_grace, self.expire_session, (session,))
+                session.expiry.daemon = True
+                session.expiry.start()
+                log.info("Conexão de %s perdida; sessão mantida por %s s.", session.username, self.resume_grace)
+            client.close()
+            return
+        session = self.sessions.unregister(client)
+        if session is not None:
+            self.end_session(session)
+        client.close()
+
+    def expire_session(self, session):
+        """Encerra a sessão se o cliente não reconectou a tempo (executa no temporizador)."""
+        if session.expiry is not threading.current_thread():
+            return  # Sessão retomada, ou temporizador de uma queda anterior
+        if self.sessions.unregister_detached(session):
+            metrics.SESSIONS_EXPIRED.inc()
+            self.end_session(session)
+
+    def end_session(self, session):
+        """
+        Fecha a fila de saída da sessão encerrada e avisa os seguidores. Mensagens
+        de chat que ainda não tinham sido enviadas ao cliente vão para o armazenamento offline.
+        """
+        session.outbox.close()
+        if session.outbox.unsent:
+            self.offline_store.append_many([(session.username, message) for message in session.outbox.unsent])
+        log.info("Usuário %s desconectado.", session.username)
+        self.publish_presence(session.username, None)
+
+    def create_outbox(self, client, username, replay=0):
+        """
+        Cria a fila de saída da conexão e seu escritor (uma thread no motor threaded).
+        - replay: frames guardados para reenvio se a sessão for retomada.
+        """
+        return ThreadedOutbox(client, username, self.outbound_limit, self.slow_consumer_policy,
+                              spill=self.spill_to_offline, coalesce_delay=self.coalesce_delay,
+                              gather=self.gather_writes, replay=replay).start()
+
+    def spill_to_offline(self, username, message):
+        """Desvia para o armazenamento offline uma mensagem que não coube na fila de saída."""
+        self.offline_store.append(username, message)
+
+    def handle_client(self, client, reader):
         """
         Lida com as ações do cliente, como envio de mensagens ou atualizações de status.
+        - reader: FrameReader da conexão (pode já conter frames recebidos junto ao handshake).
         """
         try:
             while True:
-                data = client.recv(4096)
-                if not data:
+                action_data = reader.read()
+                if action_data is None:
                     break
-                action_data = pickle.loads(data)
-                print(f"Ação recebida de {self.clients[client]}: {action_data}")
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Ação recebida de %s: %s", self.sessions.username(client), action_data)
                 self.handle_action(action_data, client)
         except Exception as e:
-            print(f"Erro ao gerenciar cliente {self.clients[client]}: {e}")
+            log.warning("Erro ao gerenciar cliente %s: %s", self.sessions.username(client), e)
         finally:
-            with self.lock:
-                username = self.clients.pop(client, None)
-                self.client_status.pop(username, None)
-                if username:
-                    print(f"Usuário {username} desconectado.")
-            client.close()
-            self.update_user_list(client)
+            self.remove_session(client)
 
     def handle_action(self, action_data, client):
+        """
+        Executa uma ação do cliente, registrando sua latência nas métricas.
+        - action_data: Dicionário com dados de ação do cliente.
+        """
+        action = action_data.get('action')
+        label = action if action in self.actions else 'unknown'
+        if self.over_rate_limit(self.sessions.username(client), '*', label) is not None:
+            self.send(client, "Erro: Muitas requisições. Aguarde um instante e tente novamente.")
+            return
+        start = time.perf_counter()
+        try:
+            self.dispatch_action(action_data, client)
+        except Exception:
+            metrics.ACTION_ERRORS.inc(action=label)
+            raise
+        finally:
+            metrics.ACTION_LATENCY.observe(time.perf_counter() - start, action=label)
+
+    def over_rate_limit(self, username, *keys):
+        """
+        Consome uma ficha de cada limite de keys ('*', nome da ação ou 'offline')
+        e retorna a primeira chave sem saldo, ou None. Os baldes são do usuário,
+        não da conexão: reconectar não renova o saldo. Toda ação recebida, mesmo
+        recusada por outro limite, consome do limite '*'.
+        """
+        for key in keys:
+            limiter = self.rate_limits.get(key)
+            if limiter is not None and not limiter.allow(username):
+                metrics.RATE_LIMITED.inc(action=key)
+                return key
+        return None
+
+    def dispatch_action(self, action_data, client):
         """
         Executa ações baseadas nos dados recebidos do cliente.
         - action_data: Dicionário com dados de ação do cliente.
@@ -140,20 +448,14 @@ class ChatServer:
             message = action_data['message']
 
             # Verificação se o destinatário está na lista de contatos de quem envia a mensagem
-            username = self.clients[client]
-            if target_user not in self.contacts[username]:
-                client.send(pickle.dumps(
-                    f"Erro: Você não pode enviar mensagens para {target_user}, pois ele não está na sua lista de contatos."))
-                print(f"{username} tentou enviar mensagem para {target_user}, que não está na lista de contatos.")
+            username = self.sessions.username(client)
+            if not self.contacts.has(username, target_user):
+                self.send(client,
+                          f"Erro: Você não pode enviar mensagens para {target_user}, pois ele não está na sua lista de contatos.")
+                log.info("%s tentou enviar mensagem para %s, que não está na lista de contatos.", username, target_user)
                 return
 
-            # Verifica se o destinatário está online
-            if self.client_status.get(target_user, False):
-                # Se o destinatário estiver online, envia a mensagem diretamente para ele
-                self.send_private_message(client, message, target_user)
-            else:
-                # Se estiver offline, envia a mensagem para a fila RabbitMQ
-                self.send_message_to_queue(client, target_user, message)
+            self.route_private_message(client, target_user, message)
 
         elif action_data['action'] == 'add_contact':
             contact = action_data['contact']
@@ -164,145 +466,463 @@ class ChatServer:
             self.remove_contact(client, contact)
 
         elif action_data['action'] == 'status_update':
-            with self.lock:
-                self.client_status[self.clients[client]] = action_data['status']
-            print(f"{self.clients[client]} mudou para {'online' if action_data['status'] else 'offline'}")
+            username = self.sessions.username(client)
+            self.sessions.set_online(username, action_data['status'])
+            log.info("%s mudou para %s", username, 'online' if action_data['status'] else 'offline')
+            self.publish_presence(username, action_data['status'])
 
-            # Se o cliente ficar online, busca mensagens offline no broker do RabbitMQ
+            # Se o cliente ficar online, busca suas mensagens offline
             if action_data['status']:
-                threading.Thread(target=self.retrieve_offline_messages, args=(self.clients[client],)).start()
+                threading.Thread(target=self.retrieve_offline_messages, args=(username,)).start()
+
+        elif action_data['action'] == 'roster_sync':
+            # O cliente detectou um delta perdido (ex.: descartado pela política 'drop')
+            self.send_roster(client)
+
+        elif action_data['action'] == 'create_channel':
+            self.create_channel(client, action_data['channel'])
+
+        elif action_data['action'] == 'join_channel':
+            self.join_channel(client, action_data['channel'])
+
+        elif action_data['action'] == 'leave_channel':
+            self.leave_channel(client, action_data['channel'])
+
+        elif action_data['action'] == 'post_channel':
+            self.post_channel(client, action_data['channel'], action_data['message'])
+
+        elif action_data['action'] == 'history':
+            self.send_history(client, action_data)
+
+        elif action_data['action'] == 'search_history':
+            self.search_history(client, action_data)
+
+    def route_private_message(self, client, target_user, message):
+        """Entrega a mensagem diretamente ou a guarda offline, conforme o status do destinatário."""
+        # Verifica se o destinatário está online
+        if self.sessions.is_online(target_user):
+            # Se o destinatário estiver online, envia a mensagem diretamente para ele
+            self.send_private_message(client, message, target_user)
+        else:
+            # Se estiver offline, guarda a mensagem no armazenamento offline
+            self.send_message_to_queue(client, target_user, message)
+
+    def user_exists(self, username):
+        """True se o usuário estiver conectado ao servidor."""
+        return username in self.sessions
+
+    def publish_presence(self, username, status):
+        """
+        Notifica mudanças de presença: True (online), False (offline) ou None
+        (desconectado). O delta vai apenas para quem tem username como contato.
+        """
+        self.notify_followers(username, status)
+
+    def notify_followers(self, username, status):
+        """Envia o delta de presença aos usuários conectados que têm username como contato."""
+        change = ['online' if status else 'offline', username]
+        for follower in self.contacts.followers_of(username):
+            session = self.sessions.get(follower)
+            if session is not None:
+                self.send_roster_delta(session, [change])
+
+    def presence_of(self, username):
+        """Status exibido na lista de contatos: 'online' ou 'offline'."""
+        return 'online' if self.sessions.is_online(username) else 'offline'
+
+    def send_roster(self, client):
+        """
+        Envia o snapshot da lista de contatos com presença, na versão atual da
+        sessão. Os deltas seguintes partem dessa versão, um número por delta.
+        """
+        session = self.sessions.for_client(client)
+        if session is None:
+            return
+        with session.roster_lock:
+            contacts = [[contact, self.presence_of(contact)] for contact in self.contacts.contacts_of(session.username)]
+            # Espera espaço na fila: sem o snapshot o cliente não consegue aplicar os deltas
+            self.send(client, {'action': 'roster', 'version': session.roster_version, 'contacts': contacts},
+                      block=True)
+
+    def send_roster_delta(self, session, changes):
+        """
+        Envia alterações compactas da lista de contatos: ['add', contato, status],
+        ['remove', contato], ['online', contato] ou ['offline', contato].
+        """
+        with session.roster_lock:
+            session.roster_version += 1
+            # Direto na fila da sessão: se o usuário acabou de desconectar, a fila fechada descarta o frame
+            self.send_to(session, {'action': 'roster_delta', 'version': session.roster_version, 'changes': changes})
 
     def retrieve_offline_messages(self, username):
         """
-        Busca as mensagens offline da fila RabbitMQ e as envia ao cliente.
+        Busca as mensagens offline do usuário e as envia ao cliente.
         """
         try:
-            if self.rabbitmq_connection.is_closed:
-                print("Conexão com RabbitMQ perdida. Tentando reconectar...")
-                self.connect_rabbitmq()
-
-            messages = []
-            while True:
-                method_frame, properties, body = self.rabbitmq_channel.basic_get(queue=username, auto_ack=False)
-                if method_frame:
-                    messages.append(body.decode())
-                    self.rabbitmq_channel.basic_ack(method_frame.delivery_tag)
-                else:
-                    break
+            delivered = 0
+            # Cada lote só é removido do armazenamento depois de entregue ao cliente
+            with closing(self.offline_store.drain(username, batch_size=self.offline_batch_size)) as batches:
+                for messages in batches:
+                    if not self.send_offline_messages_to_client(username, messages):
+                        break
+                    delivered += len(messages)
 
-            if messages:
-                print(f"Entregando {len(messages)} mensagens offline para {username}")
-                self.send_offline_messages_to_client(username, messages)
+            if delivered:
+                log.info("%s mensagens offline entregues a %s.", delivered, username)
 
         except Exception as e:
-            print(f"Erro ao consumir mensagens offline para {username}: {e}")
-            self.connect_rabbitmq()
+            log.error("Erro ao consumir mensagens offline para %s: %s", username, e)
 
     def send_offline_messages_to_client(self, username, messages):
         """
-        Envia todas as mensagens offline para o cliente quando ele voltar online.
+        Envia um lote de mensagens offline para o cliente quando ele voltar online.
+        Retorna False se o cliente não estiver mais conectado ou o envio falhar.
         """
-        target_client = next((c for c, u in self.clients.items() if u == username), None)
-        if target_client:
-            try:
-                target_client.send(pickle.dumps(messages))
-                print(f"Mensagens offline entregues a {username}.")
-            except Exception as e:
-                print(f"Erro ao enviar mensagens offline para {username}: {e}")
+        target = self.sessions.get(username)
+        if target:
+            # Espera haver espaço na fila de saída em vez de aplicar a política de consumidor lento
+            delivery = Delivery()
+            if not self.send_to(target, messages, block=True, delivery=delivery):
+                return False
+            # O lote só é confirmado no armazenamento depois que o escritor o enviou
+            return delivery.wait()
+        return False
 
     def add_contact(self, client, contact):
         """
         Adiciona um contato à lista de contatos do cliente.
         """
-        username = self.clients[client]
+        username = self.sessions.username(client)
 
         if contact == username:
-            client.send(pickle.dumps("Você não pode adicionar a si mesmo como contato."))
-            print(f"{username} tentou se adicionar como contato.")
+            self.send(client, "Você não pode adicionar a si mesmo como contato.")
+            log.info("%s tentou se adicionar como contato.", username)
             return
 
-        if contact in self.client_status:
-            if contact not in self.contacts[username]:
-                self.contacts[username].append(contact)
-                self.update_user_list(client)
-                client.send(pickle.dumps(f"Contato {contact} adicionado."))
-                print(f"Contato {contact} adicionado para {username}.")
+        if self.user_exists(contact):
+            if self.contacts.add(username, contact):
+                self.send_roster_delta(self.sessions.get(username), [['add', contact, self.presence_of(contact)]])
+                self.send(client, f"Contato {contact} adicionado.")
+                log.info("Contato %s adicionado para %s.", contact, username)
             else:
-                client.send(pickle.dumps(f"Contato {contact} já está na lista."))
+                self.send(client, f"Contato {contact} já está na lista.")
         else:
-            client.send(pickle.dumps(f"Contato {contact} não existe."))
+            self.send(client, f"Contato {contact} não existe.")
 
     def remove_contact(self, client, contact):
         """
         Remove um contato da lista de contatos do cliente.
         """
-        username = self.clients[client]
-        if contact in self.contacts[username]:
-            self.contacts[username].remove(contact)
-            self.update_user_list(client)
-            client.send(pickle.dumps(f"Contato {contact} removido."))
-            print(f"Contato {contact} removido de {username}.")
+        username = self.sessions.username(client)
+        if self.contacts.remove(username, contact):
+            self.send_roster_delta(self.sessions.get(username), [['remove', contact]])
+            self.send(client, f"Contato {contact} removido.")
+            log.info("Contato %s removido de %s.", contact, username)
+        else:
+            self.send(client, f"Contato {contact} não está na lista.")
+
+    def create_channel(self, client, channel):
+        """Cria um canal tendo quem o criou como primeiro membro."""
+        username = self.sessions.username(client)
+        if not valid_channel_name(channel):
+            self.send(client, "Nome de canal inválido.")
+        elif self.channels.exists(channel):
+            self.send(client, f"Canal {channel} já existe.")
         else:
-            client.send(pickle.dumps(f"Contato {contact} não está na lista."))
+            self.channels.join(channel, username)
+            self.send(client, f"Canal {channel} criado.")
+            log.info("Canal %s criado por %s.", channel, username)
+
+    def channel_exists(self, channel):
+        """True se o canal tiver algum membro."""
+        return self.channels.exists(channel)
+
+    def join_channel(self, client, channel):
+        """Adiciona o cliente a um canal existente."""
+        username = self.sessions.username(client)
+        if not valid_channel_name(channel) or not self.channel_exists(channel):
+            self.send(client, f"Canal {channel} não existe.")
+        elif self.channels.join(channel, username):
+            self.send(client, f"Você entrou no canal {channel}.")
+        else:
+            self.send(client, f"Você já participa do canal {channel}.")
+
+    def leave_channel(self, client, channel):
+        """Remove o cliente de um canal."""
+        username = self.sessions.username(client)
+        if self.channels.leave(channel, username):
+            self.send(client, f"Você saiu do canal {channel}.")
+        else:
+            self.send(client, f"Você não participa do canal {channel}.")
+
+    def post_channel(self, client, channel, message):
+        """Envia uma mensagem a todos os membros do canal e confirma ao remetente."""
+        username = self.sessions.username(client)
+        if not self.channels.is_member(channel, username):
+            self.send(client, f"Erro: Você não participa do canal {channel}.")
+            return
+        text = f"[{channel}] {username}: {message}"
+
+        def confirm():
+            self.history.append(channel_conversation(channel), username, message)
+            self.send(client, f"Você em [{channel}]: {message}")
+
+        def failed(e):
+            log.error("Erro ao armazenar mensagens offline do canal %s: %s", channel, e)
+
+        try:
+            stored = self.publish_to_channel(channel, text, exclude=username, message=message)
+        except Exception as e:
+            failed(e)
+            return
+        if stored is None:
+            confirm()
+        else:
+            # Confirma depois da gravação, em lote, das cópias dos membros offline
+            self.when_stored(stored, confirm, failed)
+
+    def when_stored(self, future, on_stored, on_error):
+        """
+        Chama on_stored() quando o armazenamento offline confirmar a gravação de
+        future, ou on_error(exceção) se ela falhar ou passar de publish_timeout.
+        No motor com threads, a thread da conexão espera pela confirmação.
+        """
+        try:
+            future.result(timeout=self.publish_timeout)
+        except Exception as e:
+            on_error(e)
+            return
+        on_stored()
+
+    def publish_to_channel(self, channel, text, exclude=None, message=None):
+        """
+        Entrega o texto aos membros do canal neste servidor (ver fan_out).
+        - exclude: remetente, que não recebe a própria mensagem.
+        - message: mensagem original (sem o prefixo do canal), usada pelo modo multiprocesso.
+        """
+        return self.fan_out(channel, text, exclude)
+
+    def fan_out(self, channel, text, exclude=None):
+        """
+        Entrega o texto aos membros locais do canal, exceto exclude. O frame é
+        codificado uma única vez por variante (com e sem compressão) e o mesmo
+        buffer vai para a fila de saída de cada membro online; os demais recebem a
+        mensagem em uma única gravação em lote no armazenamento offline. Retorna o
+        Future dessa gravação, ou None.
+        """
+        frames = {}
+        offline = []
+        for member in self.channels.members(channel):
+            if member == exclude:
+                continue
+            session = self.sessions.get(member)
+            if session is not None and session.online:
+                frame = frames.get(session.compress)
+                if frame is None:
+                    frame = frames[session.compress] = protocol.encode(text, session.compress)
+                session.outbox.put(frame, text)
+            else:
+                offline.append((member, text))
+        if not offline:
+            return None
+        return self.offline_store.append_many(offline)
 
     def send_private_message(self, client, message, target_user):
         """
         Envia mensagem diretamente para um cliente, caso esteja online.
         """
-        username = self.clients[client]
+        username = self.sessions.username(client)
 
-        if target_user not in self.contacts[username]:
-            client.send(pickle.dumps(
-                f"Erro: Você não pode enviar mensagens para {target_user}, pois ele não está na sua lista de contatos."))
-            print(f"{username} tentou enviar mensagem para {target_user}, que não está na lista de contatos.")
+        if not self.contacts.has(username, target_user):
+            self.send(client,
+                      f"Erro: Você não pode enviar mensagens para {target_user}, pois ele não está na sua lista de contatos.")
+            log.info("%s tentou enviar mensagem para %s, que não está na lista de contatos.", username, target_user)
             return
 
-        target_client = next((c for c, u in self.clients.items() if u == target_user), None)
-        if target_client:
+        target = self.sessions.get(target_user)
+        if target:
             try:
-                target_client.send(pickle.dumps(f"{self.clients[client]} (privado): {message}"))
-                client.send(pickle.dumps(f"Você para ({target_user}): {message}"))
+                text = f"{username} (privado): {message}"
+                if not self.send_to(target, text, spill_message=text):
+                    self.send(client, f"Erro: A mensagem para {target_user} não foi entregue. Tente novamente.")
+                    return
+                self.history.append(private_conversation(username, target_user), username, message)
+                self.send(client, f"Você para ({target_user}): {message}")
             except Exception as e:
-                print(f"Erro ao enviar mensagem para {target_user}: {e}")
+                log.warning("Erro ao enviar mensagem para %s: %s", target_user, e)
         else:
-            print(f"Usuário {target_user} não encontrado online.")
+            log.info("Usuário %s não encontrado online.", target_user)
 
     def send_message_to_queue(self, client, target_user, message):
         """
-        Envia mensagem para a fila do destinatário no RabbitMQ e confirma ao remetente.
+        Guarda a mensagem na fila offline do destinatário e confirma ao remetente.
         """
-        try:
-            if self.rabbitmq_connection.is_closed:
-                print("Conexão com RabbitMQ perdida. Tentando reconectar...")
-                self.connect_rabbitmq()
-
-            self.rabbitmq_channel.basic_publish(
-                exchange='',
-                routing_key=target_user,
-                body=message,
-                properties=pika.BasicProperties(delivery_mode=2)  # Persistência da mensagem
-            )
-            print(f"Mensagem para {target_user} armazenada na fila RabbitMQ.")
-            client.send(pickle.dumps(f"Você (privado): {message}"))
+        username = self.sessions.username(client)
+        if self.over_rate_limit(username, 'offline') is not None:
+            self.send(client,
+                      f"Erro: Limite de mensagens offline excedido. A mensagem para {target_user} não foi enviada.")
+            return
+
+        def confirm():
+            log.debug("Mensagem para %s armazenada na fila offline.", target_user)
+            self.history.append(private_conversation(username, target_user), username, message)
+            self.send(client, f"Você (privado): {message}")
 
+        def failed(e):
+            log.error("Erro ao armazenar mensagem offline para %s: %s", target_user, e)
+
+        try:
+            stored = self.offline_store.append(target_user, message)
         except Exception as e:
-            print(f"Erro ao enviar mensagem para a fila do RabbitMQ: {e}")
-            self.connect_rabbitmq()
+            failed(e)
+            return
+        # Confirma depois da gravação (no broker, a do lote em que a mensagem entrou)
+        self.when_stored(stored, confirm, failed)
 
-    def update_user_list(self, client):
-        """Atualiza a lista de contatos de um cliente."""
-        username = self.clients[client]
-        user_list = self.contacts[username]
-        client.send(pickle.dumps({'action': 'update_user_list', 'user_list': user_list}))
+    def requested_conversation(self, username, action_data):
+        """
+        Conversa indicada em uma consulta ao histórico: 'with' (outro usuário) ou
+        'channel' (canal de que o usuário participa). None se não houver acesso.
+        """
+        if 'channel' in action_data:
+            channel = action_data['channel']
+            return channel_conversation(channel) if self.channels.is_member(channel, username) else None
+        return private_conversation(username, action_data['with'])
+
+    def send_history(self, client, action_data):
+        """
+        Envia uma página do histórico de uma conversa: as últimas 'limit' mensagens
+        ou, com 'before', as anteriores a esse id. O 'cursor' da resposta é o
+        'before' da página seguinte (None quando a página veio vazia).
+        """
+        username = self.sessions.username(client)
+        conversation = self.requested_conversation(username, action_data)
+        if conversation is None:
+            self.send(client, "Erro: Você não tem acesso a esse histórico.")
+            return
+        records = self.history.before(conversation, action_data.get('before'), action_data.get('limit', 50))
+        messages = [{'id': message_id, 'timestamp': timestamp, 'sender': sender, 'message': text}
+                    for message_id, timestamp, sender, text in records]
+        reply = describe_conversation(conversation, username)
+        reply.update(action='history', messages=messages, cursor=records[0][0] if records else None)
+        self.send(client, reply)
+
+    def search_history(self, client, action_data):
+        """
+        Busca por palavras no histórico: em uma conversa ('with' ou 'channel') ou
+        em todas as conversas do usuário. Resultados do mais recente ao mais antigo.
+        """
+        username = self.sessions.username(client)
+        if 'with' in action_data or 'channel' in action_data:
+            conversation = self.requested_conversation(username, action_data)
+            conversations = [conversation] if conversation is not None else []
+        else:
+            conversations = self.history.conversations_of(username)
+            conversations.update(channel_conversation(channel) for channel in self.channels.channels_of(username))
+        results = self.history.search(conversations, action_data['query'], action_data.get('limit', 50))
+        messages = [dict(describe_conversation(conversation, username), id=message_id, timestamp=timestamp,
+                         sender=sender, message=text)
+                    for message_id, timestamp, sender, text, conversation in results]
+        self.send(client, {'action': 'search_results', 'query': action_data['query'], 'messages': messages})
+
+    def send(self, client, obj, spill_message=None, block=False):
+        """
+        Enfileira um objeto, como frame do protocolo, na fila de saída do cliente.
+        - spill_message: texto guardado offline se a política for 'spill' e a fila estiver cheia.
+        - block: espera haver espaço na fila em vez de aplicar a política de consumidor lento.
+        Retorna False se o frame não foi enfileirado. Conexões ainda sem sessão
+        (ex.: nome de usuário recusado) recebem o frame diretamente.
+        """
+        session = self.sessions.for_client(client)
+        if session is None:
+            client.sendall(protocol.encode(obj))
+            return True
+        return self.send_to(session, obj, spill_message, block)
+
+    def send_to(self, session, obj, spill_message=None, block=False, delivery=None):
+        """
+        Enfileira um objeto na fila de saída da sessão (mesmos parâmetros de send).
+        Funciona também com a sessão sem conexão, à espera de ser retomada.
+        - delivery: Delivery avisado quando o frame for enviado (ver Outbox.put).
+        """
+        return session.outbox.put(protocol.encode(obj, session.compress), spill_message, block=block,
+                                  delivery=delivery)
+
+    def outbound_metrics(self):
+        """Métricas das filas de saída por usuário conectado."""
+        return {session.username: session.outbox.stats() for session in self.sessions.all()}
 
     def shutdown(self):
         """Encerra o servidor e desconecta todos os clientes."""
-        print("Encerrando o servidor...")
+        log.info("Encerrando o servidor...")
+        self.closing = True
         with self.lock:
-            for client in self.clients.keys():
-                client.close()
-            self.server_socket.close()
-            self.rabbitmq_connection.close()
+            for session in self.sessions.all():
+                if session.client is not None:
+                    session.client.close()
+            if self.server_socket is not None:
+                self.server_socket.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.offline_store.close()
+        self.contacts.close()
+        self.channels.close()
+        self.history.close()
+
+
+def rate_limiters(limits):
+    """Cria um RateLimiter para cada limite (rate, burst) de limits; rate 0 desativa o limite."""
+    return {key: RateLimiter(rate, burst) for key, (rate, burst) in limits.items() if rate > 0}
+
+
+def parse_rate_limit(value):
+    """Converte 'chave=taxa[/rajada]' (argumento --rate-limit) em (chave, (taxa, rajada))."""
+    key, sep, spec = value.partition('=')
+    rate, _, burst = spec.partition('/')
+    try:
+        rate = float(rate)
+        burst = float(burst) if burst else max(rate, 1.0)
+    except ValueError:
+        rate = -1
+    if not key or not sep or rate < 0 or burst < 1:
+        raise argparse.ArgumentTypeError(f"Limite inválido: {value!r} (use chave=taxa[/rajada])")
+    return key, (rate, burst)
+
+
+def build_server(args, server_class=ChatServer, data_dir=None, **kwargs):
+    """
+    Monta um servidor e seus armazenamentos a partir dos argumentos da linha de comando.
+    - data_dir: diretório de dados (padrão: args.data_dir).
+    """
+    data_dir = data_dir or args.data_dir
+    contacts = ContactGraph(os.path.join(data_dir, 'contacts'))
+    channels = ChannelDirectory(os.path.join(data_dir, 'channels'))
+    history = MessageHistory(os.path.join(data_dir, 'history'))
+
+    if args.offline_store == 'log':
+        offline_store = LogOfflineStore(os.path.join(data_dir, 'offline'))
+    elif args.offline_store == 'memory':
+        offline_store = BrokerOfflineStore(BrokerPool(InMemoryBroker().connect), prefetch=args.offline_prefetch)
+    else:
+        offline_store = BrokerOfflineStore(BrokerPool(rabbitmq_connector(args.rabbitmq_host)),
+                                           prefetch=args.offline_prefetch)
+
+    kwargs.setdefault('max_clients', args.max_clients)
+    server = server_class(host=args.host, port=args.port, offline_store=offline_store, contacts=contacts,
+                          channels=channels, history=history, **kwargs)
+    server.offline_batch_size = args.offline_batch
+    server.outbound_limit = args.outbound_limit
+    server.slow_consumer_policy = args.slow_consumer
+    server.compression = None if args.compression == 'off' else args.compression
+    server.coalesce_delay = args.coalesce_ms / 1000
+    server.gather_writes = args.writev
+    server.resume_grace = args.resume_grace
+    server.replay_size = args.replay_size
+    server.admission_timeout = args.admission_timeout
+    if args.accept_rate > 0:
+        server.accept_limiter = TokenBucket(args.accept_rate, max(args.accept_rate, 1.0))
+    server.rate_limits = rate_limiters(dict(DEFAULT_RATE_LIMITS, **dict(args.rate_limit)))
+    return server
 
 
 if __name__ == '__main__':
@@ -310,7 +930,73 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Servidor de Chat com RabbitMQ")
     parser.add_argument('--host', type=str, default='0.0.0.0', help='IP para o servidor escutar (padrão: 0.0.0.0)')
     parser.add_argument('--port', type=int, required=True, help='Porta para o servidor escutar')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded',
+                        help='Motor de conexões: uma thread por cliente ou loop asyncio (padrão: threaded)')
+    parser.add_argument('--offline-store', choices=['rabbitmq', 'memory', 'log'], default='rabbitmq',
+                        help='Armazenamento de mensagens offline: RabbitMQ, broker em memória (sem persistência) '
+                             'ou log local em disco (padrão: rabbitmq)')
+    parser.add_argument('--data-dir', type=str, default='data',
+                        help='Diretório dos dados locais do servidor (padrão: data)')
+    parser.add_argument('--rabbitmq-host', type=str, default='localhost', help='Host do RabbitMQ (padrão: localhost)')
+    parser.add_argument('--offline-prefetch', type=int, default=500,
+                        help='Mensagens offline em trânsito por consumidor do broker (padrão: 500)')
+    parser.add_argument('--offline-batch', type=int, default=100,
+                        help='Mensagens offline por lote enviado ao cliente (padrão: 100)')
+    parser.add_argument('--outbound-limit', type=int, default=1000,
+                        help='Frames na fila de saída de cada conexão (padrão: 1000)')
+    parser.add_argument('--slow-consumer', choices=POLICIES, default='drop',
+                        help='O que fazer quando a fila de saída de um cliente enche: descartar, '
+                             'desviar para o armazenamento offline ou desconectar (padrão: drop)')
+    parser.add_argument('--compression', choices=[*protocol.COMPRESSIONS, 'off'], default='zlib',
+                        help='Compressão oferecida aos clientes que a pedirem no handshake (padrão: zlib)')
+    parser.add_argument('--coalesce-ms', type=float, default=0.0,
+                        help='Milissegundos que cada conexão espera por mais frames antes de escrever (padrão: 0)')
+    parser.add_argument('--writev', action=argparse.BooleanOptionalAction, default=True,
+                        help='Envia os frames pendentes de uma conexão em uma única escrita (padrão: ativado)')
+    parser.add_argument('--resume-grace', type=float, default=30.0,
+                        help='Segundos que a sessão de um cliente que caiu aguarda reconexão (padrão: 30; 0 desativa)')
+    parser.add_argument('--replay-size', type=int, default=256,
+                        help='Frames guardados por sessão para reenvio ao reconectar (padrão: 256)')
+    parser.add_argument('--max-clients', type=int, default=10000,
+                        help='Conexões atendidas ao mesmo tempo; no modo multiprocesso, divididas entre os shards '
+                             '(padrão: 10000)')
+    parser.add_argument('--admission-timeout', type=float, default=1.0,
+                        help='Segundos que as conexões aguardam vaga com o servidor cheio antes de serem recusadas '
+                             '(padrão: 1)')
+    parser.add_argument('--accept-rate', type=float, default=0.0,
+                        help='Conexões aceitas por segundo (padrão: 0, sem limite)')
+    default_limits = ', '.join(f"{key}={rate:g}/{burst:g}" for key, (rate, burst) in DEFAULT_RATE_LIMITS.items())
+    parser.add_argument('--rate-limit', type=parse_rate_limit, action='append', default=[],
+                        metavar='CHAVE=TAXA[/RAJADA]',
+                        help="Limite de ações por usuário, repetível: '*' (todas), nome da ação ou 'offline' "
+                             f"(mensagens para usuários offline); taxa 0 desativa (padrão: {default_limits})")
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processos (shards) do servidor; usuários são distribuídos por hash do nome (padrão: 1)')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help='Nível mínimo de log (padrão: INFO)')
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help='Registra 1 a cada N eventos de nível DEBUG, como cada ação recebida (padrão: 1)')
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1',
+                        help='IP do endpoint de métricas (padrão: 127.0.0.1)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Porta do endpoint HTTP de métricas no formato do Prometheus (padrão: desativado)')
     args = parser.parse_args()
 
-    server = ChatServer(host=args.host, port=args.port)
-    server.start()
+    if args.workers > 1:
+        if args.engine != 'threaded':
+            parser.error("--workers só é suportado com --engine threaded")
+        from sharding import ShardedServer
+        server = ShardedServer(args)  # Cada processo configura o próprio log após o fork
+    else:
+        logs.setup_logging(args.log_level, args.log_sample)
+        if args.engine == 'asyncio':
+            from async_server import AsyncChatServer
+            server = build_server(args, AsyncChatServer)
+        else:
+            server = build_server(args)
+        if args.metrics_port is not None:
+            server.start_metrics(args.metrics_host, args.metrics_port)
+    try:
+        server.start()
+    finally:
+        logs.shutdown_logging()
@@ -0,0 +1,205 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+import hmac
+import threading
+
+import metrics
+
+
+class Session:
+    """
+    Estado de um usuário conectado: nome, conexão, fila de saída, status
+    online/offline, versão da lista de contatos já enviada ao cliente, se a
+    compressão foi negociada no handshake e, em sessões retomáveis, o token de
+    reconexão e o temporizador que encerra a sessão se o cliente não voltar.
+    """
+
+    __slots__ = ('username', 'client', 'outbox', 'online', 'roster_version', 'roster_lock', 'compress', 'token',
+                 'expiry')
+
+    def __init__(self, username, client, outbox=None):
+        self.username = username
+        self.client = client
+        self.outbox = outbox
+        self.online = True  # O cliente começa online
+        self.roster_version = 0
+        self.roster_lock = threading.Lock()  # Numera e enfileira os deltas na mesma ordem
+        self.compress = False
+        self.token = None  # Token de retomada (None: sessão termina junto com a conexão)
+        self.expiry = None  # threading.Timer ativo enquanto a sessão está sem conexão
+
+
+class Partition:
+    """Parte dos índices de um SessionRegistry, com seu próprio lock."""
+
+    __slots__ = ('by_username', 'by_client', 'lock')
+
+    def __init__(self):
+        self.by_username = {}
+        self.by_client = {}
+        self.lock = metrics.InstrumentedLock('sessions')
+
+
+class SessionRegistry:
+    """
+    Índice bidirecional nome de usuário <-> conexão, particionado por hash: o
+    nome de usuário escolhe a partição de by_username e a conexão, a de
+    by_client. Cada partição tem seu lock, então operações de usuários
+    diferentes raramente disputam o mesmo lock. Todas as consultas são O(1)
+    e feitas com o lock da partição.
+
+    Nenhuma operação segura dois locks ao mesmo tempo: registro e remoção
+    atualizam um índice e depois o outro, e por um instante a sessão pode
+    aparecer só em um deles (ex.: encontrada pelo nome, mas não pela conexão
+    que está sendo encerrada).
+    """
+
+    def __init__(self, partitions=64):
+        self.partitions = [Partition() for _ in range(partitions)]
+
+    def users(self, username):
+        """Partição que indexa username."""
+        return self.partitions[hash(username) % len(self.partitions)]
+
+    def connections(self, client):
+        """Partição que indexa a conexão."""
+        return self.partitions[hash(client) % len(self.partitions)]
+
+    def register(self, client, username, outbox=None):
+        """Cria a sessão do usuário. Retorna None se o nome já estiver em uso."""
+        users = self.users(username)
+        with users.lock:
+            if username in users.by_username:
+                return None
+            session = Session(username, client, outbox)
+            users.by_username[username] = session
+        connections = self.connections(client)
+        with connections.lock:
+            connections.by_client[client] = session
+        return session
+
+    def unregister(self, client):
+        """Remove a sessão associada à conexão e a retorna (ou None)."""
+        connections = self.connections(client)
+        with connections.lock:
+            session = connections.by_client.pop(client, None)
+        if session is not None:
+            users = self.users(session.username)
+            with users.lock:
+                if users.by_username.get(session.username) is session:
+                    del users.by_username[session.username]
+        return session
+
+    def detach(self, client):
+        """
+        Desassocia a conexão da sessão, que continua registrada (sem conexão) à
+        espera de ser retomada. Retorna a sessão, ou None se a conexão não tinha
+        sessão (ou se ela já foi retomada em outra conexão).
+        """
+        connections = self.connections(client)
+        with connections.lock:
+            session = connections.by_client.pop(client, None)
+        if session is None:
+            return None
+        with self.users(session.username).lock:
+            if session.client is not client:
+                return None
+            session.client = None
+        return session
+
+    def resume(self, client, username, token):
+        """
+        Associa a nova conexão à sessão de username se o token conferir. Retorna
+        (sessão, conexão anterior ou None), ou None se não houver sessão retomável.
+        """
+        users = self.users(username)
+        with users.lock:
+            session = users.by_username.get(username)
+            if session is None or session.token is None or not hmac.compare_digest(session.token, token):
+                return None
+            previous = session.client
+            session.client = client
+        if previous is not None:
+            connections = self.connections(previous)
+            with connections.lock:
+                if connections.by_client.get(previous) is session:
+                    del connections.by_client[previous]
+        connections = self.connections(client)
+        with connections.lock:
+            connections.by_client[client] = session
+        return session, previous
+
+    def unregister_detached(self, session):
+        """Remove a sessão se ela ainda estiver sem conexão. Retorna True se removeu."""
+        users = self.users(session.username)
+        with users.lock:
+            if session.client is not None or users.by_username.get(session.username) is not session:
+                return False
+            del users.by_username[session.username]
+            return True
+
+    def get(self, username):
+        """Sessão do usuário, ou None se não estiver conectado."""
+        users = self.users(username)
+        with users.lock:
+            return users.by_username.get(username)
+
+    def for_client(self, client):
+        """Sessão associada à conexão, ou None."""
+        connections = self.connections(client)
+        with connections.lock:
+            return connections.by_client.get(client)
+
+    def username(self, client):
+        """Nome de usuário associado à conexão, ou None."""
+        session = self.for_client(client)
+        return session.username if session is not None else None
+
+    def set_online(self, username, online):
+        """Atualiza o status online/offline do usuário, se conectado."""
+        users = self.users(username)
+        with users.lock:
+            session = users.by_username.get(username)
+            if session is not None:
+                session.online = online
+
+    def is_online(self, username):
+        """True se o usuário estiver conectado e com status online."""
+        users = self.users(username)
+        with users.lock:
+            session = users.by_username.get(username)
+            return session is not None and session.online
+
+    def all(self):
+        """Cópia da lista de sessões ativas (cada partição copiada com seu lock)."""
+        sessions = []
+        for partition in self.partitions:
+            with partition.lock:
+                sessions.extend(partition.by_username.values())
+        return sessions
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def __len__(self):
+        return sum(len(partition.by_username) for partition in self.partitions)
@@ -0,0 +1,415 @@
+# -----------------------------------------------------------------------------
+# Copyright 2024 Lucas Fernandes
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the “Software”), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+# -----------------------------------------------------------------------------
+
+
+"""
+Modo multiprocesso do servidor.
+
+O processo principal (ShardedServer) escuta a porta pública, lê o handshake de
+cada conexão e repassa o descritor do socket, junto com os bytes já lidos, ao
+shard dono do usuário (hash do nome de usuário). Cada shard é um processo com
+seu próprio ChatServer (ShardServer), contatos e armazenamento offline.
+
+Mensagens para usuários de outro shard trafegam por um barramento local de
+sockets Unix (ShardBus) entre os shards, e mudanças de presença são
+difundidas a todos, para que cada shard saiba quais usuários existem.
+"""
+
+import logging
+import multiprocessing
+import os
+import selectors
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import logs
+import protocol
+from history import channel_conversation, private_conversation
+from server import ChatServer, build_server
+
+log = logging.getLogger('chat.sharding')
+
+MAX_HANDSHAKE = 64 * 1024  # Bytes aceitos antes de o handshake estar completo
+
+
+def shard_for(username, shards):
+    """Shard dono do usuário (hash estável entre processos)."""
+    return zlib.crc32(str(username).encode('utf-8')) % shards
+
+
+def first_frame(buffer):
+    """Decodifica o primeiro frame do buffer, ou retorna None se ainda estiver incompleto."""
+    if len(buffer) < protocol.HEADER.size:
+        return None
+    length, codec = protocol.HEADER.unpack_from(buffer)
+    end = protocol.HEADER.size + length
+    if len(buffer) < end:
+        return None
+    return protocol.decode_body(codec, bytes(buffer[protocol.HEADER.size:end]))
+
+
+class ShardBus:
+    """
+    Barramento entre shards: cada shard escuta em <runtime_dir>/shard-<id>.sock e
+    mantém uma conexão de saída por shard vizinho. Mensagens são dicionários
+    enviados como frames do protocolo e entregues a handler(mensagem).
+    """
+
+    def __init__(self, shard_id, shards, runtime_dir, handler):
+        self.shard_id = shard_id
+        self.shards = shards
+        self.runtime_dir = runtime_dir
+        self.handler = handler
+        self.peers = {}
+        self.peer_locks = {i: threading.Lock() for i in range(shards)}
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path_for(shard_id))
+        self.listener.listen()
+        threading.Thread(target=self.accept_loop, name="shard-bus", daemon=True).start()
+
+    def path_for(self, shard_id):
+        return os.path.join(self.runtime_dir, f"shard-{shard_id}.sock")
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.read_loop, args=(conn,), daemon=True).start()
+
+    def read_loop(self, conn):
+        reader = protocol.FrameReader(conn)
+        try:
+            while True:
+                message = reader.read()
+                if message is None:
+                    break
+                try:
+                    self.handler(message)
+                except Exception as e:
+                    log.error("Erro ao processar mensagem do barramento: %s", e)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def connect(self, shard_id, attempts=50):
+        """Abre a conexão com um shard, aguardando-o começar a escutar."""
+        for _ in range(attempts):
+            try:
+                conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                conn.connect(self.path_for(shard_id))
+                return conn
+            except (FileNotFoundError, ConnectionRefusedError):
+                conn.close()
+                time.sleep(0.1)
+        raise ConnectionError(f"Shard {shard_id} indisponível")
+
+    def send(self, shard_id, message):
+        """Envia uma mensagem a um shard, reconectando uma vez em caso de falha."""
+        frame = protocol.encode(message)
+        with self.peer_locks[shard_id]:
+            for attempt in range(2):
+                conn = self.peers.get(shard_id)
+                try:
+                    if conn is None:
+                        conn = self.peers[shard_id] = self.connect(shard_id)
+                    conn.sendall(frame)
+                    return
+                except OSError:
+                    self.peers.pop(shard_id, None)
+                    if conn is not None:
+                        conn.close()
+                    if attempt:
+                        raise
+
+    def broadcast(self, message):
+        """Envia uma mensagem a todos os outros shards."""
+        for shard_id in range(self.shards):
+            if shard_id != self.shard_id:
+                try:
+                    self.send(shard_id, message)
+                except OSError as e:
+                    log.warning("Erro ao difundir mensagem para o shard %s: %s", shard_id, e)
+
+    def close(self):
+        self.listener.close()
+        for conn in list(self.peers.values()):
+            conn.close()
+
+
+class ShardServer(ChatServer):
+    """
+    ChatServer de um shard: não escuta a porta pública; recebe conexões já
+    aceitas pelo processo principal e encaminha mensagens para outros shards.
+    """
+
+    def __init__(self, shard_id, shards, handoff, runtime_dir, **kwargs):
+        """
+        - shard_id / shards: índice deste shard e total de shards.
+        - handoff: socket Unix (SOCK_SEQPACKET) por onde chegam as conexões.
+        - runtime_dir: diretório dos sockets do barramento.
+        """
+        self.shard_id = shard_id
+        self.shards = shards
+        self.handoff = handoff
+        self.remote_presence = {}  # usuário de outro shard -> online/offline
+        super().__init__(**kwargs)
+        self.bus = ShardBus(shard_id, shards, runtime_dir, self.handle_bus_message)
+
+    def create_server_socket(self):
+        return None
+
+    def accept_connections(self):
+        """
+        Recebe do processo principal o descritor e o handshake de cada conexão.
+        Sem vaga (max_clients do shard), a conexão é recusada na hora: esperar
+        aqui travaria o repasse de conexões para todos os shards.
+        """
+        log.info("Shard %s aguardando conexões...", self.shard_id)
+        while True:
+            try:
+                data, fds, _, _ = socket.recv_fds(self.handoff, MAX_HANDSHAKE, 1)
+            except OSError as e:
+                log.error("Erro ao receber conexão no shard %s: %s", self.shard_id, e)
+                break
+            if not fds:
+                break  # Processo principal encerrado
+            client = socket.socket(fileno=fds[0])
+            if not self.connection_slots.acquire(False):
+                self.refuse(client)
+                continue
+            threading.Thread(target=self.serve_client, args=(client, data), daemon=True).start()
+
+    def owner(self, username):
+        return shard_for(username, self.shards)
+
+    def user_exists(self, username):
+        return username in self.sessions or username in self.remote_presence
+
+    def publish_presence(self, username, status):
+        super().publish_presence(username, status)
+        self.bus.broadcast({'type': 'presence', 'user': username, 'status': status})
+
+    def presence_of(self, username):
+        if self.owner(username) == self.shard_id:
+            return super().presence_of(username)
+        return 'online' if self.remote_presence.get(username) else 'offline'
+
+    def route_private_message(self, client, target_user, message):
+        """Mensagens para usuários de outro shard são entregues pelo shard dono."""
+        owner = self.owner(target_user)
+        if owner == self.shard_id:
+            super().route_private_message(client, target_user, message)
+            return
+        sender = self.sessions.username(client)
+        if not self.remote_presence.get(target_user) and self.over_rate_limit(sender, 'offline') is not None:
+            # O limite é do remetente: o shard dono não tem os baldes dele
+            self.send(client,
+                      f"Erro: Limite de mensagens offline excedido. A mensagem para {target_user} não foi enviada.")
+            return
+        # O histórico do remetente é gravado quando o shard dono confirmar a entrega (ver handle_bus_message)
+        self.bus.send(owner, {'type': 'deliver', 'sender': sender, 'target': target_user, 'message': message})
+
+    def channel_exists(self, channel):
+        # Cada shard conhece só os membros locais: entrar em um canal desconhecido o cria aqui
+        return True
+
+    def publish_to_channel(self, channel, text, exclude=None, message=None):
+        """Entrega aos membros locais e difunde a mensagem aos demais shards."""
+        stored = super().publish_to_channel(channel, text, exclude, message)
+        self.bus.broadcast({'type': 'channel', 'channel': channel, 'text': text, 'sender': exclude,
+                            'message': message})
+        return stored
+
+    def deliver(self, sender, target_user, message):
+        """
+        Entrega uma mensagem vinda de outro shard a um usuário local (ou a guarda
+        offline). Retorna (entregue, texto de confirmação para o remetente).
+        """
+        target = self.sessions.get(target_user)
+        if target is not None and target.online:
+            text = f"{sender} (privado): {message}"
+            if not self.send_to(target, text, spill_message=text):
+                return False, f"Erro: A mensagem para {target_user} não foi entregue. Tente novamente."
+            self.history.append(private_conversation(sender, target_user), sender, message)
+            return True, f"Você para ({target_user}): {message}"
+        self.offline_store.append(target_user, message).result(timeout=self.publish_timeout)
+        log.debug("Mensagem para %s armazenada na fila offline.", target_user)
+        self.history.append(private_conversation(sender, target_user), sender, message)
+        return True, f"Você (privado): {message}"
+
+    def handle_bus_message(self, message):
+        """Processa mensagens recebidas de outros shards."""
+        if message['type'] == 'deliver':
+            try:
+                delivered, confirmation = self.deliver(message['sender'], message['target'], message['message'])
+            except Exception as e:
+                log.warning("Erro ao entregar mensagem para %s: %s", message['target'], e)
+                delivered = False
+                confirmation = f"Erro: A mensagem para {message['target']} não foi entregue. Tente novamente."
+            self.bus.send(self.owner(message['sender']),
+                          {'type': 'confirm', 'user': message['sender'], 'target': message['target'],
+                           'message': message['message'], 'delivered': delivered, 'text': confirmation})
+
+        elif message['type'] == 'confirm':
+            if message['delivered']:
+                # Cada shard guarda o histórico dos seus usuários; o do destinatário já gravou a sua cópia
+                self.history.append(private_conversation(message['user'], message['target']),
+                                    message['user'], message['message'])
+            session = self.sessions.get(message['user'])
+            if session is not None:
+                self.send_to(session, message['text'])
+
+        elif message['type'] == 'channel':
+            self.fan_out(message['channel'], message['text'], exclude=message['sender'])
+            self.history.append(channel_conversation(message['channel']), message['sender'], message['message'])
+
+        elif message['type'] == 'presence':
+            if message['status'] is None:
+                self.remote_presence.pop(message['user'], None)
+            else:
+                self.remote_presence[message['user']] = message['status']
+            self.notify_followers(message['user'], message['status'])
+
+    def shutdown(self):
+        super().shutdown()
+        self.bus.close()
+
+
+def run_shard(shard_id, shards, handoff, runtime_dir, args):
+    """Ponto de entrada de cada processo shard (métricas na porta metrics_port + shard_id)."""
+    logs.setup_logging(args.log_level, args.log_sample)
+    data_dir = os.path.join(args.data_dir, f"shard-{shard_id}")
+    server = build_server(args, ShardServer, data_dir=data_dir, shard_id=shard_id, shards=shards,
+                          handoff=handoff, runtime_dir=runtime_dir, max_clients=-(-args.max_clients // shards))
+    if args.metrics_port is not None:
+        server.start_metrics(args.metrics_host, args.metrics_port + shard_id)
+    server.start()
+
+
+class ShardedServer:
+    """
+    Processo principal do modo multiprocesso: cria os shards, escuta a porta
+    pública e entrega cada conexão ao shard dono do usuário.
+    """
+
+    def __init__(self, args):
+        """- args: argumentos da linha de comando do servidor (args.workers = número de shards)."""
+        self.args = args
+        self.shards = args.workers
+        self.handoffs = []
+        self.processes = []
+        self.runtime_dir = tempfile.mkdtemp(prefix='chat-shards-')
+
+    def start(self):
+        """Inicia os shards e distribui as conexões até ser interrompido."""
+        # fork antes de criar qualquer thread ou o socket de escuta
+        context = multiprocessing.get_context('fork')
+        for shard_id in range(self.shards):
+            parent, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+            process = context.Process(target=run_shard, name=f"shard-{shard_id}",
+                                      args=(shard_id, self.shards, child, self.runtime_dir, self.args))
+            process.start()
+            child.close()
+            self.handoffs.append(parent)
+            self.processes.append(process)
+
+        logs.setup_logging(self.args.log_level, self.args.log_sample)
+        # SIGTERM também encerra os shards e limpa o diretório do barramento
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.args.host, self.args.port))
+        listener.listen()
+        log.info("Servidor iniciado em %s:%s com %s shards", self.args.host, self.args.port, self.shards)
+        try:
+            self.dispatch(listener)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            self.shutdown()
+
+    def dispatch(self, listener):
+        """Lê o handshake de cada conexão sem bloquear e a repassa ao shard do usuário."""
+        selector = selectors.DefaultSelector()
+        listener.setblocking(False)
+        selector.register(listener, selectors.EVENT_READ, None)
+        while True:
+            for key, _ in selector.select():
+                if key.data is None:
+                    try:
+                        conn, _ = listener.accept()
+                    except BlockingIOError:
+                        continue
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ, bytearray())
+                    continue
+
+                conn, buffer = key.fileobj, key.data
+                try:
+                    chunk = conn.recv(protocol.RECV_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b''
+                buffer += chunk
+                username = None
+                try:
+                    handshake = first_frame(buffer) if chunk else None
+                    if handshake is not None:
+                        username = protocol.parse_handshake(handshake)[0]
+                except (protocol.ProtocolError, ValueError):
+                    chunk = b''
+                if not chunk or (username is None and len(buffer) > MAX_HANDSHAKE):
+                    selector.unregister(conn)
+                    conn.close()
+                    continue
+                if username is None:
+                    continue
+
+                selector.unregister(conn)
+                conn.setblocking(True)
+                shard_id = shard_for(username, self.shards)
+                try:
+                    socket.send_fds(self.handoffs[shard_id], [bytes(buffer)], [conn.fileno()])
+                except OSError as e:
+                    log.warning("Erro ao repassar conexão ao shard %s: %s", shard_id, e)
+                conn.close()
+
+    def shutdown(self):
+        """Encerra os shards e remove os sockets do barramento."""
+        log.info("Encerrando o servidor...")
+        for handoff in self.handoffs:
+            handoff.close()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        shutil.rmtree(self.runtime_dir, ignore_errors=True)